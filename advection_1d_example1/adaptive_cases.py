@@ -0,0 +1,70 @@
+"""
+Choose the resolutions to run adaptively rather than from a fixed list:
+mx is sampled between 25 and 400 (uniformly in log(mx)) for order = 1 and 2,
+and new cases are added where the error at frame 2 changes most between
+neighboring cases, until it changes by less than a factor of 10**tol.
+
+Run this script via:
+
+    $ python adaptive_cases.py
+"""
+
+import os,sys
+from numpy import log10
+
+from convergence_cases import qtrue
+
+# for now use local versions:
+CLAW = os.environ['CLAW']
+sys.path.insert(0, CLAW + '/clawmultip/src/python/clawmultip')
+import multip_tools, clawmultip_tools, sweep_design, sweep_data, convergence
+sys.path.pop(0)
+
+
+def make_case(point):
+    """
+    Return the case to run for a *point* with values of 'mx' and 'order',
+    as in make_cases in run_cases_clawpack.py, but without plots.
+    """
+
+    case = dict(point)
+    case_name = 'order%s_mx%s' % (point['order'], str(point['mx']).zfill(4))
+    case['case_name'] = case_name
+    case['outdir'] = '_output_' + case_name
+    case['xclawcmd'] = 'xclaw'  # executable created by 'make .exe'
+    case['setrun_file'] = 'setrun_cases.py'
+    case['plotdir'] = None  # if None, will not make plots
+    return case
+
+
+def metric(case):
+    """
+    log10 of the L1 norm of the error at frame 2.
+    """
+
+    frame = sweep_data.read_frame(case['outdir'], 2)
+    patch = frame['patches'][0]
+    x = sweep_data.cell_centers(patch)[0]
+    e = patch['q'][0] - qtrue(x, frame['t'])
+    return log10(convergence.error_norms(e, patch['delta'])['L1'])
+
+
+if __name__ == '__main__':
+
+    # number of Clawpack jobs to run simultaneously:
+    nprocs = 4
+
+    space = {'mx': (25, 400, 'log'), 'order': [1, 2]}
+
+    def run_cases(caselist):
+        return multip_tools.run_many_cases_pool(caselist, nprocs,
+                        clawmultip_tools.run_one_case_clawpack, abort_time=0)
+
+    caselist, values = sweep_design.adaptive_sweep(space, make_case,
+                                run_cases, metric, num_initial=6, num_new=4,
+                                tol=0.25, max_cases=20, seed=1)
+
+    for case, value in sorted(zip(caselist, values),
+                              key=lambda cv: (cv[0]['order'], cv[0]['mx'])):
+        print('order = %i, mx = %4i:  log10(L1 error) = %7.3f' \
+                % (case['order'], case['mx'], value))
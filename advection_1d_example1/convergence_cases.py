@@ -0,0 +1,50 @@
+"""
+Compute the errors and observed convergence rates for the cases run by
+run_cases_clawpack.py, by comparing each case with the true solution.
+The error norms and rates for each order are written to
+convergence_table.txt.
+
+Run this script after run_cases_clawpack.py via:
+
+    $ python convergence_cases.py
+"""
+
+import os,sys
+from numpy import mod, exp, where, logical_and
+
+from run_cases_clawpack import make_cases
+
+# for now use local versions:
+CLAW = os.environ['CLAW']
+sys.path.insert(0, CLAW + '/clawmultip/src/python/clawmultip')
+import convergence
+sys.path.pop(0)
+
+# values set in setrun_cases.py:
+u = 1.0
+beta = 400.
+
+def qtrue(x,t):
+    """
+    The true solution, as in setplot_cases.py.
+    Should be consistent with the initial data specified in qinit.f90.
+    """
+    x0 = x - u*t
+    x0 = mod(x0, 1.)   # because of periodic boundary conditions
+    q = exp(-beta * (x0-0.75)**2)
+    q = where(logical_and(x0 > 0.1, x0 < 0.4), q+1, q)
+    return q
+
+
+if __name__ == '__main__':
+
+    # number of processes to use for computing errors:
+    nprocs = 4
+
+    caselist = make_cases()
+
+    # errors at output frames 1 and 2, with a convergence rate for
+    # each order:
+    convergence.convergence_study(caselist, frames=[1,2], qtrue=qtrue,
+                                  group_by=['order'], resolution_key='mx',
+                                  nprocs=nprocs)
@@ -0,0 +1,67 @@
+"""
+Run a resolution study as refinement ladders: for each order, mx is doubled
+from 25 up to at most 400, but a finer grid is only run if the maximum of q
+at frame 2 still changed by more than tol between the last two grids run.
+
+Run this script via:
+
+    $ python ladder_cases.py
+"""
+
+import os,sys
+
+# for now use local versions:
+CLAW = os.environ['CLAW']
+sys.path.insert(0, CLAW + '/clawmultip/src/python/clawmultip')
+import multip_tools, clawmultip_tools, sweep_data
+sys.path.pop(0)
+
+
+def make_cases():
+    """
+    Create the list of cases to be run, as in run_cases_clawpack.py but
+    without plots and with more resolutions.
+    """
+
+    caselist = []
+
+    for mx in [25,50,100,200,400]:
+        for order in [1,2]:
+            case = {}
+            outdir = '_output_order%s_mx%s' % (order, str(mx).zfill(4))
+            case_name = 'order%s_mx%s' % (order, str(mx).zfill(4))
+
+            case['case_name'] = case_name
+            case['outdir'] = outdir
+            case['xclawcmd'] = 'xclaw'  # executable created by 'make .exe'
+            case['setrun_file'] = 'setrun_cases.py'
+            case['order'] = order
+            case['mx'] = mx
+            case['plotdir'] = None  # if None, will not make plots
+
+            caselist.append(case)
+
+    return caselist
+
+
+def metric(case):
+    """
+    The maximum of q at frame 2.
+    """
+
+    frame = sweep_data.read_frame(case['outdir'], 2)
+    return frame['patches'][0]['q'][0].max()
+
+
+if __name__ == '__main__':
+
+    # number of Clawpack jobs to run simultaneously:
+    nprocs = 4
+
+    # one ladder of increasing mx for each order:
+    ladders = multip_tools.refinement_ladders(make_cases(),
+                                              resolution_key='mx')
+
+    run_one_case = clawmultip_tools.run_one_case_clawpack
+    results, summaries = multip_tools.run_refinement_ladders(ladders,
+                                nprocs, run_one_case, metric, tol=0.02)
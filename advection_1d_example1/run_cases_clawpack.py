@@ -9,7 +9,7 @@ import os,sys,shutil,pickle
 # for now use local versions:
 CLAW = os.environ['CLAW']
 sys.path.insert(0, CLAW + '/clawmultip/src/python/clawmultip')
-import multip_tools, clawmultip_tools
+import multip_tools, clawmultip_tools, results_index
 sys.path.pop(0)
 
 
@@ -37,6 +37,10 @@ def make_cases():
 
             #case['xclawcmd'] = None  # if None, will not run code
             case['xclawcmd'] = 'xclaw'  # executable created by 'make .exe'
+            #case['cache'] = True  # if True, skip runs already done
+            # run in node-local scratch space and move results to outdir,
+            # see scratch_staging.wait_for_transfers:
+            #case['scratch_dir'] = '/dev/shm'
 
             # setrun parameters:
             case['setrun_file'] = 'setrun_cases.py'
@@ -46,6 +50,11 @@ def make_cases():
             case['order'] = order
             case['mx'] = mx
 
+            # the classic 1d code always writes ascii output (out1.f), so
+            # 'binary' only applies to solvers that write binary output,
+            # see clawmultip/src/python/clawmultip/sweep_data.py:
+            case['output_format'] = 'ascii'
+
             #case['plotdir'] = None  # if None, will not make plots
             case['plotdir'] = outdir.replace('_output', '_plots')
             case['setplot_file'] = 'setplot_cases.py'
@@ -68,4 +77,11 @@ if __name__ == '__main__':
 
     # run all cases using nprocs processors:
     run_one_case = clawmultip_tools.run_one_case_clawpack
-    multip_tools.run_many_cases_pool(caselist, nprocs, run_one_case)
+    # progress is also written to sweep_status.json, which can be read with
+    #   python $CLAW/clawmultip/src/python/clawmultip/sweep_progress.py \
+    #          sweep_status.json
+    multip_tools.run_many_cases_pool(caselist, nprocs, run_one_case,
+                                     status_file='sweep_status.json')
+
+    # summary of all cases from the records in _case_index:
+    results_index.write_summary('_case_index', 'case_summary.txt')
@@ -37,6 +37,7 @@ def setrun(claw_pkg='classic', case={}):
 
     order = case['order']
     mx = case['mx']
+    output_format = case.get('output_format', 'ascii')
 
     num_dim = 1
     rundata = data.ClawRunData(claw_pkg, num_dim)
@@ -129,7 +130,7 @@ def setrun(claw_pkg='classic', case={}):
         clawdata.output_t0 = True  # output at initial (or restart) time?
 
 
-    clawdata.output_format = 'ascii'      # 'ascii' is only option currently
+    clawdata.output_format = output_format  # 'ascii' or 'binary', from case
 
     clawdata.output_q_components = 'all'   # could be list such as [True,True]
     clawdata.output_aux_components = 'none'  # could be list
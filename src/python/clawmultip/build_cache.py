@@ -0,0 +1,274 @@
+"""
+Build the executables needed by a sweep over compile-time variants, e.g.
+different Riemann solvers, FFLAGS, or OpenMP on or off.
+
+A case that sets case['make_vars'], a dictionary of make variables such as
+    case['make_vars'] = {'FFLAGS': '-O2 -fopenmp'}
+is run with an executable built by
+    make .exe FFLAGS='-O2 -fopenmp'
+using the Makefile in case['build_dir'] (default '.').  Any variable of the
+Makefile can be set, e.g. SOURCES to use a different Riemann solver.
+
+build_executables(caselist, nprocs) finds the distinct build variants in
+caselist and compiles each one once, with up to nprocs builds at a time,
+and then sets case['xclawcmd'] of each case to the executable of its
+variant.  Call it before run_many_cases_pool, e.g.
+
+    build_cache.build_executables(caselist, nprocs)
+    multip_tools.run_many_cases_pool(caselist, nprocs, run_one_case)
+
+Each variant is built in its own directory in case['build_cache_dir']
+(default '_clawmultip_builds'), named by a hash of the make variables, the
+Makefile and the contents of all the source files (including the Clawpack
+library sources), so a variant is only compiled again if one of these has
+changed.  The sources are copied into the build directory so that the
+object files of different variants (which Clawpack otherwise puts next to
+the library sources in $CLAW) do not overwrite each other.  They are
+copied without their directories, so the sources of a variant must have
+distinct file names (as make would otherwise put two object files in the
+same place too).
+"""
+
+import os, json, shutil, hashlib, subprocess
+
+# environment variables that affect the build:
+build_env_vars = ['FC', 'FFLAGS', 'LFLAGS', 'PPFLAGS', 'CLAW']
+
+# files in build_dir that are copied in addition to the sources, e.g. files
+# included by the Fortran code:
+extra_file_extensions = ['.h', '.i', '.inc']
+
+
+def build_variant(case):
+    """
+    Return the build variant of *case*, a tuple (build_dir, make_vars)
+    where make_vars is a sorted tuple of (name, value), or None if the case
+    does not set case['make_vars'].
+    """
+
+    if case.get('make_vars', None) is None:
+        return None
+    build_dir = os.path.abspath(case.get('build_dir', '.'))
+    make_vars = tuple(sorted([(str(k), str(v))
+                              for k, v in case['make_vars'].items()]))
+    return (build_dir, make_vars)
+
+
+def make_command(target, make_vars, evals=[]):
+    """
+    Return the make command for *target* as a list, setting the variables
+    in *make_vars* (a list of (name, value)).
+    """
+
+    cmd = ['make', '-s', '--no-print-directory']
+    for text in evals:
+        cmd.append('--eval=%s' % text)
+    cmd.append(target)
+    cmd = cmd + ['%s=%s' % (name, value) for name, value in make_vars]
+    return cmd
+
+
+def variant_sources(build_dir, make_vars):
+    """
+    Return the lists (sources, modules) of the source files compiled for
+    the variant, as full paths, including the Clawpack library sources.
+
+    The Makefile in *build_dir* sets SOURCES and MODULES to the files of
+    the application and includes Makefiles that set COMMON_SOURCES and
+    COMMON_MODULES to the library files.  Makefile.common combines the two
+    into ALL_SOURCES and ALL_MODULES, or (in some Clawpack versions) back
+    into SOURCES and MODULES, so make is asked for ALL_SOURCES and
+    ALL_MODULES and for SOURCES and MODULES if these are not set.
+    """
+
+    names = ['ALL_SOURCES', 'ALL_MODULES', 'SOURCES', 'MODULES']
+    rule = '_clawmultip_sources:' + ''.join(['\n\t@echo %s $(%s)'
+                                             % (name, name) for name in names])
+    output = subprocess.check_output(make_command('_clawmultip_sources',
+                                                  make_vars, [rule]),
+                                     cwd=build_dir, text=True)
+    lists = dict([(name, []) for name in names])
+    for line in output.splitlines():
+        tokens = line.split()
+        if tokens and tokens[0] in lists:
+            lists[tokens[0]] = [os.path.join(build_dir, fname)
+                                for fname in tokens[1:]]
+    if not lists['ALL_SOURCES']:
+        return lists['SOURCES'], lists['MODULES']
+    return lists['ALL_SOURCES'], lists['ALL_MODULES']
+
+
+def variant_hash(build_dir, make_vars, sources, modules):
+    """
+    Return a hash of everything that determines the executable of a variant.
+    """
+
+    h = hashlib.sha256()
+    h.update(('make_vars:%s\n' % repr(make_vars)).encode())
+    for name in build_env_vars:
+        h.update(('%s=%s\n' % (name, os.environ.get(name, ''))).encode())
+    files = [os.path.join(build_dir, 'Makefile')] + modules + sources
+    files = files + _extra_files(build_dir)
+    for fname in files:
+        h.update(('file:%s\n' % os.path.basename(fname)).encode())
+        with open(fname, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def _extra_files(build_dir):
+    return sorted([os.path.join(build_dir, fname)
+                   for fname in os.listdir(build_dir)
+                   if os.path.splitext(fname)[1] in extra_file_extensions])
+
+
+def _same_basename(files):
+    """
+    Return the files in *files* that have the same file name as another,
+    different, file (the same file listed twice is not a clash).
+    """
+
+    paths = {}
+    for fname in files:
+        paths.setdefault(os.path.basename(fname), set()).add(
+                os.path.realpath(fname))
+    return sorted([path for name in paths if len(paths[name]) > 1
+                   for path in paths[name]])
+
+
+def _build_one(build):
+    """
+    Copy the sources of one variant into a new directory and compile it.
+    *build* is a dictionary with the 'build_dir', 'make_vars', 'sources',
+    'modules', 'exe' and the final directory 'path'.
+    Returns (path, None) on success or (path, error message).
+    """
+
+    path = build['path']
+    files = build['modules'] + build['sources'] \
+            + _extra_files(build['build_dir'])
+    clashes = _same_basename(files)
+    if clashes:
+        return path, 'sources with the same file name for %s: %s' \
+                % (build['build_dir'], ', '.join(clashes))
+
+    tmp_path = '%s.tmp%i' % (path, os.getpid())
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    shutil.copy2(os.path.join(build['build_dir'], 'Makefile'), tmp_path)
+    for fname in files:
+        shutil.copy2(fname, tmp_path)
+
+    # all the sources are the copies, so no object files are written next
+    # to the library sources:
+    local = lambda files: ' '.join([os.path.basename(f) for f in files])
+    make_vars = list(build['make_vars']) \
+                + [('SOURCES', local(build['sources'])),
+                   ('MODULES', local(build['modules'])),
+                   ('ALL_SOURCES', local(build['sources'])),
+                   ('ALL_MODULES', local(build['modules'])),
+                   ('COMMON_SOURCES', ''), ('COMMON_MODULES', ''),
+                   ('EXCLUDE_SOURCES', ''), ('EXCLUDE_MODULES', '')]
+    cmd = ['make', '.exe'] + ['%s=%s' % var for var in make_vars]
+
+    with open(os.path.join(tmp_path, 'build_log.txt'), 'w') as log:
+        log.write(' '.join(cmd) + '\n\n')
+        log.flush()
+        status = subprocess.call(cmd, cwd=tmp_path, stdout=log,
+                                 stderr=subprocess.STDOUT)
+
+    if status != 0 or not os.path.isfile(os.path.join(tmp_path,
+                                                      build['exe'])):
+        return path, 'make failed, see %s/build_log.txt' % tmp_path
+
+    with open(os.path.join(tmp_path, 'build_info.json'), 'w') as f:
+        json.dump({'build_dir': build['build_dir'],
+                   'make_vars': dict(build['make_vars']),
+                   'exe': build['exe'],
+                   'sources': build['modules'] + build['sources']},
+                  f, indent=1)
+
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # built at the same time by another sweep:
+        shutil.rmtree(tmp_path)
+    return path, None
+
+
+def build_executables(caselist, nprocs=1, verbose=True):
+    """
+    Build the executable for every build variant in *caselist* that is not
+    already in the cache, running up to *nprocs* builds at once, and set
+    case['xclawcmd'] for each case with case['make_vars'] to the executable
+    of its variant.  Cases without case['make_vars'] are not changed.
+
+    Raises a RuntimeError listing the variants that failed to build, after
+    all builds are done.  Returns a dictionary with the build directory of
+    each variant, keyed on (variant, cache_dir) where variant is as
+    returned by build_variant and cache_dir is the absolute path of
+    case['build_cache_dir'], since cases of the same variant can use
+    different caches.
+    """
+
+    from multiprocessing.pool import ThreadPool
+
+    def build_key(case):
+        variant = build_variant(case)
+        if variant is None:
+            return None
+        cache_dir = os.path.abspath(case.get('build_cache_dir',
+                                             '_clawmultip_builds'))
+        return (variant, cache_dir)
+
+    variants = []
+    for case in caselist:
+        key = build_key(case)
+        if key is not None and key not in variants:
+            variants.append(key)
+
+    def find_build(key):
+        (build_dir, make_vars), cache_dir = key
+        sources, modules = variant_sources(build_dir, make_vars)
+        h = variant_hash(build_dir, make_vars, sources, modules)
+        return {'build_dir': build_dir, 'make_vars': make_vars,
+                'sources': sources, 'modules': modules,
+                'exe': dict(make_vars).get('EXE', 'xclaw'),
+                'path': os.path.join(cache_dir, h[:16])}
+
+    # the builds run in subprocesses, so threads are enough here:
+    with ThreadPool(processes=max(1, nprocs)) as pool:
+
+        builds = dict(zip(variants,
+                          pool.map(find_build, variants, chunksize=1)))
+
+        todo = [build for build in builds.values()
+                if not os.path.isfile(os.path.join(build['path'],
+                                                   'build_info.json'))]
+        if verbose:
+            print("%i build variants, %i already built, building %i" \
+                    % (len(builds), len(builds) - len(todo), len(todo)))
+
+        for build in todo:
+            os.makedirs(os.path.dirname(build['path']), exist_ok=True)
+        results = pool.map(_build_one, todo, chunksize=1)
+
+    failed = [(path, message) for path, message in results
+              if message is not None]
+    for path, message in results:
+        if verbose and message is None:
+            print("Built %s" % path)
+
+    for case in caselist:
+        key = build_key(case)
+        if key is not None:
+            build = builds[key]
+            case['xclawcmd'] = os.path.join(build['path'], build['exe'])
+
+    if failed:
+        raise RuntimeError("%i builds failed:\n%s" % (len(failed),
+                '\n'.join(['    %s' % message for path, message in failed])))
+
+    return dict([(key, build['path']) for key, build in builds.items()])
@@ -2,10 +2,54 @@
 The function run_one_case_clawpack defined in this module can be used when
 calling mulitp_tools.run_many_cases_pool, along with a list of cases,
 in order to perform a parameter sweep using Clawpack.
+
+For sweeps of many small cases, pass
+    initializer=clawmultip_tools.init_worker_clawpack
+to run_many_cases_pool so that each worker process imports the Clawpack and
+plotting modules once, rather than when it runs its first case.
+The setrun and setplot modules are loaded once per worker process
+(and again only if the file changes), see load_module_cached.
+The setup time of each case is returned by run_one_case_clawpack,
+see report_setup_time.
+
+To run Clawpack and make plots in separate pools of processes, so that
+plotting of finished cases overlaps with running the next cases, use
+    multip_tools.run_many_cases_pipeline(caselist, nprocs_run, nprocs_plot,
+                                         run_stage_clawpack,
+                                         plot_stage_clawpack)
+
+Each case is recorded in a JSON file in case['index_dir'] (by default
+'_case_index'), see results_index.py for querying these records.
+
+To remake the plots of a sweep that has already been run, when there are
+few cases with many frames or many cases with few frames, use
+    plot_many_cases_frames(caselist, nprocs)
+which plots all frames of all cases with one pool of processes.
 """
 
+import os, sys, threading
+
+# other modules in this directory:
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import results_index, frame_fingerprints, fast_frames, scratch_staging
+import resource_usage, sweep_archive
+sys.path.pop(0)
+
+# modules imported by init_worker_clawpack, shared by all cases
+# run in this process:
+_worker_modules = {}
+
+# setrun and setplot modules loaded by load_module_cached,
+# keyed on (path, mtime):
+_module_cache = {}
+
+# plotdata and frame numbers of each case for plot_many_cases_frames,
+# inherited by the forked worker processes since plotdata may contain
+# functions that cannot be pickled:
+_sweep_plots = {}
 
-def run_one_case_clawpack(case):
+
+def run_one_case_clawpack(case, run=True, plot=True):
     """
     Code to run a specific case and/or plot the results using Clawpack.
     This function can be pased in to multip_tools.run_many_cases_pool
@@ -58,37 +102,105 @@ def run_one_case_clawpack(case):
         case['redirect_python'] = True/False. Redirect stdout to a file
                                   case['outdir'] + '/python_output.txt'
                                   (Default is True)
+        case['cache'] = True/False. If True, do not rerun Clawpack when
+                        the .data files, executable and setrun file are
+                        identical to those of a run that already completed,
+                        see case_cache_key.  (Default is False)
+        case['output_format'] = 'ascii', 'binary', 'binary64' or 'binary32',
+                                the format of the output files.  This is
+                                passed to plotclaw so the frames are read
+                                in the right format, and should also be
+                                used in setrun to set
+                                clawdata.output_format.  (Default 'ascii')
+        case['stream_plots'] = True/False.  If True (and both running and
+                               plotting), each frame is plotted as soon as
+                               the Fortran code has written it, while the
+                               run continues.  The html and latex index
+                               files are made at the end.  (Default False)
+        case['fast_plots'] = True/False.  If True, 1d frame plots are made
+                             by updating the data in figures that are
+                             created only once, see fast_frames.py.
+                             (Default False)
+        case['incremental_plots'] = True/False.  If True, only the frames
+                                    and figures whose output, setplot file
+                                    or setplot settings have changed since
+                                    they were last plotted are replotted,
+                                    see frame_fingerprints.py.
+                                    (Default False)
+        case['plot_keys'] = list of other case parameters that affect the
+                            plots, for incremental_plots.  (Default [])
+        case['index_dir'] = directory in which a JSON record of this case
+                            is written, see results_index.py.
+                            (Default is '_case_index')
+        case['cache_dir'] = directory where completed runs are registered
+                            by their cache key, so that output can be
+                            hard-linked from another outdir.
+                            (Default is '_clawmultip_cache')
+        case['make_vars'] = dictionary of make variables, e.g. FFLAGS, for
+                            sweeps over compile-time variants.  Set
+                            case['xclawcmd'] by calling
+                            build_cache.build_executables(caselist) before
+                            running the cases, see build_cache.py.
+                            (case['build_dir'] and case['build_cache_dir']
+                            are also used there.)
+        case['scratch_dir'] = node-local directory, e.g. '/dev/shm' or
+                              '$TMPDIR', in which to run the case.  The
+                              results are moved to outdir and plotdir by a
+                              background process when the case is done,
+                              replacing any earlier ones, see
+                              scratch_staging.py.  (Default None)
+        case['scratch_limit'] = bytes, or a string such as '2G'.  Wait
+                                before starting the case until less than
+                                this is used in scratch_dir.  (Default None)
 
         In addition, add any other parameters to the case dictionary that
         you want to have available in setrun and/or setplot.
 
+    The optional arguments *run* and *plot* can be set to False to skip
+    running Clawpack or making plots regardless of the case, as done by
+    run_stage_clawpack and plot_stage_clawpack.  When plot is done
+    separately in this way, its Python output goes to
+    case['outdir'] + '/python_output_plots.txt'.
+
+    The wall time, CPU time, peak memory and bytes written of each phase
+    (setrun, writing the .data files, running Clawpack and plotting) are
+    recorded in the results index, see resource_usage.py.
+
+    Returns a dictionary with 'setup_time', the time in seconds spent
+    importing modules and loading setrun and setplot for this case.
+
     """
 
     import multip_tools
     import os,sys,shutil,pickle
     import inspect
     import datetime
-    import importlib
+    import time
     from multiprocessing import current_process
-    from clawpack.clawutil.runclaw import runclaw
 
-    #from clawpack.visclaw.plotclaw import plotclaw
-    # for now use local version:
-    import os,sys
-    CLAW = os.environ['CLAW']
-    sys.path.insert(0, CLAW + '/clawmultip/src/python/clawmultip')
-    from plotclaw import plotclaw
-    sys.path.pop(0)
+    t_setup = time.time()
+
+    # does nothing if already done in this process:
+    init_worker_clawpack()
+    runclaw = _worker_modules['runclaw']
+    plotclaw = _worker_modules['plotclaw']
+    plotclaw_streaming = _worker_modules['plotclaw_streaming']
+
+    setup_time = time.time() - t_setup
+    timings = {}  # time of each phase, for the results index
+    usage = {}  # resources used by each phase, see resource_usage.py
+    plot_phase = None
+    stream_phase = None
 
     p = current_process()
 
     # unpack the dictionary case to get parameters for this case:
 
     xclawcmd = case.get('xclawcmd', None)
-    run_clawpack = xclawcmd is not None
+    run_clawpack = (xclawcmd is not None) and run
 
     plotdir = case.get('plotdir', None)
-    make_plots = plotdir is not None
+    make_plots = (plotdir is not None) and plot
 
     case_name = case['case_name']
     outdir = case['outdir']
@@ -102,6 +214,48 @@ def run_one_case_clawpack(case):
 
     redirect_python = case.get('redirect_python', True) # sent stdout to file
 
+    output_format = case.get('output_format', 'ascii')  # fort.q format
+
+    # only replot frames that have changed:
+    incremental_plots = case.get('incremental_plots', False)
+
+    index_dir = case.get('index_dir', '_case_index')  # JSON case records
+
+    use_cache = case.get('cache', False)  # skip runs already done
+    cache_dir = case.get('cache_dir', '_clawmultip_cache')
+
+    # plot frames while the code is still running:
+    stream_plots = case.get('stream_plots', False) and run_clawpack \
+                    and make_plots
+    run_thread = None
+
+    # run in node-local scratch space and move the results afterwards:
+    scratch_dir = case.get('scratch_dir', None)
+    staged = (scratch_dir is not None) and run_clawpack
+    transfer_cache_key = None  # registered once the results are moved
+
+    if (scratch_dir is not None) and (not run):
+        # the output of the run stage may still be on its way:
+        scratch_staging.wait_for_transfer(index_dir, case_name)
+
+    if staged:
+        scratch_limit = case.get('scratch_limit', None)
+        if scratch_limit is not None:
+            timings['scratch_wait'] = scratch_staging.wait_for_scratch(
+                        scratch_staging.scratch_root(scratch_dir),
+                        scratch_limit)
+        stage_dir, outdir, plotdir = scratch_staging.stage_dirs(case)
+        print('Running case %s in %s' % (case_name, stage_dir))
+        # case as seen by setrun and setplot:
+        run_case = dict(case, outdir=outdir, plotdir=plotdir)
+    else:
+        run_case = case
+
+    # output archived by sweep_archive.archive_case, to be plotted:
+    restored_codec = None
+    if (not run_clawpack) and make_plots:
+        restored_codec = _restore_archived_outdir(outdir)
+
 
     if os.path.isdir(outdir):
         print('overwrite = %s and outdir already exists: %s' \
@@ -124,13 +278,20 @@ def run_one_case_clawpack(case):
 
 
     if redirect_python:
-        stdout_fname = outdir + '/python_output.txt'
+        if run:
+            stdout_fname = outdir + '/python_output.txt'
+        else:
+            # don't overwrite the output from the run stage:
+            stdout_fname = outdir + '/python_output_plots.txt'
         try:
             stdout_file = open(stdout_fname, 'w')
             message = "Python output from this run will go to\n   %s\n" \
                                 % stdout_fname
         except:
             print(message)
+            if restored_codec is not None:
+                sweep_archive.archive_outdir(outdir, restored_codec,
+                                             case.get('archive_level', None))
             raise Exception("Cannot open file %s" % stdout_fname)
 
 
@@ -142,110 +303,749 @@ def run_one_case_clawpack(case):
         sys.stderr = stdout_file
         print(message)
 
-    # write out all case parameters:
-    fname = os.path.join(outdir, 'case_info.txt')
-    with open(fname,'w') as f:
-        f.write('----------------\n%s\n' % timenow)
-        f.write('case %s\n' % case['case_name'])
-        for k in case.keys():
-            f.write('%s:  %s\n' % (k.ljust(20), case[k]))
-    print('Created %s' % fname)
-
-    # pickle case dictionary for reloading later:
-    fname = os.path.join(outdir, 'case_info.pkl')
-    with open(fname, 'wb') as f:
-        pickle.dump(case, f)
-    print('Created %s' % fname)
-
-    # global summary file:
-    fname = 'case_summary.txt'
-    with open(fname,'a') as f:
-        f.write('=========\n%s\n\ncase_name: %s\n' % (timenow,case['case_name']))
-        for k in case.keys():
-            if k != 'case_name':
+    try:
+        # write out all case parameters:
+        fname = os.path.join(outdir, 'case_info.txt')
+        with open(fname,'w') as f:
+            f.write('----------------\n%s\n' % timenow)
+            f.write('case %s\n' % case['case_name'])
+            for k in case.keys():
                 f.write('%s:  %s\n' % (k.ljust(20), case[k]))
+        print('Created %s' % fname)
+
+        # pickle case dictionary for reloading later:
+        fname = os.path.join(outdir, 'case_info.pkl')
+        with open(fname, 'wb') as f:
+            pickle.dump(case, f)
+        print('Created %s' % fname)
+
+        # record of this case in the index shared by all cases
+        # (replaces the global case_summary.txt, which can be created
+        # at the end with results_index.write_summary):
+        if run:
+            results_index.write_record(index_dir,
+                                       results_index.new_record(case))
+        else:
+            # plot stage of a case that was already run:
+            results_index.update_record(index_dir, case_name,
+                                        {'status': 'running',
+                                         'pid': p.pid}, case)
+
+
+        if run_clawpack:
+
+            t_run = time.time()
+
+            with resource_usage.Phase(usage, 'setrun'):
+
+                # initialize rundata using specified setrun file:
+                t_setup = time.time()
+                setrun = load_module_cached(setrun_file, 'setrun')
+                setup_time += time.time() - t_setup
+
+                # The setrun function may have been modified to accept an
+                # argument `case` so that the dictionary of parameters can be
+                # passed in:
+
+                if 'case' in inspect.signature(setrun.setrun).parameters:
+                    rundata = setrun.setrun(case=run_case)
+                else:
+                    print('*** Warning: setrun does not support case ' \
+                          + 'parameter:', '    setrun_file = %s' % setrun_file)
+                    rundata = setrun.setrun()
+
+            # write .data files in outdir:
+            with resource_usage.Phase(usage, 'write'):
+                rundata.write(outdir)
+
+            # Run the clawpack executable
+            if not os.path.isfile(xclawcmd):
+                raise Exception('Executable %s not found' % xclawcmd)
+
+            cache_hit = False
+            if use_cache:
+                cache_key = case_cache_key(outdir, xclawcmd, setrun_file,
+                                           runexe)
+                print('cache key: %s' % cache_key)
+                cache_hit = use_cached_output(cache_key, outdir, cache_dir)
+
+            if cache_hit:
+                print('Output for this cache key exists, not running %s' \
+                        % xclawcmd)
+            else:
+                if use_cache:
+                    # so a run that does not complete is never taken as cached:
+                    cache_key_file = os.path.join(outdir, 'cache_key.txt')
+                    if os.path.isfile(cache_key_file):
+                        os.remove(cache_key_file)
+
+                # redirect output and error messages:
+                outfile = os.path.join(outdir, 'fortran_output.txt')
+                print('Fortran output will be redirected to\n    ', outfile)
+
+                # Use data from rundir=outdir, which was just written above...
+                runclaw_kwargs = dict(xclawcmd=xclawcmd, outdir=outdir,
+                                      overwrite=overwrite, rundir=outdir,
+                                      nohup=nohup, runexe=runexe,
+                                      xclawout=outfile, xclawerr=outfile)
+
+                if stream_plots:
+                    # frames are plotted below while this runs:
+                    stream_phase = resource_usage.Phase(usage, 'runclaw_plot',
+                                                        children=True).start()
+                    run_thread = RunclawThread(runclaw, runclaw_kwargs)
+                    run_thread.start()
+                else:
+                    with resource_usage.Phase(usage, 'runclaw',
+                                              children=True):
+                        runclaw(**runclaw_kwargs)
+
+                    if use_cache and staged:
+                        transfer_cache_key = cache_key
+                    elif use_cache:
+                        register_cached_output(cache_key, outdir, cache_dir)
+
+            timings['run_time'] = time.time() - t_run
+
+        if make_plots:
+
+            t_plot = time.time()
+            if stream_phase is None:
+                plot_phase = resource_usage.Phase(usage, 'plot').start()
+
+            # initialize plotdata using specified setplot file:
+            t_setup = time.time()
+            setplot = load_module_cached(setplot_file, 'setplot')
+            setup_time += time.time() - t_setup
+
+            plotdata = case_plotdata(setplot, run_case)
+
+            # note that setplot can also be modified to return None if the
+            # user does not want to make frame plots (setplot can explicitly
+            # make other plots or do other post-processing)
+
+            if plotdata is not None:
+                # user wants to make time frame plots using plotclaw:
+                plotdata.outdir = outdir
+                plotdata.plotdir = plotdir
+                plotdata.format = output_format
+                if case.get('fast_plots', False):
+                    plotdata.add_attribute('fast_frames', True)
+
+                if run_thread is not None:
+                    try:
+                        plotclaw_streaming(outdir, plotdir, plotdata,
+                                           running=run_thread.is_alive,
+                                           format=output_format,
+                                           incremental=incremental_plots,
+                                           case=run_case)
+                    finally:
+                        run_thread.join()
+                else:
+                    # modified plotclaw is needed in order to pass plotdata:
+                    plotclaw(outdir, plotdir, setplot, plotdata=plotdata,
+                             format=output_format,
+                             incremental=incremental_plots,
+                             case=run_case)
+            else:
+                # assume setplot already made any plots desired by user,
+                # e.g. fgmax, fgout, or specialized gauge plots.
+                print('plotdata is None, so not making frame plots')
+
+            timings['plot_time'] = time.time() - t_plot
+            if plot_phase is not None:
+                plot_phase.stop()
+
+        if run_thread is not None:
+            run_thread.join()
+            stream_phase.stop()
+            if run_thread.error is not None:
+                raise run_thread.error
+            if use_cache and staged:
+                transfer_cache_key = cache_key
+            elif use_cache:
+                register_cached_output(cache_key, outdir, cache_dir)
+            # run and plot overlapped:
+            timings['run_time'] = time.time() - t_run
+
+        #timenow = datetime.datetime.today().strftime('%Y-%m-%d at %H:%M:%S')
+        timenow = datetime.datetime.utcnow().strftime('%Y-%m-%d at %H:%M:%S') \
+                    + ' UTC'
+        message = "Process %i completed case %s at %s\n" \
+                    % (p.pid, case_name, timenow)
+        print('Setup time (imports, setrun, setplot): %.3f seconds' \
+                % setup_time)
+        print(message)
 
+        timings['setup_time'] = setup_time
+        updates = {'status': 'done',
+                   'finished': results_index.timenow(),
+                   'timings': timings,
+                   'usage': usage}
+        if staged:
+            updates['transfer'] = 'pending'
+        results_index.update_record(index_dir, case_name, updates)
+
+    except Exception as err:
+        # make sure the error also appears in python_output.txt:
+        import traceback
+        traceback.print_exc()
+        for phase in [plot_phase, stream_phase]:
+            if phase is not None:
+                phase.stop()  # only if not already stopped
+        updates = {'status': 'failed',
+                   'finished': results_index.timenow(),
+                   'timings': timings,
+                   'usage': usage,
+                   'error': repr(err)}
+        if staged:
+            # move the logs anyway, to see what went wrong:
+            updates['transfer'] = 'pending'
+        results_index.update_record(index_dir, case_name, updates)
+        raise
+
+    finally:
+        if redirect_python:
+            stdout_file.close()
+            # Fix stdout again
+            sys.stdout = sys_stdout
+            sys.stderr = sys_stderr
+        if staged:
+            # after python_output.txt is closed, so it is moved complete:
+            scratch_staging.start_transfer(case, stage_dir,
+                                           transfer_cache_key)
+        if restored_codec is not None:
+            # put the outdir back in its archive, even if plotting failed,
+            # with any python_output_plots.txt (the plots are in plotdir):
+            sweep_archive.archive_outdir(outdir, restored_codec,
+                                         case.get('archive_level', None))
 
-    if run_clawpack:
+    if redirect_python:
+        print(message) # to screen
 
-        # initialize rundata using specified setrun file:
-        spec = importlib.util.spec_from_file_location('setrun',setrun_file)
-        setrun = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(setrun)
+    return {'setup_time': setup_time}
 
-        # The setrun function may have been modified to accept an argument
-        # `case` so that the dictionary of parameters can be passed in:
 
-        if 'case' in inspect.signature(setrun.setrun).parameters.keys():
-            rundata = setrun.setrun(case=case)
-        else:
-            print('*** Warning: setrun does not support case parameter: ', \
-                    '    setrun_file = %s' % setrun_file)
-            rundata = setrun.setrun()
+def _restore_archived_outdir(outdir):
+    """
+    If *outdir* has been archived by sweep_archive.archive_case (and so
+    removed), extract the archive into outdir so the output can be plotted.
+    Returns the codec of the archive, to archive outdir again with
+    sweep_archive.archive_outdir once the plots are made, or None if there
+    is no archive to extract.
+    """
 
-        # write .data files in outdir:
-        rundata.write(outdir)
+    import os
 
-        # Run the clawpack executable
-        if not os.path.isfile(xclawcmd):
-            raise Exception('Executable %s not found' % xclawcmd)
+    archive = sweep_archive.archive_name(outdir)
+    if os.path.isdir(outdir) or not os.path.isfile(archive):
+        return None
+    codec = sweep_archive.archive_codec(archive)
+    sweep_archive.extract_archive(outdir)
+    print('Extracted %s to plot it' % archive)
+    return codec
 
-        # redirect output and error messages:
-        outfile = os.path.join(outdir, 'fortran_output.txt')
-        print('Fortran output will be redirected to\n    ', outfile)
 
-        # Use data from rundir=outdir, which was just written above...
-        runclaw(xclawcmd=xclawcmd, outdir=outdir, overwrite=overwrite,
-                rundir=outdir, nohup=nohup, runexe=runexe,
-                xclawout=outfile, xclawerr=outfile)
+class RunclawThread(threading.Thread):
+    """
+    Thread that calls runclaw(**runclaw_kwargs), used when
+    case['stream_plots'] is True so that frames can be plotted in the
+    main thread while the Clawpack executable is running.
+    Any exception raised by runclaw is saved as *error*.
+
+    Plotting changes the working directory of the process (see
+    clawpack.visclaw.plotpages.cd_plotdir), so the directories and files
+    in *runclaw_kwargs* are made absolute here, before the thread starts.
+    """
 
-    if make_plots:
+    def __init__(self, runclaw, runclaw_kwargs):
+        threading.Thread.__init__(self)
+        self.runclaw = runclaw
+        self.runclaw_kwargs = dict(runclaw_kwargs)
+        if self.runclaw_kwargs.get('rundir', None) is None:
+            self.runclaw_kwargs['rundir'] = os.getcwd()
+        for key in ['xclawcmd', 'outdir', 'rundir', 'xclawout', 'xclawerr']:
+            if isinstance(self.runclaw_kwargs.get(key, None), str):
+                self.runclaw_kwargs[key] = \
+                        os.path.abspath(self.runclaw_kwargs[key])
+        self.error = None
+
+    def run(self):
+        try:
+            self.runclaw(**self.runclaw_kwargs)
+        except Exception as err:
+            self.error = err
 
-        # initialize plotdata using specified setplot file:
-        spec = importlib.util.spec_from_file_location('setplot',setplot_file)
-        setplot = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(setplot)
 
-        # The setplot function may have been modified to accept an argument
-        # `case` so that the dictionary of parameters can be passed in:
+def run_stage_clawpack(case):
+    """
+    Run Clawpack for *case* but do not make plots, the first stage for
+    multip_tools.run_many_cases_pipeline.
+    """
 
-        if 'case' in inspect.signature(setplot.setplot).parameters.keys():
-            plotdata = setplot.setplot(plotdata=None,case=case)
-        else:
-            print('*** Warning: setplot does not support case parameter: ', \
-                    '    setplot_file = %s' % setplot_file)
-            plotdata = setplot.setplot(plotdata=None)
+    return run_one_case_clawpack(case, plot=False)
+
+
+def plot_stage_clawpack(case):
+    """
+    Make plots for *case* from existing output without running Clawpack,
+    the second stage for multip_tools.run_many_cases_pipeline.
+    """
+
+    return run_one_case_clawpack(case, run=False)
+
+
+def case_plotdata(setplot, case):
+    """
+    Return the plotdata for *case* from the setplot module *setplot*.
+
+    The setplot function may have been modified to accept an argument
+    `case` so that the dictionary of parameters can be passed in.
+    """
+
+    import inspect
 
+    if 'case' in inspect.signature(setplot.setplot).parameters.keys():
+        plotdata = setplot.setplot(plotdata=None,case=case)
+    else:
+        print('*** Warning: setplot does not support case parameter:', \
+                '    setplot_file = %s' % setplot.__file__)
+        plotdata = setplot.setplot(plotdata=None)
+    return plotdata
 
-        # note that setplot can also be modified to return None if the
-        # user does not want to make frame plots (setplot can explicitly
-        # make other plots or do other post-processing)
 
-        if plotdata is not None:
-            # user wants to make time frame plots using plotclaw:
-            plotdata.outdir = outdir
-            plotdata.plotdir = plotdir
+def plot_many_cases_frames(caselist, nprocs, abort_time=5, verbose=True):
+    """
+    Make the plots for every case in *caselist* from existing output, using
+    a single pool of *nprocs* processes for all frames of all cases.
+
+    Plotting one case per process leaves processes idle when there are few
+    cases with many frames, and plotting the frames of one case at a time
+    in parallel (plotdata.parallel) leaves them idle when there are many
+    cases with few frames.  Here every (case, frame) pair is a separate task,
+    handed out one at a time in case order.  As soon as all frames of a case
+    are done, the html and latex index files (and any gauge plots) for that
+    case are made by the next free process.  If case['incremental_plots']
+    is True, only the frames and figures that are out of date are
+    replotted, see frame_fingerprints.py.
+
+    Only case['outdir'], case['plotdir'], case['setplot_file'] and
+    case['output_format'] are used, Clawpack is not run.  An outdir that
+    has been archived by sweep_archive.archive_case is extracted just
+    before its frames are plotted and archived again once its index files
+    are made, so only the cases being plotted are extracted at a time
+    (and briefly each case before plotting starts, to find the frames to
+    plot).  The plot time and
+    status of each case are recorded in case['index_dir'] (see
+    results_index.py).
+
+    Returns a list with a dictionary for each case with keys 'case_name',
+    'status', 'num_frames', 'failed_frames' and 'plot_time', the total time
+    spent plotting the case over all processes.
+    """
 
-            # modified plotclaw is needed in order to pass plotdata here:
-            plotclaw(outdir, plotdir, setplot, plotdata=plotdata)
+    import time, queue, collections, shutil
+    import multiprocessing
+    import clawpack.visclaw.frametools as frametools
+
+    # import in this process so worker processes inherit the modules:
+    init_worker_clawpack()
+
+    cases = [case for case in caselist if case.get('plotdir') is not None]
+
+    print("\nFrames of %s cases will be plotted on %s processors" \
+            % (len(cases), nprocs))
+    print("You have %s seconds to abort..." % abort_time)
+
+    time.sleep(abort_time) # give time to abort
+
+    _sweep_plots.clear()
+    results = []
+    tasks = collections.deque()
+    restored_codecs = {}  # index of each case that has an archive
+    for index, case in enumerate(cases):
+        restored_codec = _restore_archived_outdir(case['outdir'])
+        if restored_codec is not None:
+            restored_codecs[index] = restored_codec
+        setplot = load_module_cached(case.get('setplot_file', 'setplot.py'),
+                                     'setplot')
+        plotdata = case_plotdata(setplot, case)
+        result = {'case_name': case['case_name'], 'status': 'done',
+                  'num_frames': 0, 'failed_frames': [], 'plot_time': 0.}
+        results.append(result)
+        if plotdata is None:
+            print('plotdata is None for case %s, not making frame plots' \
+                    % case['case_name'])
+            if restored_codec is not None:
+                shutil.rmtree(case['outdir'])
+                del restored_codecs[index]
+            continue
+
+        plotdata.outdir = case['outdir']
+        plotdata.plotdir = case['plotdir']
+        plotdata.format = case.get('output_format', 'ascii')
+        if case.get('fast_plots', False):
+            plotdata.add_attribute('fast_frames', True)
+
+        # set up plotdir, keeping the frame plots that are up to date:
+        plotclaw_driver_todo = _worker_modules['plotclaw_driver_todo']
+        plotclaw_driver_todo(plotdata, 'initialize', plotdata.format,
+                             keep_frames=case.get('incremental_plots', False))
+
+        framenos = frametools.only_most_recent(plotdata.print_framenos,
+                                               plotdata.outdir)
+        figures = frame_fingerprints.figure_fingerprints(plotdata, case)
+        if case.get('incremental_plots', False):
+            todo = frame_fingerprints.stale_frames(plotdata, framenos, case,
+                                                   figures)
         else:
-            # assume setplot already made any plots desired by user,
-            # e.g. fgmax, fgout, or specialized gauge plots.
-            print('plotdata is None, so not making frame plots')
+            todo = [(plotdata.print_fignos, framenos)]
+        case_tasks = [(index, frameno, fignos) for fignos, todo_framenos
+                      in todo for frameno in todo_framenos]
+
+        _sweep_plots[index] = {'plotdata': plotdata, 'framenos': framenos,
+                               'print_fignos': plotdata.print_fignos,
+                               'figures': figures,
+                               'remaining': len(case_tasks)}
+        result['num_frames'] = len(case_tasks)
+        tasks.extend(case_tasks)
+        if len(case_tasks) == 0:
+            tasks.append((index, None, None))
+
+        if restored_codec is not None:
+            # only read to find the frames to plot, so the archive is
+            # unchanged; it is extracted again when the case is plotted:
+            shutil.rmtree(case['outdir'])
+
+    print("%i frames to plot" % len([t for t in tasks if t[1] is not None]))
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+
+    t_start = time.time()
+    running = 0
+    done = queue.Queue()
+    extracted = set()  # indices of the archived cases extracted now
+
+    with context.Pool(processes=nprocs) as pool:
+        while tasks or running:
+
+            while tasks and running < nprocs:
+                task = tasks.popleft()
+                if task[0] in restored_codecs and task[0] not in extracted:
+                    _restore_archived_outdir(cases[task[0]]['outdir'])
+                    extracted.add(task[0])
+                pool.apply_async(_plot_sweep_task, (task,),
+                                 callback=done.put,
+                        error_callback=lambda err, task=task: \
+                            done.put({'index': task[0], 'frameno': task[1],
+                                      'status': 'failed', 'elapsed': 0.,
+                                      'error': repr(err)}))
+                running += 1
+
+            task_result = done.get()
+            running -= 1
+
+            index = task_result['index']
+            result = results[index]
+            result['plot_time'] += task_result['elapsed']
+            if task_result['status'] != 'done':
+                result['status'] = 'failed'
+                print("*** Plotting failed for case %s, frame %s: %s" \
+                        % (result['case_name'], task_result['frameno'],
+                           task_result['error']))
+                if task_result['frameno'] is not None:
+                    result['failed_frames'].append(task_result['frameno'])
+
+            if task_result['frameno'] is not None:
+                _sweep_plots[index]['remaining'] -= 1
+                if _sweep_plots[index]['remaining'] == 0:
+                    # all frames done, make the index files next:
+                    tasks.appendleft((index, None, None))
+            else:
+                case = cases[index]
+                if case.get('incremental_plots', False):
+                    plotdata = _sweep_plots[index]['plotdata']
+                    frame_fingerprints.update_fingerprints(plotdata,
+                        [frameno for frameno in _sweep_plots[index]['framenos']
+                         if frameno not in result['failed_frames']], case,
+                        _sweep_plots[index]['figures'])
+                results_index.update_record(
+                        case.get('index_dir', '_case_index'),
+                        case['case_name'],
+                        {'plot_status': result['status'],
+                         'timings': {'plot_time': result['plot_time']}},
+                        case)
+                if index in extracted:
+                    sweep_archive.archive_outdir(case['outdir'],
+                                    restored_codecs[index],
+                                    case.get('archive_level', None))
+                    extracted.remove(index)
+                if verbose:
+                    print("Done plotting case %s, %i frames, %.1f seconds" \
+                            % (result['case_name'], result['num_frames'],
+                               result['plot_time']))
+
+    failed = [result for result in results if result['status'] != 'done']
+    print("\nPlotted %i cases in %.1f seconds, %i failed" \
+            % (len(results), time.time() - t_start, len(failed)))
+    return results
+
+
+def _plot_sweep_task(task):
+    """
+    Plot the figures *fignos* of one frame of one case for
+    plot_many_cases_frames, or make the index files for the case if the
+    frame number is None.
+    """
 
-    #timenow = datetime.datetime.today().strftime('%Y-%m-%d at %H:%M:%S')
-    timenow = datetime.datetime.utcnow().strftime('%Y-%m-%d at %H:%M:%S') \
-                + ' UTC'
-    message = "Process %i completed case %s at %s\n" \
-                % (p.pid, case_name, timenow)
-    print(message)
+    import time, traceback
+
+    index, frameno, fignos = task
+    plotdata = _sweep_plots[index]['plotdata']
+    t_start = time.time()
+    try:
+        if frameno is None:
+            plotdata.print_framenos = _sweep_plots[index]['framenos']
+            plotdata.print_fignos = _sweep_plots[index]['print_fignos']
+            _worker_modules['plotclaw_driver_todo'](plotdata, 'finalize',
+                                                    plotdata.format)
+        else:
+            plotdata.print_fignos = fignos
+            fast_frames.render_frames(plotdata, [frameno], plotdata.format)
+        status, error = 'done', None
+    except Exception as err:
+        traceback.print_exc()
+        status, error = 'failed', repr(err)
+    return {'index': index, 'frameno': frameno, 'status': status,
+            'elapsed': time.time() - t_start, 'error': error}
 
-    if redirect_python:
-        stdout_file.close()
-        # Fix stdout again
-        sys.stdout = sys_stdout
-        sys.stderr = sys_stderr
-        print(message) # to screen
+
+def init_worker_clawpack():
+    """
+    Import the Clawpack modules used by run_one_case_clawpack, including
+    the local plotclaw and so matplotlib and clawpack.visclaw.frametools.
+
+    Pass this function as *initializer* to multip_tools.run_many_cases_pool
+    so each worker process does this once when it starts.  It can also be
+    called in the main program before run_many_cases_pool, in which case
+    the worker processes inherit the imported modules when they are forked.
+    Does nothing if the modules have already been imported in this process.
+    """
+
+    import os, sys
+
+    if _worker_modules:
+        return
+
+    from clawpack.clawutil.runclaw import runclaw
+    import clawpack.visclaw.frametools
+    import clawpack.visclaw.plotpages
+    import clawpack.visclaw.data
+
+    #from clawpack.visclaw.plotclaw import plotclaw
+    # for now use local version:
+    CLAW = os.environ['CLAW']
+    sys.path.insert(0, CLAW + '/clawmultip/src/python/clawmultip')
+    from plotclaw import plotclaw, plotclaw_streaming, plotclaw_driver_todo
+    sys.path.pop(0)
+
+    _worker_modules['runclaw'] = runclaw
+    _worker_modules['plotclaw'] = plotclaw
+    _worker_modules['plotclaw_streaming'] = plotclaw_streaming
+    _worker_modules['plotclaw_driver_todo'] = plotclaw_driver_todo
+
+
+def load_module_cached(path, name):
+    """
+    Load the Python file *path* as a module called *name*, e.g. a setrun
+    or setplot file.  The module is loaded only once per process and then
+    reused for later cases, unless the file has been modified since.
+    """
+
+    import os
+    import importlib.util
+
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    if key not in _module_cache:
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _module_cache[key] = module
+    return _module_cache[key]
+
+
+def report_setup_time(results):
+    """
+    Print the total and average setup time per case (importing modules and
+    loading setrun and setplot), from the *results* returned by
+    multip_tools.run_many_cases_pool with run_one_case_clawpack.
+    Comparing this with and without initializer=init_worker_clawpack shows
+    the per-case overhead that is saved.  Returns the average.
+    """
+
+    setup_times = [result['value']['setup_time'] for result in results
+                   if result['status'] == 'done' and result['value']]
+    if len(setup_times) == 0:
+        return 0.
+
+    average = sum(setup_times) / len(setup_times)
+    print("Setup time: %.3f seconds in total, %.3f seconds per case" \
+            % (sum(setup_times), average))
+    print("    (out of %.3f seconds total elapsed time)" \
+            % sum([result['elapsed'] for result in results]))
+    return average
+
+
+def case_cache_key(outdir, xclawcmd, setrun_file, runexe=None):
+    """
+    Return a hash that identifies the Clawpack run defined by the .data files
+    written to *outdir* by rundata.write, the executable *xclawcmd*,
+    the source of *setrun_file*, and the string *runexe*, if any.
+
+    Two runs with the same key produce the same output, so if a run with this
+    key has already completed its output can be reused.
+    """
+
+    import os, glob, hashlib
+
+    h = hashlib.sha256()
+
+    def hash_file(label, path):
+        h.update(label.encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+
+    for path in sorted(glob.glob(os.path.join(outdir, '*.data'))):
+        hash_file('data:%s\n' % os.path.basename(path), path)
+
+    hash_file('xclawcmd\n', xclawcmd)
+    hash_file('setrun\n', setrun_file)
+    h.update(('runexe:%s\n' % runexe).encode())
+
+    return h.hexdigest()
+
+
+def use_cached_output(cache_key, outdir, cache_dir='_clawmultip_cache'):
+    """
+    Check whether output for *cache_key* already exists, either in *outdir*
+    itself or in the outdir of a completed run registered in *cache_dir*.
+    In the latter case the output files are hard-linked (or copied if
+    hard links are not possible) into *outdir*.
+
+    Returns True if *outdir* now contains the output for this key.
+    """
+
+    import os, glob, shutil
+
+    if _read_cache_key(outdir) == cache_key:
+        return True
+
+    entry = os.path.join(cache_dir, cache_key)
+    if not os.path.isfile(entry):
+        return False
+
+    with open(entry) as f:
+        cached_outdir = f.read().strip()
+
+    if _read_cache_key(cached_outdir) == cache_key:
+        archived = False
+    elif _read_cache_key(cached_outdir, archived=True) == cache_key:
+        # cached_outdir was archived by sweep_archive.archive_case
+        archived = True
+    else:
+        # that run has been overwritten or removed since it was registered
+        return False
+
+    # remove output from any earlier run in outdir:
+    for path in glob.glob(os.path.join(outdir, 'fort.*')):
+        os.remove(path)
+
+    # files written for this case that should not be taken from cached_outdir:
+    skip_files = ['python_output.txt', 'case_info.txt', 'case_info.pkl']
+
+    if archived:
+        # only the files at the top level, as for a directory:
+        sweep_archive.extract_archive(cached_outdir, outdir,
+                skip=lambda name: ('/' in name) or (name in skip_files)
+                                  or name.endswith('.data'))
+        print('Extracted output for cache key from %s' \
+                % sweep_archive.archive_name(cached_outdir))
+        return True
+
+    for path in glob.glob(os.path.join(cached_outdir, '*')):
+        fname = os.path.basename(path)
+        if (not os.path.isfile(path)) or (fname in skip_files) \
+                or fname.endswith('.data'):
+            continue
+        target = os.path.join(outdir, fname)
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copy2(path, target)
+
+    print('Linked output for cache key from %s' % cached_outdir)
+    return True
+
+
+def register_cached_output(cache_key, outdir, cache_dir='_clawmultip_cache'):
+    """
+    Record that the run in *outdir* completed with key *cache_key*:
+    writes *cache_key* to outdir/cache_key.txt and the absolute path of
+    *outdir* to a file named *cache_key* in *cache_dir*.
+    """
+
+    import os
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    _write_atomic(os.path.join(outdir, 'cache_key.txt'), cache_key + '\n')
+    _write_atomic(os.path.join(cache_dir, cache_key),
+                  os.path.abspath(outdir) + '\n')
+
+
+def _read_cache_key(outdir, archived=False):
+    """
+    Return the cache key of the completed run in *outdir*, or None.
+    If *archived* is True, the key is read from the archive of outdir made
+    by sweep_archive.archive_outdir instead, if there is one.
+    """
+
+    import os, zipfile
+
+    if archived:
+        archive = sweep_archive.archive_name(outdir)
+        if not os.path.isfile(archive):
+            return None
+        with zipfile.ZipFile(archive) as zf:
+            if 'cache_key.txt' not in zf.namelist():
+                return None
+            return zf.read('cache_key.txt').decode().strip()
+
+    fname = os.path.join(outdir, 'cache_key.txt')
+    if not os.path.isfile(fname):
+        return None
+    with open(fname) as f:
+        return f.read().strip()
+
+
+def _write_atomic(fname, text):
+    """
+    Write *text* to *fname* so that other processes never see a
+    partially written file.
+    """
+
+    import os
+
+    tmpname = '%s.tmp%i' % (fname, os.getpid())
+    with open(tmpname, 'w') as f:
+        f.write(text)
+    os.replace(tmpname, fname)
 
 
 def make_cases_template():
@@ -272,6 +1072,7 @@ def make_cases_template():
 
             #case['xclawcmd'] = None  # if None, will not run code
             case['xclawcmd'] = 'xclaw'  # executable created by 'make .exe'
+            #case['cache'] = True  # if True, skip runs already done
 
             # setrun parameters:
             case['setrun_file'] = 'setrun_cases.py'
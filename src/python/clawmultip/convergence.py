@@ -0,0 +1,344 @@
+"""
+Error norms and convergence rates for the cases of a resolution sweep,
+computed in parallel after the sweep has run.
+
+For every case and every requested frame, the L1, L2 and max norms of the
+error are computed, either against a true solution *qtrue(x,t)* (as in
+setplot_cases.py in the example) or against the finest grid in the same
+group of cases.  Cases are grouped by the parameters that are not the
+resolution, e.g. by 'order' in the example, and the observed order of
+accuracy is fit for each group.  A compact table is written at the end.
+
+Example:
+    rows = compute_errors(caselist, frames=[1,2], qtrue=qtrue, nprocs=4)
+    rates = convergence_rates(rows)
+    write_table(rows, rates, 'convergence_table.txt')
+
+or all three steps with
+    convergence_study(caselist, frames=[1,2], qtrue=qtrue, nprocs=4)
+
+*qtrue* must be a function qtrue(x,t) returning the true value of q[component]
+at the cell centers x (in 2d or 3d, x is a list of arrays from meshgrid).
+Frames are read with sweep_data.read_frame, so binary output is
+memory-mapped rather than parsed.  AMR output with several patches is
+supported when comparing with qtrue, using each cell from the finest level
+that covers it.
+"""
+
+import os, sys
+import numpy as np
+
+# other modules in this directory:
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sweep_data
+sys.path.pop(0)
+
+# set in each worker process by _init_worker, so that qtrue need not be
+# picklable (worker processes are forked and inherit it):
+_worker_settings = {}
+
+
+def error_norms(e, delta):
+    """
+    Return a dictionary with the grid-weighted 'L1' and 'L2' norms and the
+    'max' norm of the error array *e* on a grid with spacing *delta*
+    (a list with the spacing in each direction).
+    """
+
+    cell_volume = float(np.prod(delta))
+    e = np.abs(np.asarray(e, dtype=float))
+    return {'L1': float(e.sum() * cell_volume),
+            'L2': float(np.sqrt((e**2).sum() * cell_volume)),
+            'max': float(e.max())}
+
+
+def coarsen(q_fine, m_coarse, x_fine=None, x_coarse=None):
+    """
+    Return the array *q_fine* (shape (num_eqn, mx, ...)) restricted to a
+    coarser grid with *m_coarse* cells in each direction.
+
+    If the number of fine cells is an integer multiple of the coarse one in
+    every direction, the fine cells within each coarse cell are averaged.
+    Otherwise, in 1d only, the fine solution is linearly interpolated from
+    cell centers *x_fine* to cell centers *x_coarse*.
+    """
+
+    m_fine = list(q_fine.shape[1:])
+    ratios = [mf // mc for mf, mc in zip(m_fine, m_coarse)]
+
+    if all([r*mc == mf for r, mc, mf in zip(ratios, m_coarse, m_fine)]):
+        shape = [q_fine.shape[0]]
+        for mc, r in zip(m_coarse, ratios):
+            shape = shape + [mc, r]
+        q = np.asarray(q_fine).reshape(shape)
+        # average over the fine cells in each coarse cell:
+        return q.mean(axis=tuple(range(2, 2*len(m_coarse)+1, 2)))
+
+    if len(m_coarse) == 1 and x_fine is not None:
+        return np.array([np.interp(x_coarse, x_fine, qm) for qm in q_fine])
+
+    raise ValueError("Cannot coarsen grid with %s cells to %s cells" \
+                        % (m_fine, m_coarse))
+
+
+def _init_worker(qtrue, component):
+    _worker_settings['qtrue'] = qtrue
+    _worker_settings['component'] = component
+
+
+def covered_cells(patch, finer):
+    """
+    Return a boolean array of shape patch['m'], True for the cells of
+    *patch* whose centers lie within one of the patches in the list
+    *finer*, i.e. cells where a finer AMR level gives the solution.
+    """
+
+    x = sweep_data.cell_centers(patch)
+    xx = np.meshgrid(*x, indexing='ij')
+    covered = np.zeros(tuple(patch['m']), dtype=bool)
+    for fine in finer:
+        inside = np.ones(tuple(patch['m']), dtype=bool)
+        for d in range(len(x)):
+            upper = fine['lower'][d] + fine['m'][d] * fine['delta'][d]
+            inside = inside & (xx[d] > fine['lower'][d]) & (xx[d] < upper)
+        covered = covered | inside
+    return covered
+
+
+def _case_errors(task):
+    """
+    Compute the error norms for one case and frame.
+    *task* is a tuple (case, frameno, ref_case) where ref_case is the case
+    used as reference solution, or None to use qtrue.
+
+    With qtrue, the norms are summed over all patches, using each cell on
+    the finest level that covers it, so AMR output is supported.  With a
+    reference case both frames must have a single patch.
+    """
+
+    case, frameno, ref_case = task
+    qtrue = _worker_settings['qtrue']
+    component = _worker_settings['component']
+
+    frame = sweep_data.read_frame(case['outdir'], frameno,
+                                  case.get('output_format', None))
+    patches = frame['patches']
+    coarsest = min([patch['level'] for patch in patches])
+    base = [patch for patch in patches if patch['level'] == coarsest]
+    m = base[0]['m'] if len(patches) == 1 else None
+
+    if ref_case is None:
+        norms = {'L1': 0., 'L2': 0., 'max': 0.}
+        for patch in patches:
+            finer = [p for p in patches if p['level'] > patch['level']]
+            x = sweep_data.cell_centers(patch)
+            if len(x) == 1:
+                xx = x[0]
+            else:
+                xx = np.meshgrid(*x, indexing='ij')
+            e = np.asarray(patch['q'])[component] - qtrue(xx, frame['t'])
+            e = e[~covered_cells(patch, finer)]
+            if e.size == 0:
+                continue
+            patch_norms = error_norms(e, patch['delta'])
+            norms['L1'] += patch_norms['L1']
+            norms['L2'] += patch_norms['L2']**2
+            norms['max'] = max(norms['max'], patch_norms['max'])
+        norms['L2'] = float(np.sqrt(norms['L2']))
+    else:
+        ref_frame = sweep_data.read_frame(ref_case['outdir'], frameno,
+                                        ref_case.get('output_format', None))
+        for name, f in [(case['case_name'], frame),
+                        (ref_case['case_name'], ref_frame)]:
+            if len(f['patches']) > 1:
+                raise ValueError("Frame %i of %s has %i patches, "
+                                 "reference='finest' needs a single patch, "
+                                 "use qtrue instead" \
+                                 % (frameno, name, len(f['patches'])))
+        patch = patches[0]
+        ref_patch = ref_frame['patches'][0]
+        x = sweep_data.cell_centers(patch)
+        qref = coarsen(np.asarray(ref_patch['q']), patch['m'],
+                       sweep_data.cell_centers(ref_patch)[0], x[0])
+        norms = error_norms(np.asarray(patch['q'])[component]
+                            - qref[component], patch['delta'])
+
+    row = {'case_name': case['case_name'], 'frameno': frameno,
+           't': frame['t'], 'm': m, 'dx': base[0]['delta'][0]}
+    row.update(norms)
+    return row
+
+
+def _varying_keys(caselist, exclude):
+    """
+    Return the keys whose values differ between cases in *caselist*,
+    other than those in *exclude*.
+    """
+
+    keys = []
+    for key in caselist[0].keys():
+        if key in exclude:
+            continue
+        if len(set([repr(case.get(key)) for case in caselist])) > 1:
+            keys.append(key)
+    return keys
+
+
+def compute_errors(caselist, frames, qtrue=None, reference='finest',
+                   group_by=None, resolution_key='mx', component=0,
+                   nprocs=1):
+    """
+    Compute the error norms for every case in *caselist* and every
+    frame number in *frames*, using *nprocs* processes.
+
+    If *qtrue* is given, errors are computed against qtrue(x,t).
+    Otherwise, with reference='finest', the case with the largest value of
+    case[resolution_key] in each group is the reference solution, restricted
+    to the grid of each coarser case (see coarsen); the finest case itself
+    is left out.
+
+    Cases are grouped by the parameters listed in *group_by*.  If None, they
+    are grouped by every parameter that varies between cases other than
+    *resolution_key*, 'case_name', 'outdir' and 'plotdir'.
+
+    If *nprocs* > 1 the worker processes are forked (so this is not
+    supported on Windows), and qtrue need not be picklable.
+
+    With *qtrue*, frames with several patches (AMR output) are supported:
+    each cell is taken from the finest level that covers it.  With
+    reference='finest' every frame must have a single patch, otherwise
+    ValueError is raised.
+
+    Returns a list of rows, one dictionary for each case and frame, with
+    the case_name, the group parameters, frameno, t, m (the number of cells
+    in each direction, None if there is more than one patch), dx (the grid
+    spacing in x on the coarsest level) and the 'L1', 'L2' and 'max' norms
+    of the error in q[component].
+    """
+
+    import multiprocessing
+
+    if qtrue is None and reference != 'finest':
+        raise ValueError("Unrecognized reference = %s" % reference)
+
+    if group_by is None:
+        group_by = _varying_keys(caselist, exclude=[resolution_key,
+                                    'case_name', 'outdir', 'plotdir'])
+
+    groups = {}
+    for case in caselist:
+        group = tuple([case.get(key) for key in group_by])
+        groups.setdefault(group, []).append(case)
+
+    tasks = []
+    for group, cases in groups.items():
+        ref_case = None
+        if qtrue is None:
+            ref_case = max(cases, key=lambda case: case[resolution_key])
+        for case in cases:
+            if case is ref_case:
+                continue
+            for frameno in frames:
+                tasks.append((case, frameno, ref_case))
+
+    if nprocs > 1:
+        # worker processes are forked, so qtrue does not need to be pickled
+        # (e.g. it can be defined in a function or interactively):
+        context = multiprocessing.get_context('fork')
+        with context.Pool(processes=nprocs, initializer=_init_worker,
+                          initargs=(qtrue, component)) as pool:
+            rows = pool.map(_case_errors, tasks, chunksize=1)
+    else:
+        _init_worker(qtrue, component)
+        rows = [_case_errors(task) for task in tasks]
+
+    for row, task in zip(rows, tasks):
+        case = task[0]
+        row['group'] = dict([(key, case.get(key)) for key in group_by])
+        row[resolution_key] = case.get(resolution_key)
+
+    return rows
+
+
+def convergence_rates(rows, norms=['L1', 'L2', 'max']):
+    """
+    Fit the observed order of accuracy for each group and frame in *rows*,
+    as returned by compute_errors, by a least squares fit of
+    log(error) against log(dx) over all resolutions.
+
+    Returns a list of dictionaries with the 'group', 'frameno', the number
+    of resolutions 'num_cases' and the fitted rate for each norm.
+    """
+
+    groups = {}
+    for row in rows:
+        key = (repr(sorted(row['group'].items())), row['frameno'])
+        groups.setdefault(key, []).append(row)
+
+    rates = []
+    for key in sorted(groups.keys()):
+        group_rows = sorted(groups[key], key=lambda row: row['dx'])
+        rate = {'group': group_rows[0]['group'], 'frameno': key[1],
+                'num_cases': len(group_rows)}
+        for norm in norms:
+            dx = np.array([row['dx'] for row in group_rows])
+            err = np.array([row[norm] for row in group_rows])
+            ok = err > 0
+            if ok.sum() >= 2:
+                rate[norm] = float(np.polyfit(np.log(dx[ok]),
+                                              np.log(err[ok]), 1)[0])
+            else:
+                rate[norm] = None
+        rates.append(rate)
+    return rates
+
+
+def write_table(rows, rates, fname='convergence_table.txt',
+                norms=['L1', 'L2', 'max']):
+    """
+    Write the error norms in *rows* and the fitted *rates* to *fname*.
+    """
+
+    def fmt_rate(value):
+        if value is None:
+            return '%10s' % '-'
+        return '%10.3f' % value
+
+    with open(fname, 'w') as f:
+        f.write('Error norms\n\n')
+        f.write('%-30s %6s %12s ' % ('case_name', 'frame', 'dx') \
+                + ' '.join(['%12s' % norm for norm in norms]) + '\n')
+        for row in sorted(rows, key=lambda row: (repr(row['group']),
+                                                 row['frameno'], -row['dx'])):
+            f.write('%-30s %6i %12.4e ' % (row['case_name'], row['frameno'],
+                                           row['dx']) \
+                    + ' '.join(['%12.4e' % row[norm] for norm in norms]) \
+                    + '\n')
+
+        f.write('\nObserved convergence rates\n\n')
+        f.write('%-30s %6s %6s ' % ('group', 'frame', 'cases') \
+                + ' '.join(['%10s' % norm for norm in norms]) + '\n')
+        for rate in rates:
+            group = ', '.join(['%s=%s' % item
+                               for item in rate['group'].items()])
+            f.write('%-30s %6i %6i ' % (group, rate['frameno'],
+                                        rate['num_cases']) \
+                    + ' '.join([fmt_rate(rate[norm]) for norm in norms]) \
+                    + '\n')
+    print('Created %s' % fname)
+
+
+def convergence_study(caselist, frames, qtrue=None, reference='finest',
+                      group_by=None, resolution_key='mx', component=0,
+                      nprocs=1, fname='convergence_table.txt'):
+    """
+    Compute the errors and convergence rates for *caselist* and write
+    them to *fname*, see compute_errors for the arguments.
+    Returns the rows and rates.
+    """
+
+    rows = compute_errors(caselist, frames, qtrue, reference, group_by,
+                          resolution_key, component, nprocs)
+    rates = convergence_rates(rows)
+    write_table(rows, rates, fname)
+    return rows, rates
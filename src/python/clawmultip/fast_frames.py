@@ -0,0 +1,358 @@
+"""
+Fast rendering of 1d frame plots, reusing the matplotlib figures and axes
+from one frame to the next.
+
+clawpack.visclaw.plotpages.plotclaw_driver creates every figure, axes,
+line and legend again for each frame, and for 1d line plots most of the
+time goes into creating these and into the layout rather than into the data.
+Here each figure is created once per process, and for each frame only the
+data of the lines and the titles are updated, and the afteraxes function
+(e.g. plot_qtrue in the example setplot_cases.py) is called again after
+removing whatever it added for the previous frame.
+
+To use this, set
+    plotdata.add_attribute('fast_frames', True)
+in setplot, or case['fast_plots'] = True in the caselist when using
+clawmultip_tools.run_one_case_clawpack.  It is then used for the frame plots
+made by plotclaw.py and clawmultip_tools.plot_many_cases_frames whenever all
+the figures to be plotted are supported (see supported), otherwise the
+frames are plotted by plotclaw_driver as usual.
+
+Supported are figures with kwargs, figsize and facecolor, axes with
+axescmd, xlimits, ylimits, title (with the time as set by title_with_t and
+title_t_format), title_kwargs and afteraxes, and items of plot_type
+'1d_plot' with plot_var (a component of q or a function of current_data),
+plotstyle, color and kwargs.  current_data has the attributes x, q, t,
+frameno, patch, var, plotdata, plotfigure, plotaxes and plotitem.
+The same png files are made as by plotclaw_driver.
+
+To compare the frames per second with plotclaw_driver:
+    python fast_frames.py outdir setplot_file [case_info.pkl]
+see benchmark.
+"""
+
+import os, sys, time
+
+# other modules in this directory:
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sweep_data, frame_fingerprints
+sys.path.pop(0)
+
+# figures created in this process, keyed on figno, and the plotdata they
+# were made for (figures are recreated for new plotdata):
+_figures = {}
+_figures_plotdata = {}
+
+
+class CurrentData(object):
+    """
+    The data for one patch of a frame, passed to plot_var functions and
+    afteraxes, with the same attribute names as in clawpack.visclaw.
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def supported(plotdata):
+    """
+    Return True if all the frame figures of *plotdata* to be printed can be
+    made by render_frame.
+    """
+
+    for name in ['beforeframe', 'afterframe', 'mapc2p']:
+        if getattr(plotdata, name, None) is not None:
+            return False
+
+    for plotfigure in frame_fingerprints.frame_figures(plotdata).values():
+        if (not getattr(plotfigure, 'clf_each_frame', True)) \
+                or getattr(plotfigure, 'use_for_kml', False):
+            return False
+        for axesname in plotfigure._axesnames:
+            plotaxes = plotfigure.plotaxes_dict[axesname]
+            if getattr(plotaxes, 'beforeaxes', None) is not None \
+                    or isinstance(plotaxes.afteraxes, str) \
+                    or getattr(plotaxes, 'scaled', False) \
+                    or getattr(plotaxes, 'image', False) \
+                    or 'h:m:s' in plotaxes.title:
+                return False
+            for itemname in plotaxes._itemnames:
+                plotitem = plotaxes.plotitem_dict[itemname]
+                if plotitem.plot_type not in ['1d_plot', '1d']:
+                    return False
+                for name in ['afteritem', 'afterpatch', 'mapc2p',
+                             'MappedGrid']:
+                    if getattr(plotitem, name, None):
+                        return False
+                if not getattr(plotitem, 'data_show', True):
+                    return False
+    return True
+
+
+def _new_figure(plotfigure):
+    """
+    Create the figure and axes for *plotfigure*, without any data.
+    Returns a dictionary with the figure and a list with a dictionary for
+    each of its axes.
+    """
+
+    import matplotlib.pyplot as plt
+
+    # as in clawpack.visclaw.frametools.plot_frame:
+    kwargs = dict(getattr(plotfigure, 'kwargs', {}) or {})
+    facecolor = getattr(plotfigure, 'facecolor', None)
+    if facecolor is not None:
+        kwargs['facecolor'] = facecolor
+    elif 'facecolor' not in kwargs:
+        kwargs['facecolor'] = 'w'
+    if getattr(plotfigure, 'figsize', None) is not None:
+        kwargs['figsize'] = plotfigure.figsize
+
+    fig = plt.figure(num=plotfigure.figno, **kwargs)
+    fig.clf()
+
+    axes = []
+    for axesname in plotfigure._axesnames:
+        plotaxes = plotfigure.plotaxes_dict[axesname]
+        if not getattr(plotaxes, '_show', True):
+            continue
+        ax = eval('plt.%s' % getattr(plotaxes, 'axescmd', 'subplot(1,1,1)'))
+        if plotaxes.xlimits not in ['auto', None]:
+            ax.set_xlim(plotaxes.xlimits)
+        if plotaxes.ylimits not in ['auto', None]:
+            ax.set_ylim(plotaxes.ylimits)
+
+        items = []
+        for itemname in plotaxes._itemnames:
+            plotitem = plotaxes.plotitem_dict[itemname]
+            if getattr(plotitem, '_show', True):
+                items.append({'plotitem': plotitem, 'lines': []})
+
+        ax.set_title(plotaxes.title)
+        axes.append({'plotaxes': plotaxes, 'ax': ax, 'items': items,
+                     'baseline': set(ax.get_children())})
+
+    return {'fig': fig, 'axes': axes}
+
+
+def _title(plotaxes, t):
+    """
+    Return the axes title for time *t*, as made by clawpack.visclaw.
+    """
+
+    if not getattr(plotaxes, 'title_with_t', True):
+        return plotaxes.title
+    if getattr(plotaxes, 'title_t_format', None):
+        return "%s at time t = %s" % (plotaxes.title,
+                                      plotaxes.title_t_format % t)
+    if (t == 0.) or ((t >= 0.001) and (t < 1000.)):
+        return "%s at time t = %14.8f" % (plotaxes.title, t)
+    else:
+        return "%s at time t = %14.8e" % (plotaxes.title, t)
+
+
+def _savefig_kwargs():
+    """
+    Return the keyword arguments of savefig used for frame plots by
+    clawpack.visclaw.frametools.printfig, which plotclaw_driver calls, so
+    that the png files are the same (this differs between versions).
+    """
+
+    import inspect
+    from clawpack.visclaw import frametools
+
+    parameters = inspect.signature(frametools.printfig).parameters
+    if 'bbox_inches' in parameters:
+        return {'bbox_inches': parameters['bbox_inches'].default}
+    return {}
+
+
+def render_frame(plotdata, frameno):
+    """
+    Make the png files for frame *frameno* of all the frame figures of
+    *plotdata* to be printed, reusing the figures made for earlier frames.
+    """
+
+    import matplotlib.pyplot as plt
+
+    if _figures_plotdata.get('plotdata') is not plotdata:
+        # figures were made for another case:
+        for fig_state in _figures.values():
+            plt.close(fig_state['fig'])
+        _figures.clear()
+        _figures_plotdata['plotdata'] = plotdata
+
+    frame = sweep_data.read_frame(plotdata.outdir, frameno,
+                                  getattr(plotdata, 'format', None),
+                                  getattr(plotdata, 'file_prefix', 'fort'))
+    print_format = getattr(plotdata, 'print_format', 'png')
+
+    figures = frame_fingerprints.frame_figures(plotdata)
+    for figno in sorted(figures.keys()):
+        plotfigure = figures[figno]
+        if figno not in _figures:
+            _figures[figno] = _new_figure(plotfigure)
+        fig_state = _figures[figno]
+
+        for axes_state in fig_state['axes']:
+            plotaxes = axes_state['plotaxes']
+            ax = axes_state['ax']
+
+            # remove anything added by afteraxes for the previous frame:
+            for artist in ax.get_children():
+                if artist not in axes_state['baseline']:
+                    artist.remove()
+
+            current_data = None
+            for item_state in axes_state['items']:
+                plotitem = item_state['plotitem']
+                lines = item_state['lines']
+                for n, patch in enumerate(frame['patches']):
+                    x = sweep_data.cell_centers(patch)[0]
+                    current_data = CurrentData(x=x, q=patch['q'],
+                                t=frame['t'], frameno=frameno, patch=patch,
+                                plotdata=plotdata, plotfigure=plotfigure,
+                                plotaxes=plotaxes, plotitem=plotitem)
+                    if callable(plotitem.plot_var):
+                        var = plotitem.plot_var(current_data)
+                    else:
+                        var = patch['q'][plotitem.plot_var]
+                    current_data.var = var
+
+                    if n < len(lines):
+                        lines[n].set_data(x, var)
+                    else:
+                        kwargs = dict(getattr(plotitem, 'kwargs', {}) or {})
+                        if plotitem.color:
+                            kwargs['color'] = plotitem.color
+                        line = ax.plot(x, var, plotitem.plotstyle,
+                                       **kwargs)[0]
+                        lines.append(line)
+                        axes_state['baseline'].add(line)
+
+                # patches that are not in this frame:
+                for line in lines[len(frame['patches']):]:
+                    line.set_data([], [])
+
+            title_kwargs = dict(getattr(plotaxes, 'title_kwargs', {}) or {})
+            if getattr(plotaxes, 'title_fontsize', None) is not None:
+                title_kwargs['fontsize'] = plotaxes.title_fontsize
+            ax.set_title(_title(plotaxes, frame['t']), **title_kwargs)
+            if plotaxes.xlimits in ['auto', None] \
+                    or plotaxes.ylimits in ['auto', None]:
+                ax.relim()
+                ax.autoscale_view()
+
+            if plotaxes.afteraxes is not None and current_data is not None:
+                plt.figure(fig_state['fig'].number)
+                plt.sca(ax)
+                plotaxes.afteraxes(current_data)
+
+        fname = os.path.join(plotdata.plotdir, 'frame%sfig%s.%s' \
+                    % (str(frameno).zfill(4), figno, print_format))
+        fig_state['fig'].savefig(fname, **_savefig_kwargs())
+
+
+def render_frames(plotdata, framenos, format='ascii'):
+    """
+    Make the frame plots for the frames in *framenos*, with render_frame
+    if plotdata.fast_frames is True and the figures are supported, otherwise
+    with plotclaw_driver.  plotdir must already be initialized.
+    """
+
+    from clawpack.visclaw import plotpages
+
+    if getattr(plotdata, 'fast_frames', False) and supported(plotdata):
+        for frameno in framenos:
+            render_frame(plotdata, frameno)
+    else:
+        plotdata._parallel_todo = 'frames'
+        plotdata.print_framenos = framenos
+        plotpages.plotclaw_driver(plotdata, verbose=False, format=format)
+
+
+def benchmark(outdir, setplot_file, case=None, framenos='all', plotdir=None,
+              format=None):
+    """
+    Plot the frames *framenos* in *outdir* with plotclaw_driver and with
+    render_frame, and print the frames per second for each.
+    *case* is passed to setplot, if it has a case parameter.
+    The plots go to a temporary directory unless *plotdir* is given.
+
+    Returns a dictionary with the frames per second 'driver' and 'fast'.
+    """
+
+    import tempfile, importlib.util
+    from clawpack.visclaw import plotpages
+
+    spec = importlib.util.spec_from_file_location('setplot', setplot_file)
+    setplot = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(setplot)
+
+    if plotdir is None:
+        plotdir = tempfile.mkdtemp(prefix='_plots_benchmark_')
+    if format is None:
+        format = sweep_data.read_frame_time(outdir,
+                        sweep_data.frame_numbers(outdir)[0]).get('format')
+        format = {1: 'ascii', 2: 'binary32', 3: 'binary64'}.get(format,
+                                                               format)
+        format = format or 'ascii'
+
+    fps = {}
+    for mode in ['driver', 'fast']:
+        if case is not None:
+            plotdata = setplot.setplot(plotdata=None, case=case)
+        else:
+            plotdata = setplot.setplot(plotdata=None)
+        plotdata.outdir = outdir
+        plotdata.plotdir = plotdir
+        plotdata.format = format
+        plotdata.add_attribute('fast_frames', mode == 'fast')
+
+        if framenos == 'all':
+            framenos = sweep_data.frame_numbers(outdir)
+
+        plotdata._parallel_todo = 'initialize'
+        plotpages.plotclaw_driver(plotdata, verbose=False, format=format)
+
+        if mode == 'fast' and not supported(plotdata):
+            print("*** These figures are not supported by render_frame")
+            fps[mode] = None
+            continue
+
+        t_start = time.time()
+        render_frames(plotdata, framenos, format)
+        elapsed = time.time() - t_start
+        fps[mode] = len(framenos) / elapsed
+
+    print("\nPlotted %i frames to %s" % (len(framenos), plotdir))
+    for mode in ['driver', 'fast']:
+        if fps[mode] is not None:
+            print("%-8s %8.2f frames per second" % (mode, fps[mode]))
+    if fps['fast']:
+        print("speedup  %8.2f" % (fps['fast'] / fps['driver']))
+    return fps
+
+
+if __name__ == '__main__':
+    """
+    Usage:
+        python fast_frames.py outdir setplot_file [case_info.pkl]
+    If case_info.pkl is not given, outdir/case_info.pkl is used if it exists.
+    """
+
+    import pickle
+
+    outdir = sys.argv[1]
+    setplot_file = sys.argv[2]
+    if len(sys.argv) > 3:
+        case_file = sys.argv[3]
+    else:
+        case_file = os.path.join(outdir, 'case_info.pkl')
+
+    case = None
+    if os.path.isfile(case_file):
+        with open(case_file, 'rb') as f:
+            case = pickle.load(f)
+
+    benchmark(outdir, setplot_file, case)
@@ -0,0 +1,249 @@
+"""
+Fingerprints of the frame plots in a plotdir, so that plots can be remade
+for only the frames and figures that are out of date.
+
+For every frame and figure plotted, the file .frame_fingerprints.json in
+plotdir records
+    - the size and CRC-32 checksum of the fort.q, fort.t, fort.b and
+      fort.a files of the frame (rather than their modification times,
+      which change when an archived outdir is extracted, see
+      sweep_archive.py), and
+    - a hash of the inputs that determine the figure:
+        - the settings of the figure made by setplot (the attributes of
+          the plotfigure and its plotaxes and plotitems, including the
+          source of any functions such as afteraxes and the values and
+          functions they refer to from the enclosing setplot function or
+          from the module they are defined in),
+        - the plotdata attributes that apply to all figures, and
+        - the case parameters listed in plot_keys or case['plot_keys'].
+
+A frame is replotted if its output files have changed, and only the figures
+whose settings have changed (or whose png files are missing) are replotted,
+so changing one figure in setplot, or a module-level value used only by
+that figure's functions, only remakes that figure.  Other changes to the
+setplot file (e.g. comments) do not remake any figures.
+Used by plotclaw when incremental=True, and by run_one_case_clawpack and
+clawmultip_tools.plot_many_cases_frames if case['incremental_plots'] is True.
+
+Case parameters only affect the fingerprint if they are listed, since most
+(e.g. outdir, or the parameters used by setrun) do not affect the plots
+other than through the output files.  A case parameter that affects the
+plots in some other way, e.g. a value used in an afteraxes function, should
+be added to case['plot_keys'], e.g.
+    case['plot_keys'] = ['qtrue_shift']
+A module that adds case parameters that always affect the plots can add
+them to plot_keys.
+
+Changes to other modules imported by setplot are not detected, set
+case['incremental_plots'] = False (the default) to replot everything.
+"""
+
+import os, json, hashlib, zlib
+
+fingerprint_file = '.frame_fingerprints.json'
+
+# case parameters that affect the plots other than through the output
+# files, in addition to any in case['plot_keys']:
+plot_keys = ['setplot_file', 'output_format', 'fast_plots', 'plot_keys']
+
+# plotdata attributes that change from one call to the next (some are set
+# by plotclaw_driver), or only affect which frames and figures are plotted:
+_volatile_plotdata_keys = ['outdir', 'plotdir', 'print_framenos',
+                           'print_fignos', 'print_gaugenos', 'num_procs',
+                           'parallel', 'msgfile', 'plotfigure_dict',
+                           'setplot', 'format', 'output_format', 'rundir',
+                           'framesoln_dict', 'gaugesoln_dict', 'save_frames',
+                           'file_prefix', 'output_controller']
+_volatile_plotdata_prefixes = ('timeframes_', 'gauges_')
+
+
+def _settings(value, seen):
+    """
+    Return a string that changes whenever *value* does, following the
+    attributes of objects and the source of functions.
+    Attributes starting with '_' (e.g. references to the parent object) are
+    skipped, as are objects already in *seen*.
+    """
+
+    import inspect
+
+    if isinstance(value, (str, int, float, bool, type(None))):
+        return repr(value)
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join(['%r: %s' % (k, _settings(value[k], seen))
+                                   for k in sorted(value, key=repr)])
+    if isinstance(value, (list, tuple, set)):
+        if isinstance(value, set):
+            value = sorted(value, key=repr)
+        return '[%s]' % ', '.join([_settings(v, seen) for v in value])
+    if hasattr(value, 'tobytes'):
+        # numpy array:
+        return hashlib.sha256(value.tobytes()).hexdigest()
+    if inspect.isfunction(value) or inspect.ismethod(value):
+        try:
+            source = inspect.getsource(value)
+        except (OSError, TypeError):
+            source = repr(value.__code__.co_code)
+        # values from the enclosing function (e.g. setplot) and from the
+        # module, other than modules and classes:
+        closurevars = inspect.getclosurevars(value)
+        closure = dict(closurevars.nonlocals)
+        closure.update([(k, v) for k, v in closurevars.globals.items()
+                        if not inspect.ismodule(v)
+                        and not inspect.isclass(v)])
+        if closure:
+            if id(value) in seen:
+                return '<seen>'
+            seen.add(id(value))
+            source += _settings(closure, seen)
+        return source
+    if hasattr(value, '__dict__'):
+        if id(value) in seen:
+            return '<seen>'
+        seen.add(id(value))
+        return '%s(%s)' % (type(value).__name__,
+                           _settings(dict([(k, v) for k, v in
+                                           vars(value).items()
+                                           if not k.startswith('_')]), seen))
+    return repr(value)
+
+
+def frame_figures(plotdata):
+    """
+    Return a dictionary of the plotfigures of *plotdata* that are plotted
+    for each frame, keyed on figno, restricted to plotdata.print_fignos.
+    """
+
+    figures = {}
+    for figname in getattr(plotdata, '_fignames', []):
+        plotfigure = plotdata.plotfigure_dict[figname]
+        if getattr(plotfigure, 'type', 'each_frame') != 'each_frame':
+            continue
+        if not getattr(plotfigure, '_show', True):
+            continue
+        if plotdata.print_fignos != 'all' \
+                and plotfigure.figno not in plotdata.print_fignos:
+            continue
+        figures[plotfigure.figno] = plotfigure
+    return figures
+
+
+def figure_fingerprints(plotdata, case=None):
+    """
+    Return a dictionary with the hash of the settings of each figure in
+    frame_figures(plotdata), together with the plotdata attributes that
+    apply to all figures and the parameters in *case* listed in plot_keys
+    or case['plot_keys'].
+    """
+
+    common = dict([(k, v) for k, v in vars(plotdata).items()
+                   if not k.startswith('_')
+                   and not k.startswith(_volatile_plotdata_prefixes)
+                   and k not in _volatile_plotdata_keys])
+    if case is not None:
+        keys = plot_keys + list(case.get('plot_keys', []))
+        common['case'] = dict([(k, case[k]) for k in keys if k in case])
+    common = _settings(common, set())
+
+    fingerprints = {}
+    for figno, plotfigure in frame_figures(plotdata).items():
+        text = common + _settings(plotfigure, set())
+        fingerprints[figno] = hashlib.sha256(text.encode()).hexdigest()
+    return fingerprints
+
+
+def _crc32(path, blocksize=1 << 20):
+    crc = 0
+    with open(path, 'rb') as f:
+        block = f.read(blocksize)
+        while block:
+            crc = zlib.crc32(block, crc)
+            block = f.read(blocksize)
+    return crc
+
+
+def data_fingerprint(outdir, frameno, file_prefix='fort'):
+    """
+    Return a list with the name, size and CRC-32 checksum of each output
+    file for frame *frameno* in *outdir*.
+    """
+
+    suffix = str(frameno).zfill(4)
+    fingerprint = []
+    for ext in ['q', 't', 'b', 'a']:
+        fname = '%s.%s%s' % (file_prefix, ext, suffix)
+        path = os.path.join(outdir, fname)
+        if os.path.isfile(path):
+            fingerprint.append([fname, os.path.getsize(path), _crc32(path)])
+    return fingerprint
+
+
+def read_fingerprints(plotdir):
+    """
+    Return the fingerprints recorded in *plotdir*, a dictionary keyed on
+    frame number (as a string), or an empty dictionary.
+    """
+
+    fname = os.path.join(plotdir, fingerprint_file)
+    try:
+        with open(fname) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def stale_frames(plotdata, framenos, case=None, figures=None):
+    """
+    Return a list of tuples (fignos, framenos) of the figures that need to be
+    replotted for the frames in *framenos*, grouping frames that need the
+    same figures.  Frames that are up to date are not included.
+    *figures* are the figure_fingerprints(plotdata, case), computed here
+    if None.
+    """
+
+    recorded = read_fingerprints(plotdata.plotdir)
+    if figures is None:
+        figures = figure_fingerprints(plotdata, case)
+    print_format = getattr(plotdata, 'print_format', 'png')
+
+    groups = {}
+    for frameno in framenos:
+        record = recorded.get(str(frameno), {})
+        if record.get('data') != data_fingerprint(plotdata.outdir, frameno):
+            fignos = sorted(figures.keys())
+        else:
+            fignos = []
+            for figno, fingerprint in sorted(figures.items()):
+                png = os.path.join(plotdata.plotdir, 'frame%sfig%s.%s' \
+                            % (str(frameno).zfill(4), figno, print_format))
+                if record.get('figures', {}).get(str(figno)) != fingerprint \
+                        or not os.path.isfile(png):
+                    fignos.append(figno)
+        if fignos:
+            groups.setdefault(tuple(fignos), []).append(frameno)
+
+    return [(list(fignos), groups[fignos]) for fignos in sorted(groups)]
+
+
+def update_fingerprints(plotdata, framenos, case=None, figures=None):
+    """
+    Record the current fingerprints of the frames in *framenos*, after all
+    of their figures have been plotted.  *figures* should be the figure
+    fingerprints from before plotting, as used in stale_frames, since
+    plotting may change some attributes of plotdata.
+    """
+
+    recorded = read_fingerprints(plotdata.plotdir)
+    if figures is None:
+        figures = figure_fingerprints(plotdata, case)
+    for frameno in framenos:
+        recorded[str(frameno)] = {
+                'data': data_fingerprint(plotdata.outdir, frameno),
+                'figures': dict([(str(figno), fingerprint) for
+                                 figno, fingerprint in figures.items()])}
+
+    fname = os.path.join(plotdata.plotdir, fingerprint_file)
+    tmp_fname = '%s.%i.tmp' % (fname, os.getpid())
+    with open(tmp_fname, 'w') as f:
+        json.dump(recorded, f, indent=1, sort_keys=True)
+    os.replace(tmp_fname, fname)
@@ -12,6 +12,56 @@ a function that runs a single case as input.
 *caselist* is a list of dictionaries.
 Each dictionary should define whatever parameters are needed for one case.
 
+By default the cases are split up using pool.map.  If the cases have very
+different costs, use
+    run_many_cases_pool(caselist, nprocs, run_one_case, schedule='dynamic')
+to run the most expensive cases first and hand out cases one at a time.
+The cost of each case is estimated by default_case_cost, or by a function
+passed in as *case_cost*.
+
+To be able to continue a sweep that is interrupted, pass in the name of
+an SQLite file as *manifest* (see sweep_manifest.py) and then use
+    resume_many_cases_pool(caselist, nprocs, run_one_case, manifest)
+to run only the cases that did not finish.
+
+If each case runs a multi-threaded (OpenMP) executable, set case['num_threads']
+and pass a total core budget as *num_cores*.  Cases are then only started when
+enough cores are free, OMP_NUM_THREADS is set for each case, and each case is
+pinned to its own cores unless pin_cores=False.  With adaptive_threads=True
+the cases started as the queue drains are given more threads, sharing out
+the cores that would otherwise be idle at the end of the sweep.
+
+To run each case in two stages with separate numbers of processes, e.g.
+running Clawpack on some processes and plotting finished cases on others
+at the same time, use
+    run_many_cases_pipeline(caselist, nprocs_run, nprocs_plot,
+                            run_stage, plot_stage)
+
+For resolution studies, cases can be run as refinement ladders, lists of
+cases from coarsest to finest, where the next finer case is only run if a
+metric computed from the output has not yet converged:
+    ladders = refinement_ladders(caselist, resolution_key='mx')
+    run_refinement_ladders(ladders, nprocs, run_one_case, metric, tol)
+
+To do something with the output of each case while the remaining cases
+run, e.g. pack it into a zip archive with sweep_archive.archive_case, pass
+*post_case* to run_many_cases_pool, which calls it in a separate pool of
+processes as each case is done.
+
+To run the cases on more than one node, pass a different *backend* to
+run_many_cases_pool, e.g. sweep_backends.tcp_backend, which hands out the
+cases to worker processes connected over TCP, see sweep_backends.py.
+
+The progress of the sweep (cases done, running and failed, cases per hour
+and the estimated time left) is printed as each case finishes, and written
+to *status_file* if given, see sweep_progress.py.
+
+run_many_cases_pool returns a list of results, one dictionary for each case,
+with the status, any exception and traceback, the elapsed time and outdir.
+A case that raises an exception does not affect the other cases.  Set
+*retries* to try failed cases again, and on_error='raise' to raise an
+exception at the end if any case failed.
+
 Example:
 
 This module contains templates run_one_case_sample and make_all_cases_sample.
@@ -36,15 +86,26 @@ shell.  See:
 
 """
 
-from numpy import *
+import numpy as np
 import os, time, shutil, sys
 from multiprocessing import Process, current_process
 
+# other modules in this directory:
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sweep_manifest, sweep_progress, sweep_backends
+sys.path.pop(0)
+
 
 setplot_file = os.path.abspath('setplot.py')
 
 
-def run_many_cases_pool(caselist, nprocs, run_one_case, abort_time=5):
+def run_many_cases_pool(caselist, nprocs, run_one_case, abort_time=5,
+                        schedule='static', case_cost=None, manifest=None,
+                        retries=0, on_error='continue', num_cores=None,
+                        pin_cores=True, adaptive_threads=False,
+                        backend=None, initializer=None, initargs=(),
+                        post_case=None, nprocs_post=1, progress=True,
+                        status_file=None, on_result=None):
     """
     Split up cases in *caselist* between the *nprocs* processors.
     Each case is a dictionary of parameters for that case.
@@ -53,19 +114,941 @@ def run_many_cases_pool(caselist, nprocs, run_one_case, abort_time=5):
     *run_one_case* should be a function with a single input *case*
     that runs a single case.
 
+    Scheduling options:
+
+    *schedule* determines how cases are assigned to processes:
+        'static':  pool.map with its default chunking (the original behavior)
+        'dynamic': cases are sorted longest-first using *case_cost* and
+                   handed out one at a time as processes become free, so
+                   that the most expensive cases do not end up at the
+                   tail of the sweep.  The achieved makespan is reported
+                   along with the ideal makespan for this set of cases.
+
+    *case_cost* is a function with a single input *case* that returns
+    an estimate of the relative cost of the case, used to order the cases
+    if schedule == 'dynamic' and to estimate the time left.
+    If None, default_case_cost is used.
+
+    *manifest* is the name of an SQLite file in which the state of each case
+    is recorded, see sweep_manifest.py.  If the sweep is interrupted it can
+    be continued with resume_many_cases_pool.
+
+    An exception raised by *run_one_case* only affects that case.
+    The case is tried again up to *retries* more times, and if it still
+    fails then:
+        on_error == 'continue':  the remaining cases are run as usual
+        on_error == 'raise':     the remaining cases are run as usual and
+                                 then a RuntimeError listing the failed cases
+                                 is raised.
+
+    Resource options:
+
+    *num_cores* is the total number of cores the sweep may use, for cases
+    that use more than one thread each (e.g. Clawpack compiled with OpenMP).
+    If set, schedule == 'dynamic' is used and a case is only started when
+    case['num_threads'] cores are free (default 1), so that no more than
+    *num_cores* threads run at once.  Smaller cases may be started ahead
+    of a case that does not fit yet, but after *nprocs* of them no more
+    cases are started until it fits.  Each case is then run with
+    OMP_NUM_THREADS set to its number of threads and, if *pin_cores* is
+    True, pinned to its own set of cores, chosen within a single NUMA node
+    when possible.  Set num_cores='all' to use all available cores.
+    *nprocs* is still the maximum number of cases run at once.
+
+    If *adaptive_threads* is True (only used if num_cores is set), the
+    number of threads for each case is chosen when it is started:
+    the free cores are shared between the cases that can start now (at
+    most *nprocs* less the cases running), so cases started as the queue
+    drains get more threads than case['num_threads'] (but no more than
+    case['max_threads'], if set).
+
+    *backend* is a function returning the pool of processes to run the cases
+    on, see sweep_backends.py.  If None, sweep_backends.local_backend is
+    used, a multiprocessing.Pool which runs the cases on this machine.
+    Use sweep_backends.nested_backend instead if each case plots its frames
+    with a pool of processes of its own, and sweep_backends.tcp_backend to
+    run the cases on workers on other nodes, with *nprocs* the total number
+    of workers (*num_cores* is then not supported).
+
+    *initializer* and *initargs* are passed to the pool, so that
+    initializer(*initargs) is called once in each worker process when it
+    starts, e.g. to import modules needed by every case.
+
+    Post-processing options:
+
+    If *post_case* is given, post_case(case) is called for each case as
+    soon as it is done, in a separate pool of *nprocs_post* processes on
+    this machine, while the next cases are run, e.g. to archive the output
+    with sweep_archive.archive_case.  schedule == 'dynamic' is then used.
+    Its result (see _run_task) is result['post'] of the case, or None if
+    the case failed.  A failed post_case counts as a failure for on_error.
+
+    Reporting options:
+
+    If *progress* is True, a line with the number of cases done, running,
+    waiting and failed, the cases per hour and the estimated time left
+    (weighted by *case_cost*) is printed each time a case finishes, and if
+    *status_file* is given the same is written to this JSON file, which
+    can be read from another shell with
+        python sweep_progress.py status_file
+    see sweep_progress.py.  If *on_result* is given, on_result(result) is
+    called with the result of each case as soon as it finishes (in the
+    order they finish) for either schedule.
+
+    Returns a list of results, one for each case in *caselist*, see _run_task.
+
     Prints out what will be done and then waits abort_time seconds
     before continuing, so user can abort if necessary.
     """
 
-    from multiprocessing import Pool, TimeoutError
+    if schedule not in ['static', 'dynamic']:
+        raise ValueError("Unrecognized schedule = %s" % schedule)
+    if on_error not in ['continue', 'raise']:
+        raise ValueError("Unrecognized on_error = %s" % on_error)
+
+    if backend is None:
+        backend = sweep_backends.local_backend
+    elif num_cores is not None and backend not in [
+            sweep_backends.local_backend, sweep_backends.nested_backend]:
+        raise ValueError("num_cores is only supported for the local backend")
+
+    if len(caselist) == 0:
+        # e.g. resuming a sweep that is already complete:
+        print("No cases to run")
+        return []
+
+    if post_case is not None:
+        # so that post_case can start as soon as each case is done:
+        schedule = 'dynamic'
+
+    if num_cores is not None:
+        schedule = 'dynamic'
+        cores = available_cores()
+        if num_cores != 'all':
+            if num_cores > len(cores):
+                print("*** Only %i cores are available, not num_cores = %i" \
+                        % (len(cores), num_cores))
+            cores = cores[:num_cores]
+        print("Using a budget of %i cores" % len(cores))
+    else:
+        cores = None
 
     print("\n%s cases will be run on %s processors" % (len(caselist),nprocs))
     print("You have %s seconds to abort..." % abort_time)
 
     time.sleep(abort_time) # give time to abort
 
-    with Pool(processes=nprocs) as pool:
-        pool.map(run_one_case, caselist)
+    if manifest is not None:
+        sweep_manifest.init_manifest(manifest, caselist)
+
+    tasks = [{'run_one_case': run_one_case, 'case': case, 'index': i,
+              'manifest': manifest, 'retries': retries}
+             for i, case in enumerate(caselist)]
+
+    if case_cost is None:
+        case_cost = default_case_cost
+
+    costs = [case_cost(case) for case in caselist]
+
+    tracker = sweep_progress.SweepProgress(caselist, nprocs, costs,
+                                           status_file, verbose=progress)
+
+    def finished(result):
+        tracker.finished(result)
+        if on_result is not None:
+            on_result(result)
+
+    if schedule == 'static':
+        results = [None for case in caselist]
+        with backend(processes=nprocs, initializer=initializer,
+                     initargs=initargs) as pool:
+            # the same chunks as pool.map, but each result as it finishes:
+            for result in pool.imap_unordered(_run_task, tasks,
+                                    _map_chunksize(len(tasks), nprocs)):
+                results[result['index']] = result
+                finished(result)
+
+    else:
+        # schedule == 'dynamic':
+
+        # longest-first, so the short cases fill in the gaps at the end:
+        tasks.sort(key=lambda task: costs[task['index']], reverse=True)
+
+        results = [None for case in caselist]
+        t_start = time.time()
+
+        post_pool = None
+        post_async = []
+        if post_case is not None:
+            post_pool = sweep_backends.local_backend(processes=nprocs_post)
+
+        try:
+            with backend(processes=nprocs, initializer=initializer,
+                         initargs=initargs) as pool:
+                for result in _dispatch_dynamic(pool, tasks, nprocs, cores,
+                                                pin_cores, adaptive_threads,
+                                                on_start=tracker.started):
+                    results[result['index']] = result
+                    finished(result)
+                    if post_pool is not None:
+                        result['post'] = None
+                        if result['status'] == 'done':
+                            post_async.append(post_pool.apply_async(
+                                    _run_task, (_post_task(post_case,
+                                                caselist, result, retries),)))
+        except BaseException as err:
+            # e.g. KeyboardInterrupt, or an exception from on_result; the
+            # post_case stages already started are finished first:
+            if post_pool is not None:
+                post_pool.close()
+                post_pool.join()
+            if manifest is not None:
+                _mark_unfinished(manifest, caselist, results, err)
+            raise
+
+        makespan = time.time() - t_start
+        elapsed = [result['elapsed'] for result in results]
+        if cores is None:
+            report_makespan(elapsed, makespan, nprocs)
+        else:
+            report_makespan(elapsed, makespan, len(cores),
+                    num_threads=[result['num_threads'] for result in results])
+
+    failed = report_failures(results)
+
+    if post_case is not None:
+        post_results = _collect_post(post_pool, post_async, results)
+        failed = failed + report_failures(post_results)
+
+    if failed and (on_error == 'raise'):
+        raise RuntimeError("%i of %i cases failed: %s" \
+                % (len(failed), len(results),
+                   ', '.join([result['case_id'] for result in failed])))
+
+    return results
+
+
+def _mark_unfinished(manifest, caselist, results, err):
+    """
+    Record in *manifest* that the cases of *caselist* that were running when
+    the sweep stopped with the exception *err* failed, rather than leaving
+    them 'running', so that resume_many_cases_pool moves their output aside.
+    *results* has None for each case that did not finish.
+    """
+
+    states = sweep_manifest.read_manifest(manifest)
+    for case, result in zip(caselist, results):
+        state = states.get(sweep_manifest.case_id(case), {}).get('state')
+        if result is None and state == 'running':
+            sweep_manifest.set_case_state(manifest, case, 'failed',
+                            message='sweep stopped: %s' % repr(err))
+
+
+def _map_chunksize(num_tasks, nprocs):
+    """
+    Return the chunksize that multiprocessing.Pool.map uses by default
+    for *num_tasks* tasks on *nprocs* processes.
+    """
+
+    chunksize, extra = divmod(num_tasks, nprocs * 4)
+    if extra:
+        chunksize += 1
+    # imap_unordered requires chunksize >= 1, even if there are no tasks:
+    return max(1, chunksize)
+
+
+def _post_task(post_case, caselist, result, retries):
+    """
+    Task to call *post_case* for the case of *result*, which is done.
+    """
+
+    return {'run_one_case': post_case, 'case': caselist[result['index']],
+            'index': result['index'], 'manifest': None, 'retries': retries}
+
+
+def _collect_post(post_pool, post_async, results):
+    """
+    Wait for the post_case tasks in *post_async* and set result['post'] for
+    each of them in *results*.  Returns the list of post_case results.
+    """
+
+    if post_async:
+        print("\nWaiting for %i post_case stages..." % len(post_async))
+    post_results = []
+    for async_result in post_async:
+        post_result = async_result.get()
+        results[post_result['index']]['post'] = post_result
+        post_results.append(post_result)
+    post_pool.close()
+    post_pool.join()
+    return post_results
+
+
+def run_many_cases_pipeline(caselist, nprocs_run, nprocs_plot, run_stage,
+                            plot_stage, abort_time=5, case_cost=None,
+                            retries=0, on_error='continue',
+                            initializer=None, initargs=(), post_case=None,
+                            nprocs_post=1):
+    """
+    Run each case in *caselist* in two stages, using two pools of processes:
+    *run_stage(case)* on *nprocs_run* processes and then *plot_stage(case)*
+    on *nprocs_plot* processes.  A case is handed to the plot pool as soon as
+    its run stage is done, while the next cases are being run, so that
+    plotting overlaps with running.  The plot stage is skipped for a case
+    whose run stage failed.
+
+    For Clawpack use clawmultip_tools.run_stage_clawpack and
+    clawmultip_tools.plot_stage_clawpack as the two stages.
+
+    Cases are run longest-first as for schedule='dynamic' in
+    run_many_cases_pool, and *case_cost*, *retries*, *on_error*,
+    *initializer* and *initargs* have the same meaning as there
+    (both pools use the same initializer).  *post_case* and *nprocs_post*
+    are also as there, post_case(case) is called when the plot stage of a
+    case is done and its result is plot_results[i]['post'].
+
+    Returns two lists, *run_results* and *plot_results*, with the result of
+    each stage for each case (see _run_task), or None for plot stages
+    that were not done.
+    """
+
+    if on_error not in ['continue', 'raise']:
+        raise ValueError("Unrecognized on_error = %s" % on_error)
+
+    print("\n%s cases will be run on %s processors and plotted on %s" \
+            % (len(caselist), nprocs_run, nprocs_plot))
+    print("You have %s seconds to abort..." % abort_time)
+
+    time.sleep(abort_time) # give time to abort
+
+    if case_cost is None:
+        case_cost = default_case_cost
+
+    costs = [case_cost(case) for case in caselist]
+    tasks = [{'run_one_case': run_stage, 'case': case, 'index': i,
+              'manifest': None, 'retries': retries}
+             for i, case in enumerate(caselist)]
+    tasks.sort(key=lambda task: costs[task['index']], reverse=True)
+
+    run_results = [None for case in caselist]
+    plot_results = [None for case in caselist]
+
+    local_backend = sweep_backends.local_backend
+    with local_backend(processes=nprocs_run, initializer=initializer,
+                       initargs=initargs) as run_pool, \
+         local_backend(processes=nprocs_plot, initializer=initializer,
+                       initargs=initargs) as plot_pool:
+
+        post_pool = None
+        post_async = []
+        if post_case is not None:
+            post_pool = local_backend(processes=nprocs_post)
+
+        def start_post(result):
+            # called in a thread of plot_pool as each plot stage completes:
+            result['post'] = None
+            if result['status'] == 'done':
+                post_async.append(post_pool.apply_async(_run_task,
+                        (_post_task(post_case, caselist, result, retries),)))
+
+        plot_async = []
+        for result in _dispatch_dynamic(run_pool, tasks, nprocs_run):
+            run_results[result['index']] = result
+            if result['status'] == 'done':
+                plot_task = {'run_one_case': plot_stage,
+                             'case': caselist[result['index']],
+                             'index': result['index'],
+                             'manifest': None, 'retries': retries}
+                plot_async.append(plot_pool.apply_async(_run_task,
+                        (plot_task,),
+                        callback=start_post if post_pool is not None \
+                                 else None))
+
+        print("\nAll run stages done, waiting for plot stages...")
+        for async_result in plot_async:
+            result = async_result.get()
+            plot_results[result['index']] = result
+
+    failed = report_failures(run_results) \
+            + report_failures([result for result in plot_results
+                               if result is not None])
+
+    if post_case is not None:
+        failed = failed + report_failures(_collect_post(post_pool,
+                                                        post_async,
+                                                        plot_results))
+
+    if failed and (on_error == 'raise'):
+        raise RuntimeError("%i stages failed: %s" % (len(failed),
+                ', '.join([result['case_id'] for result in failed])))
+
+    return run_results, plot_results
+
+
+def resume_many_cases_pool(caselist, nprocs, run_one_case, manifest,
+                           **kwargs):
+    """
+    Continue a sweep started by run_many_cases_pool with the same *manifest*
+    that was interrupted, e.g. by a crash or a preempted job.
+
+    Only the cases in *caselist* that are not recorded as 'done' in
+    *manifest* are run.  The outdir of any case that was running or failed
+    is first moved aside, see sweep_manifest.move_partial_outdirs.
+
+    Any other keyword arguments are passed on to run_many_cases_pool.
+    Returns the results for the cases that were run.
+    """
+
+    sweep_manifest.move_partial_outdirs(manifest, caselist)
+    todo = sweep_manifest.unfinished_cases(manifest, caselist)
+
+    print("\n%s of %s cases are already done according to %s" \
+            % (len(caselist)-len(todo), len(caselist), manifest))
+
+    return run_many_cases_pool(todo, nprocs, run_one_case,
+                               manifest=manifest, **kwargs)
+
+
+def refinement_ladders(caselist, resolution_key='mx', group_by=None):
+    """
+    Split *caselist* into refinement ladders: lists of cases that differ
+    only in case[resolution_key], sorted from coarsest to finest.
+
+    Cases are grouped by the parameters listed in *group_by*.  If None, they
+    are grouped by every parameter that varies between cases other than
+    *resolution_key*, 'case_name', 'outdir' and 'plotdir', e.g. by 'order'
+    for the cases in the example.
+    """
+
+    exclude = [resolution_key, 'case_name', 'outdir', 'plotdir']
+    if group_by is None:
+        group_by = [key for key in caselist[0].keys() if key not in exclude
+                    and len(set([repr(case.get(key))
+                                 for case in caselist])) > 1]
+
+    ladders = {}
+    for case in caselist:
+        group = repr([case.get(key) for key in group_by])
+        ladders.setdefault(group, []).append(case)
+
+    return [sorted(ladder, key=lambda case: case[resolution_key])
+            for ladder in ladders.values()]
+
+
+def run_refinement_ladders(ladders, nprocs, run_one_case, metric, tol,
+                           relative=False, min_levels=2, abort_time=5,
+                           retries=0, on_error='continue',
+                           initializer=None, initargs=(), backend=None):
+    """
+    Run the cases in each ladder of *ladders* (lists of cases from coarsest
+    to finest, see refinement_ladders) only as far as needed: the next level
+    of a ladder is run only if *metric* has not yet converged on the levels
+    already run, so the finest and most expensive grids are skipped when
+    they are not needed.
+
+    *metric* is a function with a single input *case* that returns a number
+    (or array) computed from the output of a finished case, e.g. the maximum
+    of q at the final time.  It is evaluated in the main process as each case
+    finishes.  A ladder has converged when the metric of the latest level
+    differs from that of the level before by no more than *tol*, in the
+    max norm, or by no more than tol times the max norm of the latest metric
+    if *relative* is True.
+
+    The first *min_levels* levels of every ladder are always run, and are
+    all started at once.  Different ladders run at the same time, and the
+    next level of a ladder is handed out before any other cases waiting.
+    A ladder stops if one of its cases fails or the metric raises an
+    exception.
+
+    *abort_time*, *retries*, *on_error*, *initializer*, *initargs* and
+    *backend* have the same meaning as in run_many_cases_pool.
+
+    Returns *results*, with one result dictionary for each case in each
+    ladder (see _run_task), in the order of the ladders, with status
+    'skipped' for the cases that were not run, and *summaries*, with one
+    dictionary for each ladder with the 'case_ids' and 'metrics' of the
+    levels run, the 'changes' between successive levels, whether it
+    'converged' and the 'skipped' case_ids.
+    """
+
+    if on_error not in ['continue', 'raise']:
+        raise ValueError("Unrecognized on_error = %s" % on_error)
+    if backend is None:
+        backend = sweep_backends.local_backend
+
+    num_cases = sum([len(ladder) for ladder in ladders])
+    print("\n%s ladders with up to %s cases will be run on %s processors" \
+            % (len(ladders), num_cases, nprocs))
+    print("You have %s seconds to abort..." % abort_time)
+
+    time.sleep(abort_time) # give time to abort
+
+    # tasks for the cases in each ladder, task['index'] is the position
+    # of its result in results:
+    tasks = []
+    all_tasks = []
+    for n, ladder in enumerate(ladders):
+        tasks.append([])
+        for level, case in enumerate(ladder):
+            task = {'run_one_case': run_one_case, 'case': case,
+                    'index': len(all_tasks), 'manifest': None,
+                    'retries': retries, 'ladder': n, 'level': level}
+            tasks[n].append(task)
+            all_tasks.append(task)
+
+    summaries = [{'case_ids': [], 'metrics': [], 'changes': [],
+                  'converged': False, 'skipped': []} for ladder in ladders]
+    results = [None for n in range(num_cases)]
+
+    def next_tasks(result):
+        """
+        Return the next task of the ladder of *result*, if it should be run.
+        """
+
+        task = all_tasks[result['index']]
+        ladder_tasks = tasks[task['ladder']]
+        summary = summaries[task['ladder']]
+        if result['status'] != 'done':
+            return []
+
+        try:
+            value = np.asarray(metric(task['case']), dtype=float)
+        except Exception as err:
+            print("*** Metric failed for case %s: %s, stopping its ladder" \
+                    % (result['case_id'], repr(err)))
+            result['status'] = 'failed'
+            result['exception'] = repr(err)
+            return []
+        result['metric'] = value.tolist()
+
+        # levels may finish out of order when started at once:
+        done = [t for t in ladder_tasks if results[t['index']] is not None
+                and results[t['index']]['status'] == 'done'] + [task]
+        done.sort(key=lambda t: t['level'])
+        levels = [t['level'] for t in done]
+        if levels != list(range(len(levels))):
+            return []   # wait for the coarser levels to finish
+
+        values = [np.asarray(results[t['index']]['metric']) if t is not task
+                  else value for t in done]
+        summary['case_ids'] = [sweep_manifest.case_id(t['case'])
+                               for t in done]
+        summary['metrics'] = [v.tolist() for v in values]
+        summary['changes'] = [float(abs(v1 - v0).max())
+                              for v0, v1 in zip(values[:-1], values[1:])]
+
+        summary['converged'] = False
+        if len(values) >= 2:
+            scale = float(abs(values[-1]).max()) if relative else 1.
+            if summary['changes'][-1] <= tol*scale:
+                summary['converged'] = True
+                return []
+
+        # levels below min_levels were started at the beginning:
+        next_level = len(levels)
+        if min_levels <= next_level < len(ladder_tasks):
+            return [ladder_tasks[next_level]]
+        return []
+
+    # the first min_levels of each ladder, coarsest first:
+    initial = [task for ladder_tasks in tasks
+               for task in ladder_tasks[:min_levels]]
+    initial.sort(key=lambda task: task['level'])
+
+    with backend(processes=nprocs, initializer=initializer,
+                 initargs=initargs) as pool:
+        for result in _dispatch_dynamic(pool, initial, nprocs,
+                                        next_tasks=next_tasks):
+            results[result['index']] = result
+
+    for ladder_tasks, summary in zip(tasks, summaries):
+        for task in ladder_tasks:
+            if results[task['index']] is None:
+                results[task['index']] = _skipped_result(task)
+                summary['skipped'].append(results[task['index']]['case_id'])
+
+    report_ladders(summaries, tol, relative)
+    failed = report_failures(results)
+
+    if failed and (on_error == 'raise'):
+        raise RuntimeError("%i of %i cases failed: %s" \
+                % (len(failed), len(results),
+                   ', '.join([result['case_id'] for result in failed])))
+
+    return results, summaries
+
+
+def report_ladders(summaries, tol, relative=False):
+    """
+    Print the levels run, the change in the metric between levels and the
+    levels skipped for each ladder in *summaries*, as returned by
+    run_refinement_ladders.
+    """
+
+    print("\nRefinement ladders, tol = %g%s:" \
+            % (tol, ' (relative)' if relative else ''))
+    num_skipped = 0
+    for summary in summaries:
+        status = 'converged' if summary['converged'] else 'not converged'
+        print("  %s" % status)
+        for n, case_id in enumerate(summary['case_ids']):
+            if n == 0:
+                print("    %s" % case_id)
+            else:
+                print("    %-30s change %.4e" \
+                        % (case_id, summary['changes'][n-1]))
+        for case_id in summary['skipped']:
+            print("    %-30s skipped" % case_id)
+        num_skipped += len(summary['skipped'])
+    print("%i cases were skipped" % num_skipped)
+
+
+def _dispatch_dynamic(pool, tasks, nprocs, cores=None, pin_cores=True,
+                      adaptive_threads=False, next_tasks=None, on_start=None,
+                      max_backfill=None):
+    """
+    Hand out *tasks* to *pool* one at a time, in the order given, and yield
+    the result of each task as it completes.
+
+    At most *nprocs* tasks run at once.  If *cores* is a list of cores, a task
+    is only started when task['case'].get('num_threads', 1) of them are free,
+    and those cores are assigned to the task until it completes.  If the
+    first task waiting does not fit, later (smaller) tasks that do fit are
+    started instead, but only *max_backfill* of them (default *nprocs*):
+    after that no more tasks are started until the first task fits, so that
+    a large case cannot be held back forever by a stream of small ones.
+
+    If *adaptive_threads* is True, a task that is started is given an equal
+    share of the free cores among the tasks that can still start now, i.e.
+    the tasks waiting but at most *nprocs* less the tasks running, if that
+    is more than it asked for, up to task['case'].get('max_threads').
+
+    If *next_tasks* is given, next_tasks(result) is called as each task
+    completes, before its result is yielded, and the list of tasks it
+    returns is added to the front of the tasks waiting.
+    If *on_start* is given, on_start(task) is called as each task is
+    handed to the pool.
+    """
+
+    import queue
+
+    if max_backfill is None:
+        max_backfill = nprocs
+
+    pending = list(tasks)
+    running = 0
+    free_cores = list(cores) if cores is not None else None
+    done = queue.Queue()
+    head = None        # the first task waiting
+    backfilled = 0     # tasks started while head did not fit
+
+    while pending or running:
+
+        i = 0
+        while i < len(pending) and running < nprocs:
+            if pending[0] is not head:
+                head = pending[0]
+                backfilled = 0
+            task = pending[i]
+            if free_cores is not None:
+                num_threads = min(task['case'].get('num_threads', 1),
+                                  len(cores))
+                if num_threads > len(free_cores):
+                    i += 1
+                    continue
+                if i > 0:
+                    # head does not fit, keep its cores once it has
+                    # been passed over max_backfill times:
+                    if backfilled >= max_backfill:
+                        break
+                    backfilled += 1
+                if adaptive_threads:
+                    share = len(free_cores) \
+                            // min(len(pending), nprocs - running)
+                    max_threads = min(task['case'].get('max_threads',
+                                                       len(cores)), len(cores))
+                    num_threads = max(num_threads, min(share, max_threads))
+                task['num_threads'] = num_threads
+                task['cores'] = allocate_cores(free_cores, num_threads)
+                task['pin_cores'] = pin_cores
+                for core in task['cores']:
+                    free_cores.remove(core)
+
+            pending.pop(i)
+            pool.apply_async(_run_task, (task,), callback=done.put,
+                    error_callback=lambda err, task=task: \
+                                    done.put(_failed_result(task, err)))
+            running += 1
+            if on_start is not None:
+                on_start(task)
+
+        result = done.get()
+        running -= 1
+        if free_cores is not None:
+            free_cores.extend(result['cores'])
+        if next_tasks is not None:
+            pending[0:0] = next_tasks(result)
+        yield result
+
+
+def available_cores():
+    """
+    Return a sorted list of the cores this process is allowed to run on.
+    """
+
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    else:
+        return list(range(os.cpu_count()))
+
+
+def numa_nodes():
+    """
+    Return a list with the list of cores in each NUMA node, read from
+    /sys/devices/system/node.  If this is not available, a single node
+    containing all cores is assumed.
+    """
+
+    import glob
+
+    nodes = []
+    for path in sorted(glob.glob('/sys/devices/system/node/node*/cpulist')):
+        with open(path) as f:
+            cpulist = f.read().strip()
+        node = []
+        for item in cpulist.split(','):
+            if '-' in item:
+                first, last = item.split('-')
+                node = node + list(range(int(first), int(last)+1))
+            elif item:
+                node.append(int(item))
+        nodes.append(node)
+
+    if len(nodes) == 0:
+        nodes = [available_cores()]
+    return nodes
+
+
+def allocate_cores(free_cores, num_threads):
+    """
+    Choose *num_threads* cores out of the list *free_cores* for one case.
+    If possible they are all chosen from the NUMA node that has the fewest
+    free cores that still has enough, leaving room on the other nodes for
+    larger cases.  Otherwise the nodes with the most free cores are used.
+    """
+
+    free_by_node = [[core for core in node if core in free_cores]
+                    for node in numa_nodes()]
+
+    # cores not listed in any node, e.g. if numa_nodes found nothing:
+    listed = [core for node in free_by_node for core in node]
+    free_by_node.append([core for core in free_cores if core not in listed])
+
+    fits = [node for node in free_by_node if len(node) >= num_threads]
+    if fits:
+        node = min(fits, key=len)
+        return sorted(node[:num_threads])
+
+    chosen = []
+    for node in sorted(free_by_node, key=len, reverse=True):
+        chosen = chosen + node[:num_threads - len(chosen)]
+    return sorted(chosen)
+
+
+def _run_task(task):
+    """
+    Run a single case in a worker process.
+    *task* is a dictionary with the function 'run_one_case', the 'case'
+    to pass to it, the 'index' of the case in the original caselist,
+    the 'manifest' file in which to record its state (or None),
+    and the number of 'retries' allowed if the case fails.
+    If the task also has 'num_threads', OMP_NUM_THREADS is set to this
+    value while running the case, and if 'pin_cores' is True the process
+    (and so the Clawpack executable) is pinned to the list task['cores'].
+
+    Exceptions are caught so that they do not affect other cases.
+    Returns a dictionary *result* with keys:
+        'index':     index of the case in the original caselist
+        'case_id':   case['case_name'] if present, see sweep_manifest.case_id
+        'outdir':    case['outdir'] if present, else None
+        'status':    'done' or 'failed'
+        'exception': repr of the exception raised if status == 'failed'
+        'traceback': the traceback as a string if status == 'failed'
+        'elapsed':   wall time in seconds, summed over all attempts
+        'attempts':  number of times the case was run
+        'value':     value returned by run_one_case
+        'num_threads', 'cores': as set in task, or None
+    """
+
+    import traceback
+
+    run_one_case = task['run_one_case']
+    case = task['case']
+    manifest = task['manifest']
+
+    result = {'index': task['index'],
+              'case_id': sweep_manifest.case_id(case),
+              'outdir': case.get('outdir', None),
+              'status': None, 'exception': None, 'traceback': None,
+              'elapsed': 0., 'attempts': 0, 'value': None,
+              'num_threads': task.get('num_threads', None),
+              'cores': task.get('cores', None)}
+
+    if result['num_threads'] is not None:
+        omp_num_threads = os.environ.get('OMP_NUM_THREADS', None)
+        os.environ['OMP_NUM_THREADS'] = str(result['num_threads'])
+
+    pinned = task.get('pin_cores', False) and hasattr(os, 'sched_setaffinity')
+    if pinned:
+        affinity = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, result['cores'])
+
+    if manifest is not None:
+        sweep_manifest.set_case_state(manifest, case, 'running')
+
+    while result['attempts'] <= task['retries']:
+        result['attempts'] += 1
+        t_start = time.time()
+        try:
+            result['value'] = run_one_case(case)
+            result['status'] = 'done'
+        except Exception as err:
+            result['status'] = 'failed'
+            result['exception'] = repr(err)
+            result['traceback'] = traceback.format_exc()
+            print('*** Case %s failed on attempt %i: %s' \
+                    % (result['case_id'], result['attempts'], repr(err)))
+        result['elapsed'] += time.time() - t_start
+        if result['status'] == 'done':
+            result['exception'] = None
+            result['traceback'] = None
+            break
+
+    if manifest is not None:
+        sweep_manifest.set_case_state(manifest, case, result['status'],
+                                      message=result['exception'])
+
+    # restore the settings of this worker process for the next case:
+    if result['num_threads'] is not None:
+        if omp_num_threads is None:
+            del os.environ['OMP_NUM_THREADS']
+        else:
+            os.environ['OMP_NUM_THREADS'] = omp_num_threads
+    if pinned:
+        os.sched_setaffinity(0, affinity)
+
+    return result
+
+
+def _failed_result(task, err):
+    """
+    Result for a *task* that could not be run at all, e.g. because
+    it could not be sent to the worker process.
+    """
+
+    return {'index': task['index'],
+            'case_id': sweep_manifest.case_id(task['case']),
+            'outdir': task['case'].get('outdir', None),
+            'status': 'failed', 'exception': repr(err), 'traceback': None,
+            'elapsed': 0., 'attempts': 0, 'value': None,
+            'num_threads': task.get('num_threads', None),
+            'cores': task.get('cores', None)}
+
+
+def _skipped_result(task):
+    """
+    Result for a *task* that was not run, e.g. because its refinement
+    ladder had already converged.
+    """
+
+    result = _failed_result(task, None)
+    result['status'] = 'skipped'
+    result['exception'] = None
+    return result
+
+
+def report_failures(results):
+    """
+    Print the case_id and exception of each failed case in *results*,
+    as returned by run_many_cases_pool, and return the failed results.
+    """
+
+    failed = [result for result in results if result['status'] == 'failed']
+    if failed:
+        print("\n*** %i of %i cases failed:" % (len(failed), len(results)))
+        for result in failed:
+            print("    %s (outdir %s): %s" \
+                    % (result['case_id'], result['outdir'],
+                       result['exception']))
+    return failed
+
+
+def default_case_cost(case):
+    """
+    Return a rough estimate of the relative cost of running *case*,
+    used to sort cases longest-first when schedule == 'dynamic'.
+
+    For an explicit method the work is proportional to the number of grid
+    cells times the number of time steps, and by the CFL condition the
+    number of time steps is proportional to the finest resolution.
+    Second order methods do roughly twice the work per step.  Each output
+    time adds writing (and plotting) work proportional to the number of
+    cells.
+
+    The keys 'mx', 'my', 'mz', 'order' and 'num_output_times' are used
+    if present in *case*, otherwise all cases are given the same cost.
+    Pass a different function as *case_cost* to run_many_cases_pool
+    if these keys are not the ones that determine the cost.
+    """
+
+    num_cells = 1
+    max_cells = 1
+    for key in ['mx', 'my', 'mz']:
+        if case.get(key, None) is not None:
+            num_cells = num_cells * int(case[key])
+            max_cells = max(max_cells, int(case[key]))
+
+    order = case.get('order', 1)
+    num_output_times = case.get('num_output_times', 0)
+
+    cost = float(num_cells * max_cells * order) \
+            + float(num_cells * (num_output_times + 1))
+    return cost
+
+
+def report_makespan(elapsed, makespan, nprocs, num_threads=None):
+    """
+    Print the achieved makespan (wall time for the whole sweep) compared to
+    the ideal makespan, given the wall time *elapsed[i]* of each case.
+
+    The ideal makespan is a lower bound for any schedule on *nprocs*
+    processors: the total work divided evenly between processors,
+    but no less than the longest single case.
+    If *num_threads[i]* is given, case i kept that many of the *nprocs*
+    cores busy.
+    Returns the ideal makespan.
+    """
+
+    if len(elapsed) == 0:
+        return 0.
+
+    if num_threads is None:
+        num_threads = [1 for e in elapsed]
+
+    total = sum([e*n for e, n in zip(elapsed, num_threads)])
+    ideal = max(total / nprocs, max(elapsed))
+    if makespan > 0:
+        efficiency = ideal / makespan
+        idle = 1. - total / (nprocs * makespan)
+    else:
+        efficiency = 1.
+        idle = 0.
+
+    print("\nAchieved makespan: %.2f seconds" % makespan)
+    print("Ideal makespan:    %.2f seconds  (efficiency %.1f%%)" \
+            % (ideal, 100*efficiency))
+    print("Processors were idle %.1f%% of the time" % (100*idle))
+    return ideal
 
 
 
@@ -24,16 +24,23 @@ import sys
 import os
 import time
 import subprocess
+from multiprocessing import current_process
 
 import clawpack.visclaw.frametools as frametools
 
+# other modules in this directory:
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import frame_fingerprints, fast_frames
+sys.path.pop(0)
+
 if sys.platform in ['win32','cygwin']:
     pypath = 'C:/cygwin' + os.environ['CLAW'] + '/python'
     sys.path.append(pypath)
 
 
 def plotclaw(outdir='.', plotdir='_plots', setplot = 'setplot.py', plotdata=None,
-             format='ascii', msgfile='', frames=None, verbose=False):
+             format='ascii', msgfile='', frames=None, verbose=False,
+             incremental=False, case=None):
     """
     Create html and/or latex versions of plots.
 
@@ -41,6 +48,17 @@ def plotclaw(outdir='.', plotdir='_plots', setplot = 'setplot.py', plotdata=None
         setplot is a module containing a function setplot that will be called
                 to set various plotting parameters.
         format specifies the format of the files output from Clawpack
+
+    If plotdata.parallel is True and plotdata.num_procs > 1, frames are
+    plotted using a pool of processes, see plot_frames_pool.
+
+    If plotdata.fast_frames is True, 1d frame plots are made by reusing
+    the figures from one frame to the next, see fast_frames.py.
+
+    If incremental is True, only the frames and figures that have changed
+    since they were last plotted are replotted, see frame_fingerprints.py.
+    The parameters in the dictionary case (if any) are part of the
+    fingerprint of each figure.
     """
 
     from clawpack.visclaw.data import ClawPlotData
@@ -61,88 +79,50 @@ def plotclaw(outdir='.', plotdir='_plots', setplot = 'setplot.py', plotdata=None
         plotdata.num_procs = int(os.environ.get("OMP_NUM_THREADS", 1))
 
 
-    # Make sure plotdata.parallel is False in some cases:
-
-    if plotdata.parallel and (type(setplot) not in [str, bool, type(None)]):
-        print("*** Parallel plotting is not supported when ClawPlotData " \
-                + "attribute setplot is a function, \n" \
-                + "*** Setting plotdata.parallel to False")
-        plotdata.parallel = False
+    if frames is not None:
+        # frames given on the command line, make frame plots only
+        # (plotdir was set up by the original call):
 
-    if plotdata.parallel and (plotdata.num_procs > 1):
+        fast_frames.render_frames(plotdata, frames, format)
 
-        # If this is the original call then we need to split up the work and
-        # call this function again
+    elif (plotdata.parallel and (plotdata.num_procs > 1)) or incremental:
 
-        # First set up plotdir:
+        # First set up plotdir, keeping the frame plots that are
+        # up to date if incremental:
 
-        plotdata._parallel_todo = 'initialize'
-        plotpages.plotclaw_driver(plotdata, verbose=False, format=format)
+        plotclaw_driver_todo(plotdata, 'initialize', format,
+                             keep_frames=incremental)
 
-        if frames is None:
-            if plotdata.num_procs is None:
-                plotdata.num_procs = int(os.environ.get("OMP_NUM_THREADS", 1))
-
-
-            frames = [[] for n in range(plotdata.num_procs)]
-            framenos = frametools.only_most_recent(plotdata.print_framenos,
-                                                   outdir)
-
-            # don't use more procs than frames or infinite loop!!
-            num_procs = min(plotdata.num_procs, len(framenos))
-
-            for (n, frame) in enumerate(framenos):
-                frames[n%num_procs].append(frame)
-
-            # Create subprocesses to work on each
-            plotclaw_cmd = "python %s" % __file__
-            process_queue = []
-            for n in range(num_procs):
-                plot_cmd = "%s %s %s %s" % (plotclaw_cmd,
-                                            outdir,
-                                            plotdir,
-                                            setplot)
-                plot_cmd = plot_cmd + " " + " ".join([str(i) for i in frames[n]])
-
-                process_queue.append(subprocess.Popen(plot_cmd, shell=True))
-
-            poll_interval = 5
-            try:
-                while len(process_queue) > 0:
-                    time.sleep(poll_interval)
-                    for process in process_queue:
-                        if process.poll() is not None:
-                            process_queue.remove(process)
-                    if verbose:
-                        print("Number of processes currently:",len(process_queue))
-
-            # Stop child processes if interrupt was caught or something went
-            # wrong
-            except KeyboardInterrupt:
-                print("ABORTING: A keyboard interrupt was caught.  All " + \
-                      "child processes will be terminated as well.")
-                for process in process_queue:
-                    process.terminate()
-                raise
-
-            except:
-                print("ERROR: An error occurred while waiting for " + \
-                      "plotting processes to complete.  Aborting all " + \
-                      "child processes.")
-                for process in process_queue:
-                    process.terminate()
-                raise
-
-            # After all frames have been plotted via recursive calls,
-            # make index and gauge plots only:
-            plotdata._parallel_todo = 'finalize'
-            plotpages.plotclaw_driver(plotdata, verbose=False, format=format)
+        framenos = frametools.only_most_recent(plotdata.print_framenos,
+                                               outdir)
 
+        if incremental:
+            figures = frame_fingerprints.figure_fingerprints(plotdata, case)
+            todo = frame_fingerprints.stale_frames(plotdata, framenos, case,
+                                                   figures)
+            print("%i of %i frames need to be plotted" \
+                    % (len(set(sum([f for fignos, f in todo], []))),
+                       len(framenos)))
         else:
-            # make frame plots only:
-            plotdata._parallel_todo = 'frames'
-            plotdata.print_framenos = frames
-            plotpages.plotclaw_driver(plotdata, verbose=False, format=format)
+            todo = [(plotdata.print_fignos, framenos)]
+
+        print_fignos = plotdata.print_fignos
+        try:
+            for fignos, todo_framenos in todo:
+                plotdata.print_fignos = fignos
+                plot_frames(plotdata, todo_framenos, setplot, format,
+                            verbose)
+        finally:
+            plotdata.print_fignos = print_fignos
+
+        if incremental:
+            frame_fingerprints.update_fingerprints(plotdata, framenos, case,
+                                                   figures)
+
+        # After all frames have been plotted,
+        # make index and gauge plots only:
+        plotdata.print_framenos = framenos
+        plotclaw_driver_todo(plotdata, 'finalize', format)
 
     else:
         # not in parallel:
@@ -150,6 +130,341 @@ def plotclaw(outdir='.', plotdir='_plots', setplot = 'setplot.py', plotdata=None
         plotpages.plotclaw_driver(plotdata, verbose=False, format=format)
 
 
+def plotclaw_driver_todo(plotdata, todo, format='ascii', keep_frames=False):
+    """
+    Call plotclaw_driver with plotdata._parallel_todo = *todo*, either
+    'initialize' (set up plotdir) or 'finalize' (make the html and latex
+    index files and gauge plots, after the frames have been plotted).
+
+    plotclaw_driver only splits the work in this way if plotdata.parallel is
+    True and plotdata.num_procs > 1, otherwise 'finalize' removes all frame
+    plots and makes them again, so these are set for the call.
+
+    'initialize' removes any old frame plots, unless *keep_frames* is True
+    in which case only plotdir is created if necessary.
+    """
+
+    from clawpack.visclaw import plotpages
+
+    if (todo == 'initialize') and keep_frames:
+        if not os.path.isdir(plotdata.plotdir):
+            os.makedirs(plotdata.plotdir)
+        return
+
+    parallel = plotdata.parallel
+    num_procs = plotdata.num_procs
+    plotdata.parallel = True
+    plotdata.num_procs = max(num_procs or 1, 2)
+    plotdata._parallel_todo = todo
+    try:
+        plotpages.plotclaw_driver(plotdata, verbose=False, format=format)
+    finally:
+        plotdata.parallel = parallel
+        plotdata.num_procs = num_procs
+
+
+def plot_frames(plotdata, framenos, setplot=None, format='ascii',
+                verbose=False):
+    """
+    Make the frame plots for the frames in *framenos*, after plotdir has
+    been initialized (plotdata._parallel_todo = 'initialize').
+
+    If plotdata.parallel is True and plotdata.num_procs > 1, the frames are
+    plotted using a pool of processes, see plot_frames_pool.  In a
+    daemonic process, e.g. a worker of multip_tools.run_many_cases_pool,
+    which cannot start a pool, they are plotted by plotclaw.py subprocesses
+    if *setplot* is the name of a file, unless the sweep is run with
+    sweep_backends.nested_backend, whose workers are not daemonic.
+    """
+
+    # don't use more procs than frames:
+    num_procs = min(plotdata.num_procs, len(framenos))
+
+    if (not plotdata.parallel) or (num_procs <= 1):
+        fast_frames.render_frames(plotdata, framenos, format)
+
+    elif not current_process().daemon:
+        plot_frames_pool(plotdata, framenos, num_procs, format, verbose)
+
+    elif type(setplot) is str:
+        # Daemonic processes (e.g. those of a multiprocessing.Pool
+        # created elsewhere) cannot start a pool of their own,
+        # so run this script in subprocesses instead:
+        _plot_frames_subprocess(plotdata.outdir, plotdata.plotdir, setplot,
+                                framenos, num_procs, format, verbose)
+
+    else:
+        print("*** Parallel plotting is not supported within a " \
+                + "daemonic process when setplot is " \
+                + "a module or function, \n*** plotting frames serially")
+        fast_frames.render_frames(plotdata, framenos, format)
+
+
+def plotclaw_streaming(outdir, plotdir, plotdata, running, format='ascii',
+                       poll_interval=1., incremental=False, case=None):
+    """
+    Plot each frame in *outdir* as soon as it has been completely written,
+    while the Clawpack executable is still running.
+
+    INPUT:
+        plotdata is a ClawPlotData object, as returned by setplot
+        running is a function with no arguments that returns True while
+                the run that is writing to outdir is still going, e.g. the
+                is_alive method of the thread that called runclaw
+        poll_interval is the time in seconds between checks for new frames
+
+    When the run is done, any remaining frames are plotted and the html
+    and/or latex index files are made, as in plotclaw.
+    If incremental is True, the fingerprints of the frames are recorded
+    so that they are not replotted by a later call to plotclaw with
+    incremental=True, see frame_fingerprints.py.
+    """
+
+    from clawpack.visclaw import plotpages
+
+    plotdata.outdir = outdir
+    plotdata.plotdir = plotdir
+
+    print_framenos = plotdata.print_framenos
+
+    # First set up plotdir, without reading any frames yet:
+    plotdata.print_framenos = []
+    plotclaw_driver_todo(plotdata, 'initialize', format)
+    if incremental:
+        figures = frame_fingerprints.figure_fingerprints(plotdata, case)
+
+    plotted = []
+    sizes = {}
+    while True:
+        # check this before looking for frames, so the last frames
+        # are found after the run is done:
+        done = not running()
+
+        for frameno in completed_frames(outdir, sizes, done,
+                                getattr(plotdata, 'file_prefix', 'fort')):
+            if frameno in plotted:
+                continue
+            if (print_framenos != 'all') and (frameno not in print_framenos):
+                continue
+            fast_frames.render_frames(plotdata, [frameno], format)
+            plotted.append(frameno)
+
+        if done:
+            break
+        time.sleep(poll_interval)
+
+    if incremental:
+        frame_fingerprints.update_fingerprints(plotdata, plotted, case,
+                                               figures)
+
+    # After all frames have been plotted, make index and gauge plots only:
+    plotdata.print_framenos = print_framenos
+    plotclaw_driver_todo(plotdata, 'finalize', format)
+
+
+def completed_frames(outdir, sizes, done=False, file_prefix='fort'):
+    """
+    Return a sorted list of the frame numbers for which the Fortran code
+    has finished writing the output files, e.g. fort.q0003 and fort.t0003.
+
+    The fort.t file is written after the fort.q file (and fort.b file for
+    binary output), so a frame is taken to be complete when its fort.t file
+    exists and the size of all its files is the same as the last time this
+    function was called, recorded in the dictionary *sizes*.
+    If *done* is True the run is over and every frame is complete.
+    """
+
+    import glob
+
+    if file_prefix is None:
+        file_prefix = 'fort'
+
+    framenos = []
+    for tfile in glob.glob(os.path.join(outdir, '%s.t*' % file_prefix)):
+        suffix = tfile.split('.t')[-1]
+        if not suffix.isdigit():
+            continue
+        frameno = int(suffix)
+        frame_files = [tfile] \
+            + glob.glob(os.path.join(outdir, '%s.[qb]%s' % (file_prefix,
+                                                           suffix)))
+        frame_sizes = [os.path.getsize(fname) for fname in frame_files]
+        if done or (sizes.get(frameno, None) == frame_sizes):
+            framenos.append(frameno)
+        sizes[frameno] = frame_sizes
+
+    return sorted(framenos)
+
+
+# plotdata for the worker processes of plot_frames_pool, which are forked
+# and so inherit it (it may contain functions that cannot be pickled):
+_pool_plotdata = {}
+
+
+def _init_frame_worker(plotdata, format):
+    _pool_plotdata['plotdata'] = plotdata
+    _pool_plotdata['format'] = format
+
+
+def _plot_one_frame(frameno):
+    """
+    Make the plots for a single frame in a worker of plot_frames_pool.
+    """
+
+    plotdata = _pool_plotdata['plotdata']
+    fast_frames.render_frames(plotdata, [frameno], _pool_plotdata['format'])
+    # pool workers exit without flushing, e.g. to python_output.txt:
+    sys.stdout.flush()
+    return frameno
+
+
+def plot_frames_pool(plotdata, framenos, num_procs, format='ascii',
+                     verbose=False):
+    """
+    Plot the frames in *framenos* using a pool of *num_procs* processes.
+    Each process is handed one frame at a time as it becomes free, and
+    each frame is reported as soon as it is done.
+
+    The worker processes are forked so they inherit *plotdata*, which means
+    this also works when setplot is a function or plotdata was passed in
+    to plotclaw.  Only the frame plots are made, plotdir must already be
+    initialized and the index files made afterwards, as done in plotclaw.
+    """
+
+    import multiprocessing
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+
+    with context.Pool(processes=num_procs, initializer=_init_frame_worker,
+                      initargs=(plotdata, format)) as pool:
+        try:
+            for frameno in pool.imap_unordered(_plot_one_frame, framenos,
+                                               chunksize=1):
+                if verbose:
+                    print("Done plotting frame %i" % frameno)
+
+        # Stop child processes if interrupt was caught:
+        except KeyboardInterrupt:
+            print("ABORTING: A keyboard interrupt was caught.  All " + \
+                  "child processes will be terminated as well.")
+            pool.terminate()
+            raise
+
+
+# printed by _serve_frames after each frame:
+_frame_done = 'plotclaw: done frame'
+_frame_failed = 'plotclaw: failed frame'
+
+
+def _plot_frames_subprocess(outdir, plotdir, setplot, framenos, num_procs,
+                            format='ascii', verbose=False):
+    """
+    Plot the frames in *framenos* by running this script in *num_procs*
+    subprocesses, see _serve_frames, handing each one the next frame as
+    soon as it is done with the last one.
+    Only used when plot_frames_pool cannot be, see plot_frames.
+    """
+
+    import queue, threading
+
+    todo = list(framenos)
+    lines = queue.Queue()
+
+    def read_lines(process):
+        for line in process.stdout:
+            lines.put((process, line))
+        lines.put((process, None))
+
+    def send_next(process):
+        if todo:
+            process.stdin.write('%i\n' % todo.pop(0))
+            process.stdin.flush()
+        else:
+            process.stdin.close()
+
+    plot_cmd = [sys.executable, os.path.abspath(__file__), outdir, plotdir,
+                setplot, '-', format]
+    processes = []
+    failed = []
+    try:
+        for n in range(min(num_procs, len(todo))):
+            process = subprocess.Popen(plot_cmd, stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE,
+                                       universal_newlines=True)
+            processes.append(process)
+            threading.Thread(target=read_lines, args=(process,),
+                             daemon=True).start()
+            send_next(process)
+
+        running = len(processes)
+        while running:
+            process, line = lines.get()
+            if line is None:
+                running -= 1
+                if process.wait() != 0:
+                    raise RuntimeError("Plotting process %i failed" \
+                                        % process.pid)
+                if verbose:
+                    print("Plotting process %i is done" % process.pid)
+            elif line.startswith(_frame_done):
+                if verbose:
+                    print("Done plotting frame %s" % line.split()[-1])
+                send_next(process)
+            elif line.startswith(_frame_failed):
+                failed.append(int(line.split()[-1]))
+                send_next(process)
+            else:
+                # output of setplot and plotting:
+                sys.stdout.write(line)
+
+    # Stop child processes if interrupt was caught or something went
+    # wrong
+    except:
+        print("ERROR: An error occurred while waiting for " + \
+              "plotting processes to complete.  Aborting all " + \
+              "child processes.")
+        for process in processes:
+            process.terminate()
+        raise
+
+    if failed:
+        raise RuntimeError("Plotting failed for frames %s" \
+                            % ', '.join([str(f) for f in sorted(failed)]))
+
+
+def _serve_frames(outdir, plotdir, setplot, format='ascii'):
+    """
+    Plot the frames whose numbers are read from stdin, one per line, until
+    stdin is closed, printing a line starting with _frame_done (or
+    _frame_failed) after each one.  Run in subprocesses by
+    _plot_frames_subprocess, which sets up plotdir.
+    """
+
+    import traceback
+    from clawpack.visclaw.data import ClawPlotData
+
+    plotdata = ClawPlotData()
+    plotdata.outdir = outdir
+    plotdata.plotdir = plotdir
+    plotdata.setplot = setplot
+    plotdata.format = format
+    plotdata = frametools.call_setplot(plotdata.setplot, plotdata)
+
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        frameno = int(line)
+        try:
+            fast_frames.render_frames(plotdata, [frameno], format)
+            print('%s %i' % (_frame_done, frameno), flush=True)
+        except Exception:
+            traceback.print_exc()
+            print('%s %i' % (_frame_failed, frameno), flush=True)
+
 
 if __name__ == '__main__':
     """
@@ -157,7 +472,10 @@ if __name__ == '__main__':
     any arguments passed in.
     """
 
-    if len(sys.argv) > 4:
+    if len(sys.argv) > 4 and sys.argv[4] == '-':
+        # frame numbers on stdin, see _plot_frames_subprocess:
+        _serve_frames(*sys.argv[1:4] + sys.argv[5:6])
+    elif len(sys.argv) > 4:
         frames = [int(frame) for frame in sys.argv[4:]]
         plotclaw(sys.argv[1], sys.argv[2], sys.argv[3], frames=frames)
     elif len(sys.argv) == 4:
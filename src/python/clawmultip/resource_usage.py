@@ -0,0 +1,341 @@
+"""
+Resources used by each phase of a case: wall time, user and system CPU time,
+peak resident memory and bytes written.
+
+run_one_case_clawpack measures the phases 'setrun' (loading setrun and
+calling it), 'write' (rundata.write), 'runclaw' (the Clawpack executable)
+and 'plot' (loading setplot and plotting), or 'runclaw_plot' if
+case['stream_plots'] is True since running and plotting then overlap.
+These are recorded in the results_index record of the case as
+record['usage'][phase], a dictionary with keys
+    'wall':           wall time in seconds
+    'user', 'sys':    CPU time in seconds, of this process and of the child
+                      processes that finished during the phase (e.g. the
+                      Fortran code run by runclaw)
+    'maxrss_mb':      peak resident memory in MB of this process during
+                      the phase
+    'child_maxrss_mb':  largest peak resident memory in MB of a child
+                      process run during the phase, if any
+    'bytes_written':  bytes written by this process and its children
+                      (all writes, including to scratch or tmpfs)
+    'disk_bytes_written':  bytes sent to storage, which is 0 for tmpfs
+
+CPU time and memory come from resource.getrusage, and memory and bytes
+written from /proc on Linux.  On other systems the peak memory is that of
+the whole life of the process and the bytes written are not available.
+
+To summarize the resources used by the cases of a sweep, e.g. to size the
+nodes or spot cases whose cost explodes, use
+
+    report_usage('_case_index')
+
+or execute
+    python resource_usage.py _case_index
+"""
+
+import os, sys, time, threading, resource
+
+# other modules in this directory:
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import results_index
+sys.path.pop(0)
+
+# ru_maxrss is in kilobytes on Linux but in bytes on macOS:
+_maxrss_mb = 1. / 1024**2 if sys.platform == 'darwin' else 1. / 1024
+
+
+def _proc_io(pid='self'):
+    """
+    Return the I/O counters in /proc/pid/io as a dictionary, or {} if they
+    are not available.  These include the children that have finished.
+    """
+
+    try:
+        with open('/proc/%s/io' % pid) as f:
+            return dict([(line.split(':')[0], int(line.split(':')[1]))
+                         for line in f if ':' in line])
+    except (OSError, ValueError):
+        return {}
+
+
+def _vm_hwm_mb(pid='self'):
+    """
+    Return the peak resident memory of process *pid* in MB from
+    /proc/pid/status, or None if it is not available.
+    """
+
+    try:
+        with open('/proc/%s/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _reset_peak():
+    """
+    Reset the peak resident memory of this process (VmHWM) to its current
+    value, so the peak of a phase can be measured.  Returns False if this
+    is not possible (before Linux 4.0 or on other systems).
+    """
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _descendants(pid='self'):
+    """
+    Return the pids of the running child processes of *pid* and of their
+    children, from /proc (empty if not available).
+    """
+
+    import glob
+
+    pids = []
+    for fname in glob.glob('/proc/%s/task/*/children' % pid):
+        try:
+            with open(fname) as f:
+                pids.extend(f.read().split())
+        except OSError:
+            pass
+    for child in list(pids):
+        pids.extend(_descendants(child))
+    return pids
+
+
+class ChildPeakSampler(threading.Thread):
+    """
+    Thread that records the largest peak resident memory (in MB) of the
+    child processes of this process as *maxrss_mb*, checking every
+    *interval* seconds (more often at first, for short runs) until stop()
+    is called.
+
+    getrusage is not used for this since it only gives the largest peak
+    of all the children that have finished in the life of the process,
+    which in a worker process includes the cases it ran before, and since
+    it includes the size of this process when a child is forked.
+    For the same reason, children still running the executable of this
+    process (forked but not yet running their own program) are skipped.
+    *available* is False if /proc cannot be used for this.
+    """
+
+    def __init__(self, interval=0.1):
+        threading.Thread.__init__(self, daemon=True)
+        self.interval = interval
+        self.maxrss_mb = 0.
+        self.available = os.path.isdir('/proc/self/task')
+        self._stop_event = threading.Event()
+
+    def run(self):
+        wait = 0.005
+        try:
+            exe = os.readlink('/proc/self/exe')
+        except OSError:
+            exe = None
+        while self.available and not self._stop_event.is_set():
+            for pid in _descendants():
+                try:
+                    if os.readlink('/proc/%s/exe' % pid) == exe:
+                        continue
+                except OSError:
+                    # already finished
+                    continue
+                maxrss_mb = _vm_hwm_mb(pid)
+                if maxrss_mb is not None:
+                    self.maxrss_mb = max(self.maxrss_mb, maxrss_mb)
+            self._stop_event.wait(wait)
+            wait = min(2*wait, self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _snapshot():
+    return {'wall': time.time(),
+            'self': resource.getrusage(resource.RUSAGE_SELF),
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN),
+            'io': _proc_io()}
+
+
+class Phase(object):
+    """
+    Measure the resources used by one phase of a case, either with
+        with Phase(usage, 'write'):
+            rundata.write(outdir)
+    or by calling start() and stop(), and set usage[name] to a dictionary
+    with the keys described above.  Set *children* to True if the phase
+    runs child processes, so their peak memory is sampled while they run.
+    When used in a with block, the usage is recorded even if the block
+    raises an exception.
+    """
+
+    def __init__(self, usage, name, children=False):
+        self.usage = usage
+        self.name = name
+        self.children = children
+        self._start = None
+        self._sampler = None
+
+    def start(self):
+        self._start = _snapshot()
+        self._reset = _reset_peak()
+        if self.children:
+            self._sampler = ChildPeakSampler()
+            self._sampler.start()
+        return self
+
+    def stop(self):
+        """
+        Record the usage since start() in usage[name], only once.
+        """
+
+        if self._start is None:
+            return
+        if self._sampler is not None:
+            self._sampler.stop()
+        start = self._start
+        self._start = None
+        end = _snapshot()
+
+        cpu = lambda key, attr: getattr(end[key], attr) \
+                                - getattr(start[key], attr)
+        result = {'wall': end['wall'] - start['wall'],
+                  'user': cpu('self', 'ru_utime') + cpu('children',
+                                                        'ru_utime'),
+                  'sys': cpu('self', 'ru_stime') + cpu('children',
+                                                       'ru_stime')}
+
+        maxrss_mb = _vm_hwm_mb() if self._reset else None
+        if maxrss_mb is None:
+            maxrss_mb = end['self'].ru_maxrss * _maxrss_mb
+        result['maxrss_mb'] = maxrss_mb
+
+        child_maxrss_mb = 0.
+        if self._sampler is not None and self._sampler.available:
+            child_maxrss_mb = self._sampler.maxrss_mb
+        elif end['children'].ru_maxrss > start['children'].ru_maxrss:
+            # a child finished in this phase with the largest peak so far
+            # (or this process was larger when the child was forked):
+            child_maxrss_mb = end['children'].ru_maxrss * _maxrss_mb
+        if child_maxrss_mb > 0:
+            result['child_maxrss_mb'] = child_maxrss_mb
+
+        if end['io'] and start['io']:
+            result['bytes_written'] = end['io']['wchar'] \
+                                      - start['io']['wchar']
+            result['disk_bytes_written'] = end['io']['write_bytes'] \
+                                           - start['io']['write_bytes']
+        self.usage[self.name] = result
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+        return False
+
+
+def case_usage(record):
+    """
+    Return the total usage of all phases in a results_index *record*:
+    the sums of wall, user, sys and bytes written, and as maxrss_mb the
+    largest memory used at once by the case, the peak of this process
+    plus that of its child processes in the same phase.
+    """
+
+    total = {'wall': 0., 'user': 0., 'sys': 0., 'maxrss_mb': 0.,
+             'bytes_written': 0}
+    for usage in record.get('usage', {}).values():
+        for key in ['wall', 'user', 'sys', 'bytes_written']:
+            total[key] += usage.get(key, 0)
+        total['maxrss_mb'] = max(total['maxrss_mb'], usage['maxrss_mb']
+                                 + usage.get('child_maxrss_mb', 0.))
+    return total
+
+
+def report_usage(index_dir='_case_index', num_cases=5, fname=None):
+    """
+    Print a summary of the resources used by the cases in *index_dir*:
+    for each phase the total and largest wall time and CPU time, the largest
+    peak memory of this process and of a child process (e.g. the Fortran
+    code), and the bytes written, and then the *num_cases* cases with the
+    most CPU time and with the largest peak memory (see case_usage), with
+    the ratio to the median case.
+    If *fname* is given, the report is also written to this file.
+    Returns the list of lines of the report.
+    """
+
+    import numpy as np
+
+    records = [record for record in results_index.read_index(index_dir)
+               if record.get('usage')]
+    lines = ['Resource usage of %i cases in %s' % (len(records), index_dir)]
+    if not records:
+        lines.append('  (no usage recorded)')
+
+    phases = []
+    for record in records:
+        for name in record['usage']:
+            if name not in phases:
+                phases.append(name)
+
+    if records:
+        lines.append('')
+        lines.append('%-13s %5s %9s %9s %9s %9s %8s %8s %10s' \
+                % ('phase', 'cases', 'wall (s)', 'max wall', 'CPU (s)',
+                   'max CPU', 'max MB', 'child MB', 'MB written'))
+    for name in phases:
+        usages = [record['usage'][name] for record in records
+                  if name in record['usage']]
+        wall = np.array([usage['wall'] for usage in usages])
+        cpu = np.array([usage['user'] + usage['sys'] for usage in usages])
+        maxrss = max([usage['maxrss_mb'] for usage in usages])
+        child_maxrss = max([usage.get('child_maxrss_mb', 0.)
+                            for usage in usages])
+        written = sum([usage.get('bytes_written', 0) for usage in usages])
+        lines.append('%-13s %5i %9.2f %9.2f %9.2f %9.2f %8.1f %8.1f %10.1f' \
+                % (name, len(usages), wall.sum(), wall.max(), cpu.sum(),
+                   cpu.max(), maxrss, child_maxrss, written / 1024.**2))
+
+    totals = [(record['case_name'], case_usage(record))
+              for record in records]
+    for key, label in [('cpu', 'CPU time (s)'), ('maxrss_mb', 'peak MB')]:
+        if not totals:
+            break
+        if key == 'cpu':
+            value = lambda total: total['user'] + total['sys']
+        else:
+            value = lambda total: total['maxrss_mb']
+        median = np.median([value(total) for name, total in totals])
+        lines.append('')
+        lines.append('Cases with the largest %s (median %.2f):' \
+                % (label, median))
+        ranked = sorted(totals, key=lambda nt: value(nt[1]), reverse=True)
+        for name, total in ranked[:num_cases]:
+            ratio = value(total) / median if median > 0 else np.inf
+            lines.append('    %-30s %10.2f  (%.1f x median)' \
+                    % (name, value(total), ratio))
+
+    for line in lines:
+        print(line)
+    if fname is not None:
+        with open(fname, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        print('Created %s' % fname)
+    return lines
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        index_dir = sys.argv[1]
+    else:
+        index_dir = '_case_index'
+    report_usage(index_dir)
@@ -0,0 +1,199 @@
+"""
+Structured index of the cases run in a parameter sweep.
+
+run_one_case_clawpack writes one JSON file per case to an index directory
+(case['index_dir'], by default '_case_index'), containing the parameters of
+the case, its status ('running', 'done' or 'failed'), start and finish
+times, timings and output paths.  Each file is written to a temporary file
+and then renamed, so many processes can write to the index at once and a
+reader never sees a partially written record.
+
+Use query to find cases by parameter values, e.g.
+    query('_case_index', order=2, mx=[100,200])
+    query('_case_index', status='failed')
+    query('_case_index', mx=lambda mx: mx > 100)
+instead of parsing the case_info.txt file in each outdir.
+
+merge_index collects all the records in a single JSON file and
+write_summary writes a text summary of all the cases, e.g. at the end of
+a sweep:
+    python results_index.py _case_index
+"""
+
+import os, sys, json, glob, socket, datetime
+
+
+def jsonable(value):
+    """
+    Return *value* if it can be written as JSON, or a string representation
+    of it if not (e.g. for functions passed in a case dictionary).
+    """
+
+    try:
+        json.dumps(value)
+        return value
+    except (TypeError, ValueError):
+        return repr(value)
+
+
+def timenow():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S') + ' UTC'
+
+
+def new_record(case):
+    """
+    Return a new record for *case*, in state 'running'.
+    """
+
+    return {'case_name': case['case_name'],
+            'params': {k: jsonable(v) for k, v in case.items()},
+            'outdir': case.get('outdir', None),
+            'plotdir': case.get('plotdir', None),
+            'status': 'running',
+            'started': timenow(),
+            'finished': None,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'timings': {},
+            'error': None}
+
+
+def record_file(index_dir, case_name):
+    return os.path.join(index_dir, '%s.json' % case_name)
+
+
+def write_record(index_dir, record):
+    """
+    Write *record* to index_dir/case_name.json, replacing any previous
+    record for this case.
+    """
+
+    os.makedirs(index_dir, exist_ok=True)
+    fname = record_file(index_dir, record['case_name'])
+    tmpname = '%s.tmp%i' % (fname, os.getpid())
+    with open(tmpname, 'w') as f:
+        json.dump(record, f, indent=1, default=repr)
+    os.replace(tmpname, fname)
+
+
+def read_record(index_dir, case_name):
+    """
+    Return the record for *case_name*, or None if there is none.
+    """
+
+    fname = record_file(index_dir, case_name)
+    if not os.path.isfile(fname):
+        return None
+    with open(fname) as f:
+        return json.load(f)
+
+
+def update_record(index_dir, case_name, updates, case=None):
+    """
+    Update the record for *case_name* with the dictionary *updates*, e.g.
+    when a case is plotted separately after it was run.  Dictionaries in the
+    record (such as 'timings') are updated rather than replaced.
+    The different stages of one case never run at the same time,
+    so it is safe to read and then rewrite the record.
+
+    If there is no record yet (e.g. plotting a case that was run before the
+    index was used), a new record is made for *case* (or a case with only
+    *case_name*, if None) as by new_record, but with status None since
+    it is not known whether the case was run, unless *updates* sets it.
+    """
+
+    record = read_record(index_dir, case_name)
+    if record is None:
+        if case is None:
+            case = {'case_name': case_name}
+        record = new_record(case)
+        record['status'] = None
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(record.get(key), dict):
+            record[key].update(value)
+        else:
+            record[key] = value
+    write_record(index_dir, record)
+    return record
+
+
+def read_index(index_dir='_case_index'):
+    """
+    Return a list of all the records in *index_dir*, sorted by case_name.
+    """
+
+    records = []
+    for fname in sorted(glob.glob(os.path.join(index_dir, '*.json'))):
+        with open(fname) as f:
+            records.append(json.load(f))
+    records.sort(key=lambda record: str(record['case_name']))
+    return records
+
+
+def _matches(value, wanted):
+    if callable(wanted):
+        return wanted(value)
+    elif isinstance(wanted, (list, tuple, set)):
+        return value in wanted
+    else:
+        return value == wanted
+
+
+def query(index_dir='_case_index', status=None, **params):
+    """
+    Return the records in *index_dir* with the given *status* (if not None)
+    and whose parameters match *params*.  Each value in *params* can be
+    a single value, a list of allowed values, or a function that returns
+    True for the values wanted.
+    """
+
+    records = []
+    for record in read_index(index_dir):
+        if (status is not None) \
+                and not _matches(record.get('status'), status):
+            continue
+        record_params = record.get('params', {})
+        if all([(k in record_params) and _matches(record_params[k], v)
+                for k, v in params.items()]):
+            records.append(record)
+    return records
+
+
+def merge_index(index_dir='_case_index', fname='case_index.json'):
+    """
+    Write all the records in *index_dir* to a single JSON file *fname*.
+    """
+
+    records = read_index(index_dir)
+    with open(fname, 'w') as f:
+        json.dump(records, f, indent=1)
+    print('Merged %i records into %s' % (len(records), fname))
+
+
+def write_summary(index_dir='_case_index', fname='case_summary.txt'):
+    """
+    Write a text summary of all the cases in *index_dir* to *fname*.
+    """
+
+    records = read_index(index_dir)
+    with open(fname, 'w') as f:
+        for record in records:
+            f.write('=========\n%s\n\ncase_name: %s\n' \
+                    % (record.get('started'), record['case_name']))
+            f.write('%s:  %s\n' % ('status'.ljust(20), record.get('status')))
+            for k, v in record.get('timings', {}).items():
+                f.write('%s:  %s\n' % (k.ljust(20), v))
+            for k, v in record.get('params', {}).items():
+                if k != 'case_name':
+                    f.write('%s:  %s\n' % (k.ljust(20), v))
+    print('Created %s' % fname)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        index_dir = sys.argv[1]
+    else:
+        index_dir = '_case_index'
+    write_summary(index_dir)
+    merge_index(index_dir)
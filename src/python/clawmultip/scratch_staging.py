@@ -0,0 +1,289 @@
+"""
+Run cases in node-local scratch space and move the results to the shared
+file system afterwards.
+
+If case['scratch_dir'] is set, e.g. to '/dev/shm' or '$TMPDIR',
+run_one_case_clawpack writes the .data files, fort.* frames, logs and plots
+of the case to a new directory in scratch_dir rather than to case['outdir']
+and case['plotdir'], which are often on NFS where creating many small files
+is slow.  When the case is done (or has failed) a separate background
+process copies the results to the final outdir and plotdir, using rsync if
+it is available, and then removes them from scratch, so the worker process
+can start its next case straight away.  The outdir and plotdir of the case
+are replaced, not merged with any earlier results there.
+
+The transfer process updates the results_index record of the case:
+record['transfer'] is 'pending' until the files are in place, then 'done'
+(or 'failed', in which case the files are left in scratch and the error is
+in transfer_log.txt next to them).  Before reading the output of a sweep,
+e.g. right after run_many_cases_pool, call
+
+    scratch_staging.wait_for_transfers(caselist)
+
+plot_stage_clawpack waits for the transfer of its case before plotting.
+
+If case['scratch_limit'] is set (in bytes, or a string such as '2G'),
+a case does not start until the space used in scratch_dir by the sweeps of
+this user, including results not yet transferred, is below the limit.
+The limit is checked before each case starts, so it can be exceeded by the
+output of the cases running at that time.
+"""
+
+import os, sys, json, time, shutil, subprocess
+
+# other modules in this directory:
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import results_index
+sys.path.pop(0)
+
+
+def scratch_root(scratch_dir):
+    """
+    Return the directory in *scratch_dir* (after expanding environment
+    variables and ~) used for the cases of this user, creating it if needed.
+    """
+
+    import getpass
+
+    root = os.path.expanduser(os.path.expandvars(scratch_dir))
+    root = os.path.join(os.path.abspath(root),
+                        'clawmultip_%s' % getpass.getuser())
+    os.makedirs(root, exist_ok=True)
+    return root
+
+
+def parse_size(size):
+    """
+    Return the number of bytes for *size*, an integer or a string such as
+    '500M' or '2G'.
+    """
+
+    if not isinstance(size, str):
+        return int(size)
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(float(size))
+
+
+def scratch_usage(root):
+    """
+    Return the total size in bytes of the files in *root*.
+    """
+
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        for fname in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, fname)).st_size
+            except OSError:
+                # removed by a transfer in the meantime
+                pass
+    return total
+
+
+def wait_for_scratch(root, limit, poll=1.):
+    """
+    Wait until less than *limit* bytes are used in *root*.
+    Returns the time in seconds spent waiting.
+    """
+
+    t_start = time.time()
+    limit = parse_size(limit)
+    message_printed = False
+    while scratch_usage(root) >= limit:
+        if not message_printed:
+            print('Waiting for scratch space in %s (limit %i bytes)' \
+                    % (root, limit))
+            message_printed = True
+        time.sleep(poll)
+    return time.time() - t_start
+
+
+def stage_dirs(case):
+    """
+    Create a new directory in the scratch space for *case* and return
+    (stage_dir, outdir, plotdir), the directory and the outdir and plotdir
+    to use in it.  plotdir is None if case['plotdir'] is None.
+    A plotdir that is inside the final outdir is put in the same place
+    inside the scratch outdir.
+    """
+
+    import tempfile
+
+    root = scratch_root(case['scratch_dir'])
+    stage_dir = tempfile.mkdtemp(prefix='%s_' % case['case_name'], dir=root)
+
+    outdir = os.path.join(stage_dir, 'outdir')
+    plotdir = case.get('plotdir', None)
+    if plotdir is not None:
+        relpath = os.path.relpath(plotdir, case['outdir'])
+        if relpath.split(os.sep)[0] == '..':
+            plotdir = os.path.join(stage_dir, 'plotdir')
+        else:
+            plotdir = os.path.join(outdir, relpath)
+    return stage_dir, outdir, plotdir
+
+
+def start_transfer(case, stage_dir, cache_key=None):
+    """
+    Start a background process that moves the results of *case* from
+    *stage_dir* (see stage_dirs) to case['outdir'] and case['plotdir'].
+    If *cache_key* is not None, the outdir is registered in
+    case['cache_dir'] once the files are in place, see
+    clawmultip_tools.register_cached_output.
+
+    The process is started in a new session, so it is not stopped when the
+    pool of worker processes is terminated at the end of the sweep.
+    """
+
+    transfer = {'stage_dir': stage_dir,
+                'case_name': case['case_name'],
+                'outdir': os.path.abspath(case['outdir']),
+                'index_dir': os.path.abspath(case.get('index_dir',
+                                                      '_case_index')),
+                'cache_key': cache_key,
+                'cache_dir': os.path.abspath(case.get('cache_dir',
+                                                      '_clawmultip_cache'))}
+    plotdir = case.get('plotdir', None)
+    transfer['plotdir'] = None if plotdir is None else \
+                          os.path.abspath(plotdir)
+
+    fname = os.path.join(stage_dir, 'transfer.json')
+    with open(fname, 'w') as f:
+        json.dump(transfer, f, indent=1)
+
+    with open(os.path.join(stage_dir, 'transfer_log.txt'), 'w') as log:
+        subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                          'transfer', fname],
+                         stdout=log, stderr=subprocess.STDOUT,
+                         stdin=subprocess.DEVNULL, start_new_session=True)
+
+
+def move_dir(src, dst):
+    """
+    Move directory *src* to *dst*, replacing *dst* and everything in it
+    (e.g. fort.* files of an earlier run with more frames), and remove *src*.
+
+    The files are first copied to a new directory next to *dst*, using rsync
+    if it is available, which then replaces *dst* by two renames, so *dst*
+    never holds a mix of old and new files (it is only missing between
+    the two renames).
+    """
+
+    dst = os.path.normpath(dst)
+    parent = os.path.dirname(os.path.abspath(dst))
+    os.makedirs(parent, exist_ok=True)
+    tmp = '%s.transfer%i' % (dst, os.getpid())
+    old = '%s.old%i' % (dst, os.getpid())
+    for path in [tmp, old]:
+        if os.path.isdir(path):
+            # left by an earlier transfer that was interrupted:
+            shutil.rmtree(path)
+
+    if shutil.which('rsync') is not None:
+        subprocess.check_call(['rsync', '-a', '--remove-source-files',
+                               src + '/', tmp + '/'])
+    else:
+        shutil.copytree(src, tmp, symlinks=True)
+
+    if os.path.isdir(dst):
+        os.rename(dst, old)
+        os.rename(tmp, dst)
+        shutil.rmtree(old)
+    else:
+        os.rename(tmp, dst)
+    shutil.rmtree(src)
+
+
+def transfer(fname):
+    """
+    Move the results described in the JSON file *fname* written by
+    start_transfer and update the results_index record of the case.
+    """
+
+    with open(fname) as f:
+        transfer = json.load(f)
+
+    stage_dir = transfer['stage_dir']
+    index_dir = transfer['index_dir']
+    case_name = transfer['case_name']
+    t_start = time.time()
+
+    try:
+        plotdir = os.path.join(stage_dir, 'plotdir')
+        if transfer['plotdir'] is not None and os.path.isdir(plotdir):
+            move_dir(plotdir, transfer['plotdir'])
+        move_dir(os.path.join(stage_dir, 'outdir'), transfer['outdir'])
+
+        if transfer['cache_key'] is not None:
+            import clawmultip_tools
+            clawmultip_tools.register_cached_output(transfer['cache_key'],
+                                                    transfer['outdir'],
+                                                    transfer['cache_dir'])
+    except Exception as err:
+        import traceback
+        traceback.print_exc()
+        results_index.update_record(index_dir, case_name,
+                                    {'transfer': 'failed',
+                                     'transfer_error': '%r, see %s' \
+                                        % (err, stage_dir)})
+        return False
+
+    results_index.update_record(index_dir, case_name,
+                                {'transfer': 'done',
+                                 'timings': {'transfer_time':
+                                             time.time() - t_start}})
+    shutil.rmtree(stage_dir)
+    return True
+
+
+def wait_for_transfer(index_dir, case_name, timeout=None, poll=0.5):
+    """
+    Wait until the results of *case_name* have been transferred from scratch
+    space, according to its record in *index_dir*.  Returns at once for a
+    case that was not staged.  Raises RuntimeError if the transfer failed,
+    or if it is not done after *timeout* seconds.
+    """
+
+    t_start = time.time()
+    while True:
+        record = results_index.read_record(index_dir, case_name)
+        state = None if record is None else record.get('transfer', None)
+        if state == 'failed':
+            raise RuntimeError('Transfer of case %s failed: %s' \
+                    % (case_name, record.get('transfer_error', None)))
+        if state != 'pending':
+            return
+        if timeout is not None and time.time() - t_start > timeout:
+            raise RuntimeError('Transfer of case %s not done after %g s' \
+                    % (case_name, timeout))
+        time.sleep(poll)
+
+
+def wait_for_transfers(caselist, timeout=None):
+    """
+    Wait until the results of all cases in *caselist* have been transferred
+    from scratch space, see wait_for_transfer.
+    """
+
+    t_start = time.time()
+    for case in caselist:
+        if case.get('scratch_dir', None) is None:
+            continue
+        if timeout is not None:
+            timeout_case = max(0., timeout - (time.time() - t_start))
+        else:
+            timeout_case = None
+        wait_for_transfer(case.get('index_dir', '_case_index'),
+                          case['case_name'], timeout_case)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) == 3 and sys.argv[1] == 'transfer':
+        ok = transfer(sys.argv[2])
+        sys.exit(0 if ok else 1)
+    else:
+        print('Usage: python scratch_staging.py transfer transfer.json')
@@ -0,0 +1,205 @@
+"""
+Pack the outdir of each finished case into a compressed zip archive, to keep
+the thousands of small output files of a sweep within a disk quota.
+
+archive_outdir(outdir) writes all the files in outdir to outdir + '.zip' and
+then removes outdir.  To do this for every case in the background while the
+sweep continues, pass
+
+    post_case=sweep_archive.archive_case
+
+to multip_tools.run_many_cases_pool, which calls it in a separate pool of
+*nprocs_post* processes for each case as soon as the case is done.
+The compression is set by case['archive_codec'] (see codecs, default
+'deflate') and case['archive_level'] (e.g. 1 to 9, default None for the
+default level of the codec).  Make the plots before the outdir is archived,
+e.g. by running and plotting each case with run_one_case_clawpack.
+
+The frames can be read from the archive without extracting it, using
+sweep_data.read_frame, SweepDataset and load_case_info in the same way as
+for an outdir.  Binary frames in an archive made with codec 'store' are
+memory-mapped as they are for an outdir, compressed ones are decompressed
+one frame at a time.
+
+The output of a case that has been archived is still used by
+run_one_case_clawpack: a run with case['cache'] = True whose cache key
+matches the archived run takes its output from the archive, and plotting
+without running (case['xclawcmd'] = None or plot_stage_clawpack) extracts
+the archive into outdir, makes the plots and archives outdir again.
+"""
+
+import os, sys, shutil, zipfile
+
+# other modules in this directory:
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import results_index, scratch_staging
+sys.path.pop(0)
+
+# codecs supported by zipfile, see archive_outdir:
+codecs = {'store': zipfile.ZIP_STORED,
+          'deflate': zipfile.ZIP_DEFLATED,
+          'bzip2': zipfile.ZIP_BZIP2,
+          'lzma': zipfile.ZIP_LZMA}
+if hasattr(zipfile, 'ZIP_ZSTANDARD'):
+    # Python 3.14 and later:
+    codecs['zstd'] = zipfile.ZIP_ZSTANDARD
+
+
+def archive_name(outdir):
+    """
+    Return the name of the archive for *outdir*.
+    """
+
+    return os.path.normpath(outdir) + '.zip'
+
+
+def archive_outdir(outdir, codec='deflate', level=None, remove=True):
+    """
+    Write all the files in *outdir* (including subdirectories) to the
+    archive archive_name(outdir), compressed with *codec* (one of the keys
+    of codecs) at compression *level* (not used for 'store' and 'lzma'),
+    and then remove *outdir* if *remove* is True.
+
+    The archive is written to a temporary file and renamed when it is
+    complete, so a partial archive is never left in its place.
+    Returns the name of the archive.
+    """
+
+    if codec not in codecs:
+        raise ValueError("Unrecognized codec = %s, use one of %s" \
+                % (codec, ', '.join(sorted(codecs.keys()))))
+
+    archive = archive_name(outdir)
+    tmpname = '%s.tmp%i' % (archive, os.getpid())
+
+    with zipfile.ZipFile(tmpname, 'w', compression=codecs[codec],
+                         compresslevel=level, allowZip64=True) as zf:
+        for dirpath, dirnames, filenames in os.walk(outdir):
+            dirnames.sort()
+            for fname in sorted(filenames):
+                path = os.path.join(dirpath, fname)
+                zf.write(path, os.path.relpath(path, outdir))
+
+    # check the archive before removing the files:
+    with zipfile.ZipFile(tmpname) as zf:
+        bad_file = zf.testzip()
+    if bad_file is not None:
+        os.remove(tmpname)
+        raise RuntimeError("Archive of %s failed at %s" % (outdir, bad_file))
+
+    os.replace(tmpname, archive)
+    if remove:
+        shutil.rmtree(outdir)
+    return archive
+
+
+def archive_case(case):
+    """
+    Archive case['outdir'] for a case that is done, for use as *post_case*
+    in multip_tools.run_many_cases_pool.  Waits for the results to be moved
+    from scratch space first if case['scratch_dir'] is set, see
+    scratch_staging.py.  The archive is recorded in the results_index
+    record of the case as record['archive'].
+    Returns the name of the archive.
+    """
+
+    import time
+
+    index_dir = case.get('index_dir', '_case_index')
+    if case.get('scratch_dir', None) is not None:
+        scratch_staging.wait_for_transfer(index_dir, case['case_name'])
+
+    t_start = time.time()
+    archive = archive_outdir(case['outdir'],
+                             case.get('archive_codec', 'deflate'),
+                             case.get('archive_level', None))
+
+    if results_index.read_record(index_dir, case['case_name']) is not None:
+        results_index.update_record(index_dir, case['case_name'],
+                    {'archive': os.path.abspath(archive),
+                     'timings': {'archive_time': time.time() - t_start}})
+    return archive
+
+
+def archive_codec(archive):
+    """
+    Return the key in codecs of the compression used in *archive*
+    (that of its first member, or 'deflate' if it is empty).
+    """
+
+    with zipfile.ZipFile(archive) as zf:
+        infolist = zf.infolist()
+    if infolist:
+        for codec, compress_type in codecs.items():
+            if compress_type == infolist[0].compress_type:
+                return codec
+    return 'deflate'
+
+
+def extract_archive(outdir, dest=None, skip=None):
+    """
+    Extract the archive of *outdir* into *dest* (by default *outdir*
+    itself, e.g. to plot the output of an archived case), replacing any
+    files there with the same names.  Members for which skip(name) is True
+    are not extracted.  The modification time of each file is set to the
+    one recorded in the archive (to within the 2 seconds zip files record).
+    Returns the list of members extracted.
+    """
+
+    import time
+
+    if dest is None:
+        dest = outdir
+    with zipfile.ZipFile(archive_name(outdir)) as zf:
+        infos = [info for info in zf.infolist()
+                 if skip is None or not skip(info.filename)]
+        for info in infos:
+            path = zf.extract(info, dest)
+            if not info.is_dir():
+                # date_time is in local time, as archive_outdir writes it:
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                os.utime(path, (mtime, mtime))
+    return [info.filename for info in infos]
+
+
+def open_archive(outdir):
+    """
+    Return an open zipfile.ZipFile for the archive of *outdir*, if *outdir*
+    is not a directory and its archive exists (or if *outdir* is the name
+    of the archive itself), otherwise None.
+    """
+
+    if outdir.endswith('.zip') and os.path.isfile(outdir):
+        return zipfile.ZipFile(outdir)
+    if not os.path.isdir(outdir) and os.path.isfile(archive_name(outdir)):
+        return zipfile.ZipFile(archive_name(outdir))
+    return None
+
+
+def member_offset(zf, name):
+    """
+    Return the offset in the archive file of the data of member *name*,
+    which must be stored without compression, so it can be memory-mapped.
+    """
+
+    import struct
+
+    info = zf.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError("%s is compressed in %s" % (name, zf.filename))
+    with open(zf.filename, 'rb') as f:
+        f.seek(info.header_offset)
+        header = f.read(30)
+    # lengths of the file name and extra field in the local file header:
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    return info.header_offset + 30 + name_length + extra_length
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print('Usage: python sweep_archive.py outdir [codec [level]]')
+    else:
+        codec = sys.argv[2] if len(sys.argv) > 2 else 'deflate'
+        level = int(sys.argv[3]) if len(sys.argv) > 3 else None
+        print('Created %s' % archive_outdir(sys.argv[1], codec, level))
@@ -0,0 +1,588 @@
+"""
+Backends that run the cases of a sweep, passed as *backend* to
+multip_tools.run_many_cases_pool (and so resume_many_cases_pool) or
+multip_tools.run_refinement_ladders.
+
+A backend is a function called as
+    backend(processes=nprocs, initializer=initializer, initargs=initargs)
+that returns a pool with the apply_async, map and terminate methods of
+multiprocessing.Pool, which can be used in a with statement.
+
+local_backend, the default, is a multiprocessing.Pool that runs the cases
+on this machine only.  As for any Pool its worker processes are daemonic,
+so a case cannot start a pool of its own; plotclaw.plot_frames then plots
+the frames of a case in parallel (plotdata.parallel) with plotclaw.py
+subprocesses instead.  nested_backend is the same but with worker processes
+that are not daemonic, so that each case can plot its frames with
+plotclaw.plot_frames_pool.
+
+tcp_backend runs the cases on worker processes on any number of machines,
+connected to the process running the sweep (the coordinator) over TCP using
+multiprocessing.managers.  The workers pull one case at a time from the
+coordinator, run it and send the result back.  On the coordinator:
+
+    backend = sweep_backends.tcp_backend(address=('', 50000))
+    multip_tools.run_many_cases_pool(caselist, nprocs,
+                            clawmultip_tools.run_one_case_clawpack,
+                            backend=backend, schedule='dynamic')
+
+where nprocs is the total number of worker processes, and on each node,
+in the directory the sweep is run from (on a shared file system):
+
+    python sweep_backends.py worker coordinator_host 50000 nprocs_on_node
+
+The workers need the same environment as the coordinator, e.g. CLAW set
+and the same version of Clawpack.
+
+Workers can be started before or after the coordinator.  They wait up to
+a minute for a coordinator, and keep serving sweeps started by the same
+coordinator one after another (e.g. the rounds of
+sweep_design.adaptive_sweep) until there has been no coordinator for a
+minute.
+
+The coordinator and workers must share an authentication key, passed as
+*authkey* or set in the environment variable CLAWMULTIP_AUTHKEY.  Anyone
+who knows it can run code on the workers, so choose one that is hard to
+guess and only listen on trusted networks.  run_one_case must be a
+function the workers can import, e.g. run_one_case_clawpack, not one
+defined in the script that runs the sweep.
+
+If a worker stops sending heartbeats while running a case (e.g. its node
+went down), or dies after taking a case but before starting it, the case is
+handed out again, once by default.
+
+To try this on one machine, run the sweep with address=('localhost', 50000)
+and start a few workers with
+    python sweep_backends.py worker localhost 50000 2
+"""
+
+import os, sys, time, queue, pickle, socket, threading
+import multiprocessing, multiprocessing.pool
+from multiprocessing.managers import BaseManager
+
+authkey_variable = 'CLAWMULTIP_AUTHKEY'
+
+# queues in the manager server process of the coordinator:
+_queues = {}
+
+
+class _TaskQueue(queue.Queue):
+    """
+    Queue of tasks that records when each task is taken by a worker, so the
+    coordinator can tell a task that is waiting from one taken by a worker
+    that died before starting it.
+    """
+
+    def __init__(self):
+        queue.Queue.__init__(self)
+        self._taken = {}   # task_id -> time taken, until forget(task_id)
+
+    def get(self, block=True, timeout=None):
+        task = queue.Queue.get(self, block, timeout)
+        self._taken[task[0]] = time.time()
+        return task
+
+    def taken(self):
+        return dict(self._taken)
+
+    def forget(self, task_id):
+        self._taken.pop(task_id, None)
+
+
+def _get_queue(name):
+    if name not in _queues:
+        if name == 'tasks':
+            _queues[name] = _TaskQueue()
+        else:
+            _queues[name] = queue.Queue()
+    return _queues[name]
+
+
+def _get_task_queue():
+    return _get_queue('tasks')
+
+
+def _get_result_queue():
+    return _get_queue('results')
+
+
+class _SweepManager(BaseManager):
+    pass
+
+_SweepManager.register('get_task_queue', callable=_get_task_queue,
+                       exposed=['put', 'get', 'taken', 'forget'])
+_SweepManager.register('get_result_queue', callable=_get_result_queue)
+
+
+def local_backend(processes=None, initializer=None, initargs=()):
+    """
+    Return a multiprocessing.Pool of *processes* processes on this machine.
+    """
+
+    return multiprocessing.Pool(processes, initializer, initargs)
+
+
+def nested_backend(processes=None, initializer=None, initargs=()):
+    """
+    Return a multiprocessing.Pool of *processes* processes on this machine
+    that can start processes of their own, e.g. for cases that plot their
+    frames in parallel with plotclaw.plot_frames_pool.
+
+    Pool marks its worker processes as daemonic, and a daemonic process
+    cannot start processes of its own, so the workers are made with a
+    Process class whose daemon flag cannot be set.  The pool still stops its
+    workers when it is terminated, e.g. at the end of a with statement.
+    The default start method is used, as for local_backend.
+    """
+
+    context = multiprocessing.get_context()
+
+    class NonDaemonicProcess(context.Process):
+        @property
+        def daemon(self):
+            return False
+
+        @daemon.setter
+        def daemon(self, value):
+            pass
+
+    class NonDaemonicContext(type(context)):
+        Process = NonDaemonicProcess
+
+    return multiprocessing.pool.Pool(processes, initializer, initargs,
+                                     context=NonDaemonicContext())
+
+
+def _authkey(authkey):
+    """
+    Return *authkey* as bytes, or the value of CLAWMULTIP_AUTHKEY if None.
+    """
+
+    if authkey is None:
+        authkey = os.environ.get(authkey_variable, None)
+    if not authkey:
+        raise ValueError("Pass authkey or set the environment variable %s" \
+                            % authkey_variable)
+    if isinstance(authkey, str):
+        authkey = authkey.encode()
+    return authkey
+
+
+class TCPAsyncResult(object):
+    """
+    The result of TCPPool.apply_async, as for multiprocessing.Pool.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._success = None
+        self._value = None
+
+    def _set(self, success, value):
+        self._success = success
+        self._value = value
+        self._event.set()
+
+    def ready(self):
+        return self._event.is_set()
+
+    def successful(self):
+        if not self.ready():
+            raise ValueError("Result is not ready")
+        return self._success
+
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
+
+    def get(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise TimeoutError("Result is not ready")
+        if not self._success:
+            raise self._value
+        return self._value
+
+
+class TCPPool(object):
+    """
+    Coordinator of a pool of workers on other processes or machines, started
+    by running this module as a script (see run_workers), with the parts of
+    the interface of multiprocessing.Pool used by multip_tools.
+
+    Tasks are pickled here and unpickled by the workers, so functions are
+    sent by name and must be importable by the workers.  Each task is run
+    in the current working directory of the coordinator, if it exists on
+    the worker node.
+
+    *processes* is not used, the number of workers is the number started.
+    *initializer(*initargs)*, if given, is called once in each worker
+    process before it runs its first task for this pool.
+    The coordinator listens on *address*, a tuple (host, port), and the
+    workers must use the same *authkey*.
+    Workers send a heartbeat every *heartbeat* seconds while running a task,
+    and a task is handed out again (up to *max_requeues* times) if there has
+    been none from its worker for *lost_after* seconds, or if the worker that
+    took it has not started it after *lost_after* seconds.  If the
+    connection to the task and result queues is lost, every task not yet
+    done fails with a RuntimeError.
+    """
+
+    def __init__(self, processes=None, initializer=None, initargs=(),
+                 address=('', 50000), authkey=None, heartbeat=10.,
+                 lost_after=60., max_requeues=1):
+
+        self._manager = _SweepManager(address=address,
+                                      authkey=_authkey(authkey))
+        self._manager.start()
+        self._tasks = self._manager.get_task_queue()
+        self._results = self._manager.get_result_queue()
+        print("Coordinator listening on %s:%s" % self._manager.address)
+
+        self._setup = (initializer, tuple(initargs), '%s_%s' % (os.getpid(),
+                                                               id(self)))
+        self._cwd = os.getcwd()
+        self._heartbeat = heartbeat
+        self._lost_after = lost_after
+        self._max_requeues = max_requeues
+
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._jobs = {}      # task_id -> job dictionary
+        self._running = {}   # worker_id -> [task_id, time of last heartbeat]
+        self._last_check = time.time()
+        self._closed = False
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.terminate()
+
+    def apply_async(self, func, args=(), kwds={}, callback=None,
+                    error_callback=None):
+        """
+        Send func(*args, **kwds) to the next free worker.
+        """
+
+        result = TCPAsyncResult()
+        with self._lock:
+            task_id = self._next_id
+            self._next_id += 1
+        job = {'callback': callback, 'error_callback': error_callback,
+               'result': result, 'requeues': 0}
+        try:
+            job['payload'] = pickle.dumps((func, args, kwds, self._setup))
+        except Exception as err:
+            self._finish(job, False, err)
+            return result
+
+        with self._lock:
+            self._jobs[task_id] = job
+        self._tasks.put((task_id, job['payload'], self._cwd))
+        return result
+
+    def map(self, func, iterable, chunksize=None):
+        """
+        Return [func(x) for x in iterable], computed by the workers.
+        """
+
+        results = [self.apply_async(func, (x,)) for x in iterable]
+        return [result.get() for result in results]
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        """
+        Yield func(x) for each x in iterable, computed by the workers,
+        in the order they finish.
+        """
+
+        import queue
+
+        done = queue.Queue()
+        num_tasks = 0
+        for x in iterable:
+            self.apply_async(func, (x,),
+                             callback=lambda value: done.put((True, value)),
+                             error_callback=lambda err: done.put((False, err)))
+            num_tasks += 1
+        for n in range(num_tasks):
+            success, value = done.get()
+            if not success:
+                raise value
+            yield value
+
+    def close(self):
+        self.terminate()
+
+    def join(self):
+        pass
+
+    def terminate(self):
+        """
+        Stop the coordinator.  Workers still running a task finish it and
+        then wait for the next coordinator.
+        """
+
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._results.put(None)   # wakes up the collector thread
+        except (EOFError, OSError):
+            pass   # the collector thread has stopped already
+        self._collector.join()
+        self._manager.shutdown()
+
+    def _finish(self, job, success, value):
+        """
+        Set the result of *job* and call its callback.
+        """
+
+        try:
+            if success and job['callback'] is not None:
+                job['callback'](value)
+            elif not success and job['error_callback'] is not None:
+                job['error_callback'](value)
+        finally:
+            job['result']._set(success, value)
+
+    def _requeue(self, task_id, reason):
+        """
+        Hand out the task *task_id* again after *reason* (a lost worker),
+        or fail it if it has been handed out too often.
+        """
+
+        with self._lock:
+            job = self._jobs.get(task_id, None)
+        if job is None:
+            return
+        if job['requeues'] < self._max_requeues:
+            job['requeues'] += 1
+            print("*** %s, handing out its task again" % reason)
+            self._tasks.put((task_id, job['payload'], self._cwd))
+        else:
+            with self._lock:
+                self._jobs.pop(task_id, None)
+            self._finish(job, False, RuntimeError(reason))
+
+    def _fail_all(self, reason):
+        """
+        Fail every task not yet done, e.g. after losing the connection to
+        the queues.
+        """
+
+        with self._lock:
+            jobs = list(self._jobs.values())
+            self._jobs.clear()
+        for job in jobs:
+            self._finish(job, False, RuntimeError(reason))
+
+    def _collect(self):
+        """
+        Collect the messages sent by the workers, in a thread of the
+        coordinator, until the pool is terminated.
+        """
+
+        while not self._closed:
+            try:
+                self._collect_once()
+            except (EOFError, OSError) as err:
+                if not self._closed:
+                    self._fail_all("Lost the connection to the task and "
+                                   "result queues: %r" % err)
+                return
+
+    def _collect_once(self):
+        """
+        Handle the next message from the workers, if any within a second,
+        and hand out again the tasks of workers that were lost.
+        """
+
+        try:
+            message = self._results.get(timeout=1.)
+        except queue.Empty:
+            message = None
+
+        now = time.time()
+        if message is not None:
+            kind, worker_id = message[:2]
+            if kind == 'start':
+                self._running[worker_id] = [message[2], now]
+                self._tasks.forget(message[2])
+            elif kind == 'alive':
+                if worker_id in self._running:
+                    self._running[worker_id][1] = now
+            elif kind == 'done':
+                task_id, success, value = message[2:]
+                self._running.pop(worker_id, None)
+                with self._lock:
+                    job = self._jobs.pop(task_id, None)
+                # job is None if it was already done by another worker
+                # after this one was thought to be lost:
+                if job is not None:
+                    self._finish(job, success, value)
+
+        for worker_id, (task_id, last) in list(self._running.items()):
+            if now - last < self._lost_after:
+                continue
+            del self._running[worker_id]
+            self._requeue(task_id, "Lost worker %s running task %i"
+                          % (worker_id, task_id))
+
+        if now - self._last_check >= 1.:
+            # tasks taken by a worker that died before starting them:
+            self._last_check = now
+            for task_id, taken in self._tasks.taken().items():
+                if now - taken >= self._lost_after:
+                    self._tasks.forget(task_id)
+                    self._requeue(task_id, "Task %i was taken by a worker "
+                                  "that did not start it" % task_id)
+
+
+def tcp_backend(address=('', 50000), authkey=None, **kwargs):
+    """
+    Return a backend for multip_tools.run_many_cases_pool that runs cases on
+    workers connected over TCP, see TCPPool for the arguments.
+    """
+
+    authkey = _authkey(authkey)
+
+    def backend(processes=None, initializer=None, initargs=()):
+        return TCPPool(processes, initializer, initargs, address, authkey,
+                       **kwargs)
+
+    return backend
+
+
+def _send(results, message):
+    """
+    Put *message* on the *results* queue, sending the exception as a
+    RuntimeError instead if the value cannot be pickled.
+    """
+
+    try:
+        pickle.dumps(message)
+    except Exception as err:
+        message = message[:3] + (False, RuntimeError(
+                        "Result could not be pickled: %s" % repr(err)))
+    results.put(message)
+
+
+def _run_worker_task(results, worker_id, task, initialized, heartbeat):
+    """
+    Run one *task* from the coordinator and send back its result.
+    """
+
+    task_id, payload, cwd = task
+    results.put(('start', worker_id, task_id))
+
+    stop = threading.Event()
+
+    def send_heartbeats():
+        while not stop.wait(heartbeat):
+            try:
+                results.put(('alive', worker_id))
+            except (EOFError, OSError):
+                return
+
+    thread = threading.Thread(target=send_heartbeats, daemon=True)
+    thread.start()
+
+    try:
+        if os.path.isdir(cwd):
+            os.chdir(cwd)
+            if cwd not in sys.path:
+                sys.path.insert(1, cwd)
+        func, args, kwds, (initializer, initargs, pool_id) \
+                = pickle.loads(payload)
+        if initializer is not None and pool_id not in initialized:
+            initializer(*initargs)
+            initialized.add(pool_id)
+        message = ('done', worker_id, task_id, True, func(*args, **kwds))
+    except Exception as err:
+        message = ('done', worker_id, task_id, False, err)
+    finally:
+        stop.set()
+        thread.join()
+
+    _send(results, message)
+
+
+def worker(host, port, authkey=None, wait=60., heartbeat=10.):
+    """
+    Run tasks from the coordinator at (*host*, *port*) in this process,
+    until there has been no coordinator to connect to for *wait* seconds.
+    """
+
+    authkey = _authkey(authkey)
+    worker_id = '%s:%i' % (socket.gethostname(), os.getpid())
+    initialized = set()
+    t_lost = time.time()
+
+    while time.time() - t_lost < wait:
+        manager = _SweepManager(address=(host, port), authkey=authkey)
+        try:
+            manager.connect()
+            tasks = manager.get_task_queue()
+            results = manager.get_result_queue()
+        except (EOFError, OSError):
+            time.sleep(0.2)
+            continue
+
+        print("Worker %s connected to %s:%s" % (worker_id, host, port))
+        try:
+            while True:
+                try:
+                    task = tasks.get(timeout=heartbeat)
+                except queue.Empty:
+                    continue
+                _run_worker_task(results, worker_id, task, initialized,
+                                 heartbeat)
+        except (EOFError, OSError):
+            print("Worker %s lost the coordinator" % worker_id)
+            t_lost = time.time()
+
+    print("Worker %s is done" % worker_id)
+
+
+def run_workers(host, port, nprocs, authkey=None, wait=60., heartbeat=10.):
+    """
+    Start *nprocs* worker processes on this node, see worker, and wait
+    for them to finish.
+    """
+
+    from multiprocessing import Process
+
+    authkey = _authkey(authkey)
+    processes = [Process(target=worker, args=(host, port, authkey, wait,
+                                              heartbeat))
+                 for n in range(nprocs)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        raise
+
+
+if __name__ == '__main__':
+    """
+    Usage:
+        python sweep_backends.py worker host port [nprocs]
+    with the authentication key in the environment variable
+    CLAWMULTIP_AUTHKEY.
+    """
+
+    if len(sys.argv) < 4 or sys.argv[1] != 'worker':
+        print("Usage: python sweep_backends.py worker host port [nprocs]")
+        sys.exit(1)
+
+    if len(sys.argv) > 4:
+        nprocs = int(sys.argv[4])
+    else:
+        nprocs = 1
+
+    run_workers(sys.argv[2], int(sys.argv[3]), nprocs)
@@ -0,0 +1,438 @@
+"""
+Read the output frames of the cases in a parameter sweep.
+
+Frames written with clawdata.output_format = 'binary' (or 'binary64' or
+'binary32') are memory-mapped with numpy.memmap rather than read, so the
+q arrays returned are views into the fort.b files and no text is parsed.
+Set case['output_format'] in the caselist to run a sweep with binary output,
+see setrun_cases.py in the example; run_one_case_clawpack passes the same
+format on to plotclaw.
+
+Only the fort.q file headers are ASCII for binary output, and these are short.
+ASCII frames can also be read, for comparison or for older sweeps.
+
+If an outdir has been packed into outdir + '.zip' by sweep_archive.py,
+frames are read from the archive without extracting it.
+
+To compare cases, e.g. in a convergence study, use SweepDataset, which
+reads frames on demand and keeps only the most recently used ones.
+
+Example:
+    frame = read_frame('_output_order2_mx0100', 2)
+    q = frame['patches'][0]['q']   # shape (num_eqn, mx)
+    x = cell_centers(frame['patches'][0])[0]
+
+    frames = read_sweep_frames(caselist, 2)  # dictionary keyed on case_name
+
+    ds = SweepDataset(caselist)
+    q = ds.q(2, mx=100, order=2)
+"""
+
+import os, sys, glob
+import numpy as np
+
+# other modules in this directory:
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sweep_archive
+sys.path.pop(0)
+
+
+def _read_lines(outdir, fname):
+    """
+    Return the lines of file *fname* in *outdir* or in its archive.
+    """
+
+    zf = sweep_archive.open_archive(outdir)
+    if zf is None:
+        with open(os.path.join(outdir, fname)) as f:
+            return f.readlines()
+    with zf:
+        return zf.read(fname).decode().splitlines(True)
+
+
+def _isfile(outdir, fname):
+    """
+    Return True if file *fname* is in *outdir* or in its archive.
+    """
+
+    zf = sweep_archive.open_archive(outdir)
+    if zf is None:
+        return os.path.isfile(os.path.join(outdir, fname))
+    with zf:
+        return fname in zf.namelist()
+
+
+def _read_binary(outdir, fname, dtype):
+    """
+    Return the 1d array of values of *dtype* in file *fname* in *outdir*,
+    memory-mapped if possible, or read from the archive of *outdir*.
+    """
+
+    zf = sweep_archive.open_archive(outdir)
+    if zf is None:
+        return np.memmap(os.path.join(outdir, fname), dtype=dtype, mode='r')
+    with zf:
+        info = zf.getinfo(fname)
+        if info.compress_type == sweep_archive.codecs['store']:
+            num_values = info.file_size // np.dtype(dtype).itemsize
+            return np.memmap(zf.filename, dtype=dtype, mode='r',
+                             offset=sweep_archive.member_offset(zf, fname),
+                             shape=(num_values,))
+        return np.frombuffer(zf.read(fname), dtype=dtype)
+
+
+def frame_numbers(outdir, file_prefix='fort'):
+    """
+    Return a sorted list of the frame numbers with a fort.t file in *outdir*.
+    """
+
+    zf = sweep_archive.open_archive(outdir)
+    if zf is None:
+        tfiles = glob.glob(os.path.join(outdir, '%s.t*' % file_prefix))
+    else:
+        with zf:
+            tfiles = [fname for fname in zf.namelist()
+                      if fname.startswith('%s.t' % file_prefix)]
+
+    framenos = []
+    for tfile in tfiles:
+        suffix = tfile.split('.t')[-1]
+        if suffix.isdigit():
+            framenos.append(int(suffix))
+    return sorted(framenos)
+
+
+def read_frame_time(outdir, frameno, file_prefix='fort'):
+    """
+    Read the fort.t file for *frameno* and return a dictionary with the
+    values it contains, e.g. 'time', 'meqn', 'ngrids', 'naux', 'ndim',
+    'nghost' and, for more recent versions of Clawpack, 'format'.
+    Each line has a value followed by its name.
+    """
+
+    tfile = '%s.t%s' % (file_prefix, str(frameno).zfill(4))
+    info = {}
+    for line in _read_lines(outdir, tfile):
+        tokens = line.split()
+        if len(tokens) < 2:
+            continue
+        value, name = tokens[0], tokens[-1]
+        try:
+            value = int(value)
+        except ValueError:
+            try:
+                value = float(value.replace('D', 'E').replace('d', 'e'))
+            except ValueError:
+                pass
+        info[name] = value
+    return info
+
+
+def _read_patch_header(lines, num_dim):
+    """
+    Parse the header of one patch from the list of *lines* of a fort.q file
+    and return the patch dictionary (without q).
+    """
+
+    values = [line.split()[0] for line in lines]
+    patch = {'grid_number': int(values[0]),
+             'level': int(values[1]),
+             'm': [int(v) for v in values[2:2+num_dim]],
+             'lower': [float(v.replace('D', 'E').replace('d', 'e'))
+                       for v in values[2+num_dim:2+2*num_dim]],
+             'delta': [float(v.replace('D', 'E').replace('d', 'e'))
+                       for v in values[2+2*num_dim:2+3*num_dim]]}
+    return patch
+
+
+def read_frame(outdir, frameno, output_format=None, file_prefix='fort'):
+    """
+    Read frame *frameno* from *outdir*.
+
+    *output_format* is 'ascii', 'binary', 'binary64' or 'binary32'.
+    The format recorded in the fort.t file, if any, is used instead since
+    it is the format actually written (e.g. the classic 1d code always
+    writes ascii output).  If neither is known, binary is assumed if a
+    fort.b file exists for this frame.
+
+    Returns a dictionary with keys 't', 'frameno', 'num_eqn', 'num_dim',
+    'output_format' and 'patches', a list with a dictionary for each patch
+    with keys 'grid_number', 'level', 'm' (number of cells in each
+    direction), 'lower', 'delta' and 'q', an array of shape
+    (num_eqn, mx), (num_eqn, mx, my) or (num_eqn, mx, my, mz).
+    For binary output q is a view into the memory-mapped fort.b file.
+    """
+
+    info = read_frame_time(outdir, frameno, file_prefix)
+    num_eqn = info['meqn']
+    num_patches = info['ngrids']
+    num_dim = info.get('ndim', 1)
+    num_ghost = info.get('nghost', 2)
+
+    suffix = str(frameno).zfill(4)
+    qfile = '%s.q%s' % (file_prefix, suffix)
+    bfile = '%s.b%s' % (file_prefix, suffix)
+
+    recorded_format = info.get('format', info.get('file_format', None))
+    # recorded as an integer by some versions of Clawpack:
+    recorded_format = {1: 'ascii', 2: 'binary32', 3: 'binary64'}.get(
+                        recorded_format, recorded_format)
+    if recorded_format is not None:
+        output_format = recorded_format
+    elif output_format is None:
+        if _isfile(outdir, bfile):
+            output_format = 'binary'
+        else:
+            output_format = 'ascii'
+
+    binary = output_format in ['binary', 'binary64', 'binary32']
+    if binary:
+        dtype = np.float32 if output_format == 'binary32' else np.float64
+        bdata = _read_binary(outdir, bfile, dtype)
+        b_start = 0
+    elif output_format != 'ascii':
+        raise ValueError("Unrecognized output_format = %s" % output_format)
+
+    lines = _read_lines(outdir, qfile)
+
+    header_length = 2 + 3*num_dim
+    line_no = 0
+    patches = []
+    for n in range(num_patches):
+
+        # skip blank lines between patches:
+        while not lines[line_no].strip():
+            line_no += 1
+
+        patch = _read_patch_header(lines[line_no:line_no+header_length],
+                                   num_dim)
+        line_no += header_length
+        m = patch['m']
+        num_cells = int(np.prod(m))
+
+        if binary:
+            # includes ghost cells, stored in Fortran order:
+            shape = [num_eqn] + [mi + 2*num_ghost for mi in m]
+            b_end = b_start + int(np.prod(shape))
+            q = bdata[b_start:b_end].reshape(shape, order='F')
+            b_start = b_end
+            interior = [slice(None)] \
+                    + [slice(num_ghost, num_ghost + mi) for mi in m]
+            q = q[tuple(interior)]
+        else:
+            # one line per cell with num_eqn values, x varying fastest:
+            data = []
+            while len(data) < num_cells:
+                line = lines[line_no]
+                line_no += 1
+                if line.strip():
+                    data.append(line)
+            q = np.array([[float(v.replace('D', 'E').replace('d', 'e'))
+                           for v in line.split()] for line in data])
+            q = q.reshape(m[::-1] + [num_eqn]).T
+
+        patch['q'] = q
+        patches.append(patch)
+
+    return {'t': info['time'], 'frameno': frameno, 'num_eqn': num_eqn,
+            'num_dim': num_dim, 'output_format': output_format,
+            'patches': patches}
+
+
+def cell_centers(patch):
+    """
+    Return a list with the 1d array of cell centers in each direction
+    for a *patch* returned in read_frame.
+    """
+
+    return [patch['lower'][d] + (np.arange(patch['m'][d]) + 0.5) \
+                * patch['delta'][d] for d in range(len(patch['m']))]
+
+
+def read_sweep_frames(caselist, frameno, output_format=None):
+    """
+    Read frame *frameno* from the outdir of every case in *caselist*.
+    The format is taken from case['output_format'] if set, otherwise from
+    *output_format*.  Returns a dictionary keyed on case['case_name'].
+    """
+
+    frames = {}
+    for case in caselist:
+        frames[case['case_name']] = read_frame(case['outdir'], frameno,
+                                case.get('output_format', output_format))
+    return frames
+
+
+def load_case_info(pattern='_output*/case_info.pkl'):
+    """
+    Return a caselist from the case_info.pkl files written by
+    run_one_case_clawpack, matching the glob *pattern*.
+    case['outdir'] is set to the directory containing each file, so this
+    works even if the outdirs have been moved since the sweep was run.
+    Outdirs that have been archived (see sweep_archive.py) are included,
+    with case['outdir'] set to the outdir the archive was made from.
+    """
+
+    import pickle
+
+    cases = {}
+    for fname in glob.glob(pattern):
+        with open(fname, 'rb') as f:
+            case = pickle.load(f)
+        case['outdir'] = os.path.dirname(os.path.abspath(fname))
+        cases[case['outdir']] = case
+
+    dir_pattern, member = os.path.split(pattern)
+    for archive in glob.glob(dir_pattern + '.zip'):
+        outdir = os.path.abspath(archive[:-len('.zip')])
+        if outdir in cases:
+            continue
+        with sweep_archive.open_archive(archive) as zf:
+            if member not in zf.namelist():
+                continue
+            case = pickle.loads(zf.read(member))
+        case['outdir'] = outdir
+        cases[outdir] = case
+
+    return [cases[outdir] for outdir in sorted(cases.keys())]
+
+
+class SweepDataset(object):
+    """
+    Lazily loaded output of all the cases in a sweep, indexed by case
+    parameters and frame number.
+
+    Frames are only read when asked for (see read_frame, binary frames are
+    memory-mapped) and the *cache_size* most recently used frames are kept,
+    so a sweep with many cases and frames never has to fit in memory.
+
+    Example, for a convergence study like the one in the example directory:
+        ds = SweepDataset(caselist)  # or SweepDataset('_output*/case_info.pkl')
+        for mx in ds.values('mx'):
+            q = ds.q(2, mx=mx, order=2)   # frame 2, first patch
+        ds2 = ds.select(order=2)          # only the cases with order 2
+    """
+
+    def __init__(self, caselist='_output*/case_info.pkl', cache_size=64,
+                 output_format=None):
+        """
+        *caselist* is a list of case dictionaries, or a glob pattern for
+        case_info.pkl files (see load_case_info).
+        *output_format* is used for cases that do not set
+        case['output_format'], if None it is determined from the files.
+        """
+
+        from collections import OrderedDict
+
+        if isinstance(caselist, str):
+            caselist = load_case_info(caselist)
+        self.caselist = list(caselist)
+        self.cache_size = cache_size
+        self.output_format = output_format
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.caselist)
+
+    def __repr__(self):
+        return 'SweepDataset with %i cases' % len(self.caselist)
+
+    @property
+    def case_names(self):
+        return [case['case_name'] for case in self.caselist]
+
+    def values(self, key):
+        """
+        Return the sorted list of distinct values of parameter *key*.
+        """
+
+        return sorted(set([case[key] for case in self.caselist
+                           if key in case]))
+
+    def select(self, **params):
+        """
+        Return a SweepDataset with only the cases matching *params*, where
+        each value is a single value, a list of values, or a function
+        returning True for the values wanted.  The new dataset shares the
+        cache of frames with this one.
+        """
+
+        def matches(value, wanted):
+            if callable(wanted):
+                return wanted(value)
+            elif isinstance(wanted, (list, tuple, set)):
+                return value in wanted
+            else:
+                return value == wanted
+
+        caselist = [case for case in self.caselist
+                    if all([(k in case) and matches(case[k], v)
+                            for k, v in params.items()])]
+        subset = SweepDataset(caselist, self.cache_size, self.output_format)
+        subset._cache = self._cache
+        return subset
+
+    def case(self, case_name=None, **params):
+        """
+        Return the single case with *case_name*, or matching *params*.
+        """
+
+        if case_name is not None:
+            params['case_name'] = case_name
+        cases = self.select(**params).caselist
+        if len(cases) != 1:
+            raise ValueError("%i cases match %s" % (len(cases), params))
+        return cases[0]
+
+    def framenos(self, case_name=None, **params):
+        """
+        Return the frame numbers available for one case.
+        """
+
+        case = self.case(case_name, **params)
+        return frame_numbers(case['outdir'])
+
+    def frame(self, frameno, case_name=None, **params):
+        """
+        Return frame *frameno* of the case with *case_name* or matching
+        *params*, as returned by read_frame, reading it only if it is not
+        already in the cache.
+        """
+
+        case = self.case(case_name, **params)
+        key = (case['case_name'], frameno)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        frame = read_frame(case['outdir'], frameno,
+                           case.get('output_format', self.output_format))
+        self._cache[key] = frame
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return frame
+
+    def q(self, frameno, case_name=None, patch=0, **params):
+        """
+        Return the q array of one *patch* of frame *frameno* of one case.
+        """
+
+        return self.frame(frameno, case_name, **params)['patches'][patch]['q']
+
+    def x(self, frameno, case_name=None, patch=0, **params):
+        """
+        Return the cell centers in each direction for one *patch*
+        of frame *frameno* of one case, see cell_centers.
+        """
+
+        return cell_centers(self.frame(frameno, case_name,
+                                       **params)['patches'][patch])
+
+    def iter_frames(self, frameno):
+        """
+        Iterate over (case, frame) for frame *frameno* of every case,
+        reading one frame at a time.
+        """
+
+        for case in self.caselist:
+            yield case, self.frame(frameno, case['case_name'])
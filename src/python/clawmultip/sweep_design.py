@@ -0,0 +1,452 @@
+"""
+Caselists that sample a parameter space, rather than running every
+combination of parameter values as the nested for-loops in
+clawmultip_tools.make_cases_template do, so that the number of runs does not
+grow exponentially with the number of parameters.
+
+The parameters are given as a dictionary *space*, e.g.
+    space = {'mx': (50, 800, 'log'), 'u': (0.5, 2.), 'order': [1, 2]}
+where the value for each parameter is
+    (lower, upper):         a range of values, integers if both are integers,
+    (lower, upper, 'log'):  a range sampled uniformly in log(value),
+    a list:                 a set of discrete values.
+
+Designs with a given number of points:
+    points = latin_hypercube(space, 20, seed=1)
+    points = sobol(space, 16, seed=1)     # uses scipy.stats.qmc if available
+
+Each point is a dictionary of parameter values.  make_caselist turns the
+points into a caselist using a function make_case(point) that sets the
+other keys of each case (outdir, setrun_file, etc.), e.g. as in
+make_cases_template.
+
+Adaptive refinement chooses new points from the results of the cases
+already run: pairs of neighboring cases are ranked by how much an output
+*metric* (e.g. the maximum of q at the final time) changes between them,
+and new cases are placed halfway between the pairs where it changes most.
+Cases are added where the metric varies and not where it is flat:
+    new_points = refine(cases, values, space, num_new=8)
+or, running the cases in rounds until the metric is resolved to *tol*:
+    caselist, values = adaptive_sweep(space, make_case, run_cases, metric,
+                                      tol=0.01, max_cases=60)
+"""
+
+import os, sys
+import numpy as np
+
+# other modules in this directory:
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import results_index
+sys.path.pop(0)
+
+
+def _spec(space, key):
+    """
+    Return (kind, values) for parameter *key* of *space*, where kind is
+    'discrete', 'int', 'float', 'int_log' or 'float_log'.
+    """
+
+    spec = space[key]
+    if isinstance(spec, list):
+        if len(spec) == 0:
+            raise ValueError("No values given for parameter %s" % key)
+        return 'discrete', spec
+    if not isinstance(spec, tuple) or len(spec) not in [2, 3]:
+        raise ValueError("Parameter %s should be a list or a tuple " % key \
+                + "(lower, upper) or (lower, upper, 'log'), not %s" % (spec,))
+    lower, upper = spec[:2]
+    if upper < lower:
+        raise ValueError("Parameter %s has upper < lower" % key)
+    if isinstance(lower, (int, np.integer)) \
+            and isinstance(upper, (int, np.integer)):
+        kind = 'int'
+    else:
+        kind = 'float'
+    if len(spec) == 3:
+        if spec[2] != 'log':
+            raise ValueError("Unrecognized scale %s for parameter %s" \
+                                % (spec[2], key))
+        if lower <= 0:
+            raise ValueError("Parameter %s must be positive for 'log'" % key)
+        kind = kind + '_log'
+    return kind, spec[:2]
+
+
+def _from_unit(space, key, u):
+    """
+    Return the value of parameter *key* at *u* in [0,1].
+    """
+
+    kind, values = _spec(space, key)
+    u = min(max(float(u), 0.), 1.)
+    if kind == 'discrete':
+        return values[min(int(u*len(values)), len(values)-1)]
+    lower, upper = values
+    if kind.endswith('_log'):
+        value = np.exp(np.log(lower) + u*(np.log(upper) - np.log(lower)))
+    else:
+        value = lower + u*(upper - lower)
+    if kind.startswith('int'):
+        return int(np.floor(value + 0.5))
+    return float(value)
+
+
+def _to_unit(space, key, value):
+    """
+    Return the position in [0,1] of *value* of parameter *key*, the inverse
+    of _from_unit.  Discrete values are placed at the middle of equal
+    intervals.
+    """
+
+    kind, values = _spec(space, key)
+    if kind == 'discrete':
+        return (values.index(value) + 0.5) / len(values)
+    lower, upper = values
+    if upper == lower:
+        return 0.5
+    if kind.endswith('_log'):
+        return (np.log(value) - np.log(lower)) \
+                / (np.log(upper) - np.log(lower))
+    return (value - lower) / float(upper - lower)
+
+
+def points_from_unit(space, u):
+    """
+    Return a list of points (dictionaries of parameter values) from the
+    array *u* of shape (num_points, num_params) with values in [0,1],
+    one column for each key of *space* in sorted order.
+    """
+
+    keys = sorted(space.keys())
+    return [dict([(key, _from_unit(space, key, ui[j]))
+                  for j, key in enumerate(keys)]) for ui in u]
+
+
+def _unique(points):
+    """
+    Return *points* without duplicates (e.g. integer parameters rounded to
+    the same value), keeping the first occurrence.
+    """
+
+    seen = set()
+    unique = []
+    for point in points:
+        key = repr(sorted(point.items()))
+        if key not in seen:
+            seen.add(key)
+            unique.append(point)
+    return unique
+
+
+def latin_hypercube(space, num_points, seed=None):
+    """
+    Return *num_points* points from a Latin hypercube design of *space*:
+    the range of each parameter is split into num_points equal intervals
+    and each interval is sampled exactly once, in random order.
+    Points that are the same after rounding integer parameters are only
+    returned once.
+    """
+
+    rng = np.random.default_rng(seed)
+    num_params = len(space)
+    u = np.empty((num_points, num_params))
+    for j in range(num_params):
+        u[:,j] = (rng.permutation(num_points) + rng.random(num_points)) \
+                    / num_points
+    return _unique(points_from_unit(space, u))
+
+
+def _halton(num_points, num_params, seed=None):
+    """
+    Return a Halton sequence of shape (num_points, num_params), randomly
+    shifted modulo 1 if *seed* is not None.  Used by sobol if scipy is
+    not available.
+    """
+
+    primes = []
+    n = 2
+    while len(primes) < num_params:
+        if all([n % p for p in primes]):
+            primes.append(n)
+        n += 1
+
+    u = np.zeros((num_points, num_params))
+    for j, base in enumerate(primes):
+        for i in range(num_points):
+            f, k = 1., i + 1
+            while k > 0:
+                f = f / base
+                u[i,j] += f * (k % base)
+                k = k // base
+    if seed is not None:
+        u = np.mod(u + np.random.default_rng(seed).random(num_params), 1.)
+    return u
+
+
+def sobol(space, num_points, seed=None):
+    """
+    Return *num_points* points from a scrambled Sobol sequence in *space*,
+    which fills the space more evenly than random sampling.  Sobol
+    sequences are best balanced when num_points is a power of 2.
+
+    Uses scipy.stats.qmc.  If scipy is not available, a Halton sequence
+    (another low-discrepancy sequence) is used instead.
+    """
+
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        print("*** scipy.stats.qmc is not available, using a Halton " \
+                + "sequence instead of Sobol")
+        return _unique(points_from_unit(space,
+                                        _halton(num_points, len(space), seed)))
+
+    import warnings
+
+    sampler = qmc.Sobol(d=len(space), scramble=True, seed=seed)
+    with warnings.catch_warnings():
+        # scipy warns if num_points is not a power of 2:
+        warnings.simplefilter('ignore')
+        u = sampler.random(num_points)
+    return _unique(points_from_unit(space, u))
+
+
+def case_name(point, prefix=''):
+    """
+    Return a name for the case with parameters *point*, e.g.
+    'mx0123_u1.25' for point = {'mx': 123, 'u': 1.25}, that can also be
+    used in outdir and plotdir.
+    """
+
+    parts = []
+    for key in sorted(point.keys()):
+        value = point[key]
+        if isinstance(value, (int, np.integer)):
+            parts.append('%s%s' % (key, str(value).zfill(4)))
+        elif isinstance(value, float):
+            parts.append('%s%.6g' % (key, value))
+        else:
+            parts.append('%s%s' % (key, value))
+    return prefix + '_'.join(parts)
+
+
+def make_caselist(points, make_case):
+    """
+    Return a caselist with one case for each point in *points*.
+    *make_case* is a function with a single input *point* (a dictionary of
+    parameter values) returning the case dictionary, which should include
+    the values in point and a unique 'case_name' and 'outdir'.
+    """
+
+    caselist = []
+    for point in points:
+        case = make_case(dict(point))
+        for key, value in point.items():
+            if case.get(key, value) != value:
+                raise ValueError("make_case changed %s for case %s" \
+                                    % (key, case.get('case_name')))
+        caselist.append(case)
+    return caselist
+
+
+def _neighbor_pairs(u, num_neighbors):
+    """
+    Return the set of pairs (i,j), i < j, such that point j is one of the
+    *num_neighbors* nearest points to point i, or the other way around,
+    for the points in the rows of *u*.
+    """
+
+    num_points = u.shape[0]
+    distance = np.sqrt(((u[:,None,:] - u[None,:,:])**2).sum(axis=2))
+    pairs = set()
+    for i in range(num_points):
+        for j in np.argsort(distance[i])[1:num_neighbors+1]:
+            pairs.add((min(i, j), max(i, j)))
+    return pairs
+
+
+def refine(cases, values, space, num_new, num_neighbors=None,
+           min_distance=1e-3, tol=None, failed=None):
+    """
+    Return up to *num_new* new points in *space* where the metric changes
+    the most between the finished *cases*.
+
+    *values* is the list of metric values (floats) for *cases*, e.g. some
+    norm of the solution at the final time, and every case must have a
+    value for each parameter in space.
+
+    Each case is paired with its *num_neighbors* nearest cases (default
+    2 per range parameter) that have the same values of the discrete
+    parameters (those given as a list), measuring distance with every range
+    parameter scaled to [0,1] (in log(value) for 'log' parameters).
+    The pairs are ranked by the change in the metric between them and a new
+    point is put halfway between each pair in turn.  Pairs closer than
+    *min_distance*, pairs with a change less than *tol* (if given), pairs
+    with another case near their midpoint and new points that would
+    duplicate a case (e.g. an integer parameter between two consecutive
+    integers) are skipped.  *failed* is a list of points (or cases) that
+    were run but have no metric value, e.g. because the run failed; no new
+    point is put at or near them, so they are not proposed again.
+    Returns an empty list when there is nothing left to refine.
+    """
+
+    keys = sorted(space.keys())
+    discrete = [key for key in keys if _spec(space, key)[0] == 'discrete']
+    ranges = [j for j, key in enumerate(keys) if key not in discrete]
+    discrete_j = [j for j, key in enumerate(keys) if key in discrete]
+    if num_neighbors is None:
+        num_neighbors = 2*len(ranges)
+    if len(cases) != len(values):
+        raise ValueError("%i cases but %i values" % (len(cases), len(values)))
+    if not ranges:
+        return []
+
+    u = np.array([[_to_unit(space, key, case[key]) for key in keys]
+                  for case in cases])
+    values = np.array(values, dtype=float)
+
+    groups = {}
+    for i, case in enumerate(cases):
+        group = repr([case[key] for key in discrete])
+        groups.setdefault(group, []).append(i)
+
+    ranked = []
+    for indices in groups.values():
+        if len(indices) < 2:
+            continue
+        u_group = u[indices][:,ranges]
+        for k, l in _neighbor_pairs(u_group, num_neighbors):
+            i, j = indices[k], indices[l]
+            change = abs(values[i] - values[j])
+            if not np.isfinite(change):
+                continue
+            if tol is not None and change < tol:
+                continue
+            if np.sqrt(((u_group[k] - u_group[l])**2).sum()) < min_distance:
+                continue
+            ranked.append((change, i, j))
+    ranked.sort(reverse=True)
+
+    if failed is None:
+        failed = []
+    existing = set([repr(sorted([(key, case[key]) for key in keys]))
+                    for case in list(cases) + list(failed)])
+    points_u = list(u) + [np.array([_to_unit(space, key, point[key])
+                                    for key in keys]) for point in failed]
+    new_points = []
+    for change, i, j in ranked:
+        if len(new_points) >= num_new:
+            break
+        midpoint = 0.5*(u[i] + u[j])
+        # skip pairs that already have a case (or new point) near their
+        # midpoint, e.g. pairs that are not next to each other:
+        radius = 0.25*np.sqrt(((u[i] - u[j])[ranges]**2).sum())
+        near = [np.sqrt(((p - midpoint)[ranges]**2).sum()) < radius
+                for p in points_u if all(p[discrete_j] == u[i][discrete_j])]
+        if any(near):
+            continue
+        point = points_from_unit(space, [midpoint])[0]
+        key = repr(sorted(point.items()))
+        if key not in existing:
+            existing.add(key)
+            points_u.append(midpoint)
+            new_points.append(point)
+    return new_points
+
+
+def adaptive_sweep(space, make_case, run_cases, metric, num_initial=None,
+                   num_new=None, max_cases=100, tol=None, points=None,
+                   design='latin_hypercube', seed=None, **kwargs):
+    """
+    Run a sweep over *space* in rounds, choosing the cases of each round by
+    refine from the results of the cases already run.
+
+    *make_case* turns a point into a case, see make_caselist.
+    *run_cases* is a function with a single input *caselist* that runs
+    the cases, e.g.
+        lambda caselist: multip_tools.run_many_cases_pool(caselist, nprocs,
+                            clawmultip_tools.run_one_case_clawpack)
+    If it returns a list of results as run_many_cases_pool does, cases whose
+    status is 'failed' are left out of the refinement.
+    *metric* is a function with a single input *case* that returns a float
+    computed from the output of a finished case.  Cases for which it raises
+    an exception (e.g. because the run stopped early) are also left out.
+    Left out cases still count towards *max_cases*, and no new points are
+    put at or near them (see refine), so they are not run again.
+
+    The first round runs *points* if given, or else *num_initial* points
+    (default 4 per parameter) from *design* ('latin_hypercube' or 'sobol').
+    Each later round runs up to *num_new* new points (default num_initial)
+    until no pair of neighboring cases differs by more than *tol*, or
+    *max_cases* cases have been run.  Other keyword arguments are passed to
+    refine.
+
+    Returns the caselist of the cases run that were not left out, and their
+    metric values.
+    """
+
+    if num_initial is None:
+        num_initial = 4*len(space)
+    if num_new is None:
+        num_new = num_initial
+
+    if points is None:
+        if design == 'latin_hypercube':
+            points = latin_hypercube(space, num_initial, seed)
+        elif design == 'sobol':
+            points = sobol(space, num_initial, seed)
+        else:
+            raise ValueError("Unrecognized design = %s" % design)
+
+    caselist = []
+    values = []
+    failed = []
+    num_run = 0
+    round_number = 0
+    while points:
+        round_number += 1
+        points = points[:max_cases - num_run]
+        new_cases = make_caselist(points, make_case)
+        print("\nAdaptive sweep round %i: running %i new cases" \
+                % (round_number, len(new_cases)))
+        results = run_cases(new_cases)
+        num_run += len(new_cases)
+
+        for n, case in enumerate(new_cases):
+            if results is not None and results[n]['status'] == 'failed':
+                print("*** Leaving out failed case %s" % case['case_name'])
+                failed.append(case)
+                continue
+            try:
+                value = metric(case)
+            except Exception as err:
+                print("*** Leaving out case %s, metric failed: %s" \
+                        % (case['case_name'], repr(err)))
+                failed.append(case)
+                continue
+            caselist.append(case)
+            values.append(value)
+
+        if num_run >= max_cases:
+            print("Adaptive sweep stopped after max_cases = %i" % max_cases)
+            break
+        points = refine(caselist, values, space, num_new, tol=tol,
+                        failed=failed, **kwargs)
+
+    print("Adaptive sweep ran %i cases in %i rounds, %i left out" \
+            % (num_run, round_number, len(failed)))
+    return caselist, values
+
+
+def finished_cases(index_dir='_case_index', **params):
+    """
+    Return the cases recorded as 'done' in the results index *index_dir*
+    matching *params* (see results_index.query), e.g. to refine a sweep
+    that was run earlier:
+        cases = finished_cases('_case_index')
+        values = [metric(case) for case in cases]
+        points = refine(cases, values, space, num_new=8)
+    """
+
+    return [record['params'] for record in
+            results_index.query(index_dir, status='done', **params)]
@@ -0,0 +1,180 @@
+"""
+Persistent record of the state of each case in a parameter sweep, stored in
+an SQLite file so that it survives a crash, reboot or preempted job.
+
+Pass the name of the manifest file to run_many_cases_pool, e.g.
+    multip_tools.run_many_cases_pool(caselist, nprocs, run_one_case,
+                                     manifest='sweep_manifest.db')
+and each case will be recorded as 'pending', 'running', 'done' or 'failed',
+along with the time it started and finished and the process that ran it.
+
+If the sweep is interrupted, use
+    multip_tools.resume_many_cases_pool(caselist, nprocs, run_one_case,
+                                        manifest='sweep_manifest.db')
+to run only the cases that did not finish.  Any outdir left behind by a case
+that did not finish is moved aside first, see move_partial_outdirs.
+
+Cases are identified by case['case_name'] if present, otherwise by a hash of
+the case dictionary, see case_id.
+
+To see the state of a sweep from another shell:
+    python sweep_manifest.py sweep_manifest.db
+"""
+
+import os, sys, datetime, sqlite3, hashlib
+
+
+def case_id(case):
+    """
+    Return a string identifying *case* in the manifest:
+    case['case_name'] if present, otherwise a hash of the parameters.
+    """
+
+    if 'case_name' in case:
+        return str(case['case_name'])
+
+    items = ['%s=%r' % (k, case[k]) for k in sorted(case.keys(), key=str)]
+    return hashlib.sha1('\n'.join(items).encode()).hexdigest()[:16]
+
+
+def _timenow():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _connect(manifest):
+    """
+    Open the manifest, creating the table if necessary.
+    A long timeout is used since many processes may update it at once.
+    """
+
+    conn = sqlite3.connect(manifest, timeout=60.)
+    conn.execute("""CREATE TABLE IF NOT EXISTS cases (
+                        case_id   TEXT PRIMARY KEY,
+                        outdir    TEXT,
+                        state     TEXT,
+                        started   TEXT,
+                        finished  TEXT,
+                        pid       INTEGER,
+                        message   TEXT)""")
+    return conn
+
+
+def init_manifest(manifest, caselist):
+    """
+    Add every case in *caselist* to *manifest* in state 'pending', unless it
+    is already recorded from a previous run of the sweep.
+    """
+
+    conn = _connect(manifest)
+    with conn:
+        for case in caselist:
+            conn.execute("INSERT OR IGNORE INTO cases " \
+                         + "(case_id, outdir, state) VALUES (?, ?, ?)",
+                         (case_id(case), case.get('outdir', None), 'pending'))
+    conn.close()
+
+
+def set_case_state(manifest, case, state, message=None):
+    """
+    Record that *case* is now in *state*, one of
+    'pending', 'running', 'done' or 'failed'.
+    """
+
+    if state not in ['pending', 'running', 'done', 'failed']:
+        raise ValueError("Unrecognized state = %s" % state)
+
+    timenow = _timenow()
+    conn = _connect(manifest)
+    with conn:
+        if state == 'running':
+            conn.execute("INSERT OR REPLACE INTO cases VALUES " \
+                         + "(?, ?, ?, ?, NULL, ?, NULL)",
+                         (case_id(case), case.get('outdir', None), state,
+                          timenow, os.getpid()))
+        else:
+            conn.execute("UPDATE cases SET state=?, finished=?, message=? " \
+                         + "WHERE case_id=?",
+                         (state, timenow, message, case_id(case)))
+    conn.close()
+
+
+def read_manifest(manifest):
+    """
+    Return a dictionary mapping case_id to a dictionary with the
+    recorded 'outdir', 'state', 'started', 'finished', 'pid' and 'message'.
+    """
+
+    if not os.path.isfile(manifest):
+        return {}
+
+    conn = _connect(manifest)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("SELECT * FROM cases").fetchall()
+    conn.close()
+    return {row['case_id']: dict(row) for row in rows}
+
+
+def unfinished_cases(manifest, caselist):
+    """
+    Return the cases in *caselist* that are not recorded as 'done'
+    in *manifest*.
+    """
+
+    states = read_manifest(manifest)
+    return [case for case in caselist
+            if states.get(case_id(case), {}).get('state') != 'done']
+
+
+def move_partial_outdirs(manifest, caselist):
+    """
+    Any case in *caselist* that is recorded as 'running' or 'failed' in
+    *manifest* and whose outdir exists was interrupted (or failed) part way
+    through.
+    Move each such outdir to outdir + '_partial' so the case starts from
+    scratch when it is rerun, and return the list of directories moved.
+    """
+
+    import shutil
+
+    states = read_manifest(manifest)
+    moved = []
+    for case in caselist:
+        record = states.get(case_id(case), None)
+        outdir = case.get('outdir', None)
+        if record is None or outdir is None \
+                or record['state'] not in ['running', 'failed']:
+            continue
+        if os.path.isdir(outdir):
+            partial = outdir.rstrip('/') + '_partial'
+            if os.path.isdir(partial):
+                shutil.rmtree(partial)
+            os.rename(outdir, partial)
+            print('Case %s was %s, moved partially written %s to %s' \
+                    % (case_id(case), record['state'], outdir, partial))
+            moved.append(partial)
+    return moved
+
+
+def print_manifest(manifest):
+    """
+    Print a summary of the state of every case recorded in *manifest*.
+    """
+
+    states = read_manifest(manifest)
+    counts = {}
+    for cid in sorted(states.keys()):
+        record = states[cid]
+        counts[record['state']] = counts.get(record['state'], 0) + 1
+        print('%s  %s  started %s  finished %s' \
+                % (cid.ljust(30), record['state'].ljust(8),
+                   record['started'], record['finished']))
+    print('\n' + ', '.join(['%i %s' % (counts[s], s)
+                            for s in sorted(counts.keys())]))
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        print_manifest(sys.argv[1])
+    else:
+        print_manifest('sweep_manifest.db')
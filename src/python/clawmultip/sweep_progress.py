@@ -0,0 +1,220 @@
+"""
+Progress of a running sweep: the number of cases done, running, waiting and
+failed, the throughput in cases per hour and an estimate of the time left.
+
+run_many_cases_pool prints a line like
+
+    Progress: 40/100 finished (39 done, 1 failed), 4 running, 56 waiting,
+              120.5 cases/hour, ETA 0:31:10 (date and time in UTC)
+
+each time a case finishes, and if *status_file* is given also writes the
+status as JSON to that file, which can be read from another shell with
+
+    python sweep_progress.py sweep_status.json [interval]
+
+(repeated every *interval* seconds until the sweep is finished, if given).
+
+The time left is estimated from the cost of each case (see
+multip_tools.default_case_cost), rather than the number of cases, since the
+cases of a sweep can differ a lot in cost: the seconds per unit of cost of
+the cases finished so far times the cost of the cases not yet finished,
+less the time the running cases have already run, divided by the number of
+processes (or of cases left, if fewer).
+"""
+
+import os, sys, json, time, datetime
+
+# other modules in this directory:
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sweep_manifest
+sys.path.pop(0)
+
+
+def _timestr(t):
+    return datetime.datetime.utcfromtimestamp(t).strftime(
+                '%Y-%m-%d %H:%M:%S') + ' UTC'
+
+
+def _duration(seconds):
+    return str(datetime.timedelta(seconds=int(round(seconds))))
+
+
+class SweepProgress(object):
+    """
+    Keep track of the progress of the cases of a sweep, as reported by
+    started(task) when a case is handed to a process and finished(result)
+    when its result is returned (see multip_tools._run_task).
+
+    *costs* is a list with the estimated cost of each case in *caselist*
+    (all 1 if None), *nprocs* the number of processes running cases.
+    If *verbose* is True a line is printed each time a case finishes,
+    and if *status_file* is given the status is written to it.
+    """
+
+    def __init__(self, caselist, nprocs, costs=None, status_file=None,
+                 verbose=True):
+        self.case_ids = [sweep_manifest.case_id(case) for case in caselist]
+        self.nprocs = nprocs
+        if costs is None:
+            costs = [1. for case in caselist]
+        self.costs = list(costs)
+        self.status_file = status_file
+        self.verbose = verbose
+        self.t_start = time.time()
+        self.start_times = {}  # index of each running case: start time
+        self.results = {}      # index of each finished case: result
+        self.tracks_starts = False
+        self.write()
+
+    def started(self, task):
+        """
+        Record that the case of *task* was handed to a process.
+        """
+
+        self.tracks_starts = True
+        self.start_times[task['index']] = time.time()
+
+    def finished(self, result):
+        """
+        Record the *result* of a case, print the progress and write the
+        status file.
+        """
+
+        self.start_times.pop(result['index'], None)
+        self.results[result['index']] = result
+        if self.verbose:
+            print(self.line())
+        self.write()
+
+    def running(self):
+        """
+        Return the indices of the cases that are running.  If started() is
+        not called (e.g. schedule == 'static') the number of cases running
+        is taken to be *nprocs*, or the number of cases left if fewer,
+        and they are not identified.
+        """
+
+        if self.tracks_starts:
+            return sorted(self.start_times.keys())
+        num_left = len(self.case_ids) - len(self.results)
+        return [None] * min(self.nprocs, num_left)
+
+    def status(self):
+        """
+        Return a dictionary with the current status of the sweep.
+        """
+
+        now = time.time()
+        elapsed = now - self.t_start
+        total = len(self.case_ids)
+        finished = len(self.results)
+        failed = [index for index, result in self.results.items()
+                  if result['status'] == 'failed']
+        running = self.running()
+
+        status = {'started': _timestr(self.t_start),
+                  'updated': _timestr(now),
+                  'elapsed': elapsed,
+                  'total': total,
+                  'finished': finished,
+                  'done': finished - len(failed),
+                  'failed': len(failed),
+                  'running': len(running),
+                  'waiting': total - finished - len(running),
+                  'cases_per_hour': 3600. * finished / elapsed \
+                                    if elapsed > 0 else None,
+                  'eta_seconds': None,
+                  'eta': None,
+                  'running_cases': [self.case_ids[index] for index in running
+                                    if index is not None],
+                  'failed_cases': [self.case_ids[index] for index in failed],
+                  'complete': finished == total}
+
+        # seconds per unit of cost of the finished cases:
+        cost_finished = sum([self.costs[index] for index in self.results])
+        time_finished = sum([result['elapsed']
+                             for result in self.results.values()])
+        if finished == total:
+            status['eta_seconds'] = 0.
+        elif cost_finished > 0 and time_finished > 0:
+            cost_left = sum(self.costs) - cost_finished
+            time_left = cost_left * time_finished / cost_finished \
+                        - sum([now - t for t in self.start_times.values()])
+            # no more processes are busy than there are cases left:
+            parallel = min(self.nprocs, total - finished)
+            status['eta_seconds'] = max(time_left, 0.) / parallel
+        if status['eta_seconds'] is not None:
+            status['eta'] = _timestr(now + status['eta_seconds'])
+        return status
+
+    def line(self, status=None):
+        """
+        Return a line of text describing the *status* (by default the
+        current status).
+        """
+
+        if status is None:
+            status = self.status()
+        return format_status(status)
+
+    def write(self):
+        """
+        Write the status to *status_file* (if not None), without a reader
+        ever seeing a partially written file.
+        """
+
+        if self.status_file is None:
+            return
+        tmpname = '%s.tmp%i' % (self.status_file, os.getpid())
+        with open(tmpname, 'w') as f:
+            json.dump(self.status(), f, indent=1)
+        os.replace(tmpname, self.status_file)
+
+
+def format_status(status):
+    """
+    Return a line of text describing *status*, as returned by
+    SweepProgress.status or read_status.
+    """
+
+    line = 'Progress: %i/%i finished (%i done, %i failed), %i running, ' \
+            '%i waiting' % (status['finished'], status['total'],
+                            status['done'], status['failed'],
+                            status['running'], status['waiting'])
+    if status['cases_per_hour'] is not None:
+        line += ', %.1f cases/hour' % status['cases_per_hour']
+    if status['complete']:
+        line += ', complete after %s' % _duration(status['elapsed'])
+    elif status['eta_seconds'] is not None:
+        line += ', ETA %s (%s)' % (_duration(status['eta_seconds']),
+                                   status['eta'])
+    return line
+
+
+def read_status(status_file):
+    """
+    Return the status written to *status_file* by SweepProgress.
+    """
+
+    with open(status_file) as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print('Usage: python sweep_progress.py sweep_status.json [interval]')
+        sys.exit(1)
+
+    status_file = sys.argv[1]
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    while True:
+        status = read_status(status_file)
+        print('%s  %s' % (status['updated'], format_status(status)))
+        if status['running_cases']:
+            print('    running: %s' % ', '.join(status['running_cases']))
+        if status['failed_cases']:
+            print('    failed:  %s' % ', '.join(status['failed_cases']))
+        if interval is None or status['complete']:
+            break
+        time.sleep(interval)
@@ -0,0 +1,9 @@
+"""
+The modules in src/python/clawmultip import each other as top-level
+modules, so the tests import them the same way.
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src', 'python', 'clawmultip'))
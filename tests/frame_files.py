@@ -0,0 +1,64 @@
+"""
+Output files in the format written by Clawpack, for the tests.
+"""
+
+import os
+
+import numpy as np
+
+
+def write_frame(outdir, frameno, t, q, output_format, num_ghost=2):
+    """Write a 1d frame with one patch in the format of Clawpack."""
+    suffix = str(frameno).zfill(4)
+    num_eqn, mx = q.shape
+    with open(os.path.join(outdir, 'fort.t' + suffix), 'w') as f:
+        f.write('%26.16E    time\n' % t)
+        f.write('%5i                 meqn\n' % num_eqn)
+        f.write('    1                 ngrids\n')
+        f.write('    0                 maux\n')
+        f.write('    1                 ndim\n')
+        f.write('%5i                 nghost\n' % num_ghost)
+        f.write('%9s                    format\n' % output_format)
+    with open(os.path.join(outdir, 'fort.q' + suffix), 'w') as f:
+        f.write('    1                 grid_number\n')
+        f.write('    1                 AMR_level\n')
+        f.write('%5i                 mx\n' % mx)
+        f.write('    0.00000000E+00    xlow\n')
+        f.write('%18.8E    dx\n' % (1. / mx))
+        f.write('\n')
+        if output_format == 'ascii':
+            for i in range(mx):
+                f.write(' '.join(['%26.16E' % v for v in q[:, i]]) + '\n')
+    if output_format != 'ascii':
+        qghost = np.zeros((num_eqn, mx + 2*num_ghost))
+        qghost[:, num_ghost:num_ghost + mx] = q
+        qghost.T.astype(np.float64).tofile(os.path.join(outdir,
+                                                        'fort.b' + suffix))
+
+
+def write_amr_frame(outdir, frameno, t, patches):
+    """
+    Write a 1d frame in ascii format with several patches, given as a
+    list of tuples (level, xlower, dx, q).
+    """
+    suffix = str(frameno).zfill(4)
+    num_eqn = patches[0][3].shape[0]
+    with open(os.path.join(outdir, 'fort.t' + suffix), 'w') as f:
+        f.write('%26.16E    time\n' % t)
+        f.write('%5i                 meqn\n' % num_eqn)
+        f.write('%5i                 ngrids\n' % len(patches))
+        f.write('    0                 maux\n')
+        f.write('    1                 ndim\n')
+        f.write('    2                 nghost\n')
+        f.write('%9s                    format\n' % 'ascii')
+    with open(os.path.join(outdir, 'fort.q' + suffix), 'w') as f:
+        for n, (level, xlower, dx, q) in enumerate(patches):
+            f.write('%5i                 grid_number\n' % (n + 1))
+            f.write('%5i                 AMR_level\n' % level)
+            f.write('%5i                 mx\n' % q.shape[1])
+            f.write('%18.8E    xlow\n' % xlower)
+            f.write('%18.8E    dx\n' % dx)
+            f.write('\n')
+            for i in range(q.shape[1]):
+                f.write(' '.join(['%26.16E' % v for v in q[:, i]]) + '\n')
+            f.write('\n')
@@ -0,0 +1,156 @@
+import os
+
+import pytest
+
+import build_cache
+
+# stand-ins for the Clawpack Makefiles, in which "compiling" copies a source
+# file to its object file and "linking" concatenates the object files:
+makefile_common = '''\
+COMMON_SOURCES ?=
+COMMON_MODULES ?=
+ALL_SOURCES = $(SOURCES) $(COMMON_SOURCES)
+ALL_MODULES = $(MODULES) $(COMMON_MODULES)
+OBJECTS = $(ALL_SOURCES:.f90=.o)
+MODULE_OBJECTS = $(ALL_MODULES:.f90=.o)
+%.o : %.f90 ; cp $< $@
+$(EXE): $(MODULE_OBJECTS) $(OBJECTS) ; cat $^ > $@
+.exe: $(EXE)
+'''
+
+makefile_package = '''\
+COMMON_MODULES = $(CLAW)/pkg/mod.f90
+COMMON_SOURCES = $(CLAW)/pkg/driver.f90 $(CLAW)/pkg/step.f90
+'''
+
+makefile = '''\
+CLAWMAKE = $(CLAW)/clawutil/Makefile.common
+EXE = xclaw
+include $(CLAW)/pkg/Makefile.pkg
+MODULES =
+SOURCES = qinit.f90 $(CLAW)/riemann/rp1.f90
+include $(CLAWMAKE)
+'''
+
+
+def make_claw(path, monkeypatch):
+    """
+    Make a stand-in for $CLAW in *path* and set CLAW to it.
+    """
+
+    for subdir in ['clawutil', 'pkg', 'riemann']:
+        os.makedirs(str(path / subdir))
+    (path / 'clawutil' / 'Makefile.common').write_text(makefile_common)
+    (path / 'pkg' / 'Makefile.pkg').write_text(makefile_package)
+    (path / 'pkg' / 'mod.f90').write_text('module m\nend module m\n')
+    (path / 'pkg' / 'driver.f90').write_text('program driver\nend\n')
+    (path / 'pkg' / 'step.f90').write_text('subroutine step\nend\n')
+    (path / 'riemann' / 'rp1.f90').write_text('subroutine rp1\nend\n')
+    monkeypatch.setenv('CLAW', str(path))
+    return str(path)
+
+
+def make_build_dir(path):
+    os.makedirs(str(path))
+    (path / 'Makefile').write_text(makefile)
+    (path / 'qinit.f90').write_text('subroutine qinit\nend\n')
+    return str(path)
+
+
+def library_files(claw):
+    return sorted([os.path.join(dirpath, fname)
+                   for dirpath, dirnames, fnames in os.walk(claw)
+                   for fname in fnames])
+
+
+def test_variant_sources(tmp_path, monkeypatch):
+    claw = make_claw(tmp_path / 'claw', monkeypatch)
+    build_dir = make_build_dir(tmp_path / 'app')
+
+    sources, modules = build_cache.variant_sources(build_dir, ())
+
+    # the application and library sources, as full paths:
+    assert sources == [os.path.join(build_dir, 'qinit.f90'),
+                       os.path.join(claw, 'riemann', 'rp1.f90'),
+                       os.path.join(claw, 'pkg', 'driver.f90'),
+                       os.path.join(claw, 'pkg', 'step.f90')]
+    assert modules == [os.path.join(claw, 'pkg', 'mod.f90')]
+
+
+def test_variant_hash(tmp_path, monkeypatch):
+    claw = make_claw(tmp_path / 'claw', monkeypatch)
+    build_dir = make_build_dir(tmp_path / 'app')
+    make_vars = (('FFLAGS', '-O2'),)
+    sources, modules = build_cache.variant_sources(build_dir, make_vars)
+
+    def variant_hash(make_vars=make_vars):
+        return build_cache.variant_hash(build_dir, make_vars, sources,
+                                        modules)
+
+    monkeypatch.delenv('FFLAGS', raising=False)
+    h = variant_hash()
+    assert variant_hash() == h
+
+    # everything that changes the executable changes the hash:
+    assert variant_hash((('FFLAGS', '-O3'),)) != h
+    monkeypatch.setenv('FFLAGS', '-g')
+    assert variant_hash() != h
+    monkeypatch.delenv('FFLAGS')
+    (tmp_path / 'app' / 'qinit.f90').write_text('subroutine qinit\n\nend\n')
+    assert variant_hash() != h
+    h = variant_hash()
+    (tmp_path / 'claw' / 'pkg' / 'step.f90').write_text(
+            'subroutine step\n\nend\n')
+    assert variant_hash() != h
+    h = variant_hash()
+    (tmp_path / 'app' / 'params.h').write_text('integer, parameter :: n = 1\n')
+    assert variant_hash() != h
+
+    # but not the time stamps of the files:
+    h = variant_hash()
+    os.utime(os.path.join(claw, 'pkg', 'driver.f90'), (0, 0))
+    assert variant_hash() == h
+
+
+def test_build_executables_per_cache_dir(tmp_path, monkeypatch):
+    claw = make_claw(tmp_path / 'claw', monkeypatch)
+    build_dir = make_build_dir(tmp_path / 'app')
+    claw_files = library_files(claw)
+    caselist = [{'make_vars': {'FFLAGS': '-O2'}, 'build_dir': build_dir,
+                 'build_cache_dir': str(tmp_path / cache)}
+                for cache in ['cache1', 'cache1', 'cache2']]
+
+    paths = build_cache.build_executables(caselist, 2, verbose=False)
+
+    assert len(paths) == 2
+    assert caselist[0]['xclawcmd'] == caselist[1]['xclawcmd']
+    assert os.path.dirname(caselist[0]['xclawcmd']) \
+            == paths[(build_cache.build_variant(caselist[0]),
+                      str(tmp_path / 'cache1'))]
+    assert caselist[2]['xclawcmd'].startswith(str(tmp_path / 'cache2'))
+    for case in caselist:
+        with open(case['xclawcmd']) as f:
+            exe = f.read()
+        for name in ['qinit', 'rp1', 'driver', 'step', 'module m']:
+            assert name in exe
+        # the library objects are built in the build directory:
+        assert os.path.isfile(os.path.join(
+                os.path.dirname(case['xclawcmd']), 'step.o'))
+    assert library_files(claw) == claw_files
+    assert not os.path.exists(os.path.join(build_dir, 'qinit.o'))
+
+
+def test_build_same_basename(tmp_path, monkeypatch):
+    make_claw(tmp_path / 'claw', monkeypatch)
+    build_dir = make_build_dir(tmp_path / 'app')
+    # a source with the same name as a library source that is not excluded:
+    (tmp_path / 'app' / 'step.f90').write_text('subroutine step\n\nend\n')
+    case = {'make_vars': {'SOURCES': 'qinit.f90 step.f90'},
+            'build_dir': build_dir,
+            'build_cache_dir': str(tmp_path / 'cache')}
+
+    with pytest.raises(RuntimeError, match='same file name') as err:
+        build_cache.build_executables([case], verbose=False)
+    assert os.path.join('app', 'step.f90') in str(err.value)
+    assert os.path.join('pkg', 'step.f90') in str(err.value)
+    assert os.listdir(str(tmp_path / 'cache')) == []
@@ -0,0 +1,265 @@
+import os
+
+import pytest
+
+import clawmultip_tools
+
+
+def test_runclaw_thread_paths(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    calls = []
+    thread = clawmultip_tools.RunclawThread(lambda **kwargs:
+                                            calls.append(kwargs),
+            {'xclawcmd': 'xclaw', 'outdir': '_output', 'rundir': '_output',
+             'xclawout': '_output/fortran_output.txt', 'xclawerr': None,
+             'nohup': False})
+    # as done by plotting while the run thread is alive:
+    os.mkdir('_plots')
+    monkeypatch.chdir(tmp_path / '_plots')
+    thread.start()
+    thread.join()
+
+    assert thread.error is None
+    assert calls == [{'xclawcmd': str(tmp_path / 'xclaw'),
+                      'outdir': str(tmp_path / '_output'),
+                      'rundir': str(tmp_path / '_output'),
+                      'xclawout': str(tmp_path / '_output'
+                                      / 'fortran_output.txt'),
+                      'xclawerr': None, 'nohup': False}]
+
+
+def test_case_cache_key(tmp_path):
+    os.mkdir(str(tmp_path / '_output'))
+    files = {'claw.data': '100    mx\n', 'setrun.py': 'mx = 100\n',
+             'xclaw': 'executable 1\n'}
+
+    def key(runexe=None):
+        for fname, text in files.items():
+            path = tmp_path / fname
+            if fname.endswith('.data'):
+                path = tmp_path / '_output' / fname
+            path.write_text(text)
+        return clawmultip_tools.case_cache_key(str(tmp_path / '_output'),
+                    str(tmp_path / 'xclaw'), str(tmp_path / 'setrun.py'),
+                    runexe)
+
+    key0 = key()
+    assert key() == key0
+    keys = [key0]
+    for fname, text in [('claw.data', '200    mx\n'),
+                        ('setrun.py', 'mx = 200\n'),
+                        ('xclaw', 'executable 2\n')]:
+        files[fname] = text
+        keys.append(key())
+    keys.append(key(runexe='mpirun -n 2'))
+    # every change gives a new key:
+    assert len(set(keys)) == len(keys)
+
+    # files other than .data files in outdir do not matter:
+    (tmp_path / '_output' / 'fort.q0000').write_text('output\n')
+    assert key() == keys[-2]
+
+
+def run_one_case_setrun(case):
+    setrun = clawmultip_tools.load_module_cached(case['setrun_file'],
+                                                 'setrun')
+    return setrun.mx
+
+
+def test_module_cache(tmp_path):
+    import multip_tools
+
+    setrun_file = str(tmp_path / 'setrun.py')
+    with open(setrun_file, 'w') as f:
+        f.write('import os\n'
+                'with open(os.path.join(os.path.dirname(__file__),\n'
+                '                       "loads.txt"), "a") as f:\n'
+                '    f.write("loaded\\n")\n'
+                'mx = 100\n')
+    caselist = [{'case_name': 'case%i' % i, 'setrun_file': setrun_file}
+                for i in range(3)]
+    results = multip_tools.run_many_cases_pool(caselist, 1,
+                    run_one_case_setrun, abort_time=0, progress=False)
+    assert [result['value'] for result in results] == [100] * 3
+    # loaded once by the worker process for all three cases:
+    with open(str(tmp_path / 'loads.txt')) as f:
+        assert f.readlines() == ['loaded\n']
+
+    setrun = clawmultip_tools.load_module_cached(setrun_file, 'setrun')
+    assert clawmultip_tools.load_module_cached(setrun_file, 'setrun') \
+            is setrun
+    # loaded again once the file is modified:
+    mtime = os.path.getmtime(setrun_file)
+    os.utime(setrun_file, (mtime + 10, mtime + 10))
+    assert clawmultip_tools.load_module_cached(setrun_file, 'setrun') \
+            is not setrun
+
+
+def test_cached_output_from_archive(tmp_path, monkeypatch):
+    import sweep_archive
+
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('_output_a')
+    for fname in ['fort.q0000', 'fort.t0000', 'claw.data',
+                  'python_output.txt']:
+        with open(os.path.join('_output_a', fname), 'w') as f:
+            f.write('run a: %s\n' % fname)
+    clawmultip_tools.register_cached_output('key1', '_output_a', '_cache')
+    sweep_archive.archive_outdir('_output_a')
+
+    # a case with the same key, and an earlier run with more frames:
+    os.mkdir('_output_b')
+    for fname in ['fort.q0000', 'fort.q0001', 'claw.data']:
+        with open(os.path.join('_output_b', fname), 'w') as f:
+            f.write('run b: %s\n' % fname)
+
+    assert not clawmultip_tools.use_cached_output('key2', '_output_b',
+                                                  '_cache')
+    assert clawmultip_tools.use_cached_output('key1', '_output_b', '_cache')
+    assert sorted(os.listdir('_output_b')) == ['cache_key.txt', 'claw.data',
+                                               'fort.q0000', 'fort.t0000']
+    with open(os.path.join('_output_b', 'fort.q0000')) as f:
+        assert f.read() == 'run a: fort.q0000\n'
+    with open(os.path.join('_output_b', 'claw.data')) as f:
+        assert f.read() == 'run b: claw.data\n'
+    assert clawmultip_tools._read_cache_key('_output_b') == 'key1'
+
+    # the archived case itself, rerun with the same key:
+    os.mkdir('_output_a')
+    assert clawmultip_tools.use_cached_output('key1', '_output_a', '_cache')
+    assert 'fort.t0000' in os.listdir('_output_a')
+
+
+setplot_archived = '''
+import os, glob
+
+def setplot(plotdata=None, case=None):
+    if case.get('fail', False):
+        raise ValueError('setplot failed')
+    if plotdata is None:
+        from clawpack.visclaw.data import ClawPlotData
+        plotdata = ClawPlotData()
+    plotdata.clearfigures()
+
+    def afteraxes(current_data):
+        if current_data.frameno == case.get('fail_frameno'):
+            raise ValueError('afteraxes failed')
+        # record which outdirs are extracted while this frame is plotted:
+        with open(case['log'], 'a') as f:
+            f.write('%s %s\\n' % (case['case_name'], ' '.join(sorted(
+                    glob.glob(os.path.join(case['root'], '_output_*/'))))))
+
+    plotfigure = plotdata.new_plotfigure(name='q', figno=0)
+    plotaxes = plotfigure.new_plotaxes()
+    plotaxes.afteraxes = afteraxes
+    plotitem = plotaxes.new_plotitem(plot_type='1d_plot')
+    plotitem.plot_var = 0
+    plotdata.printfigs = True
+    plotdata.print_format = 'png'
+    plotdata.print_framenos = 'all'
+    plotdata.print_fignos = 'all'
+    plotdata.html = False
+    plotdata.latex = False
+    return plotdata
+'''
+
+
+def make_archived_cases(tmp_path, num_cases, archive=True, num_frames=[2]):
+    import numpy as np
+    import sweep_archive
+    from frame_files import write_frame
+
+    (tmp_path / 'setplot_archived.py').write_text(setplot_archived)
+    caselist = []
+    for n in range(num_cases):
+        outdir = str(tmp_path / ('_output_%i' % n))
+        os.mkdir(outdir)
+        for frameno in range(num_frames[n % len(num_frames)]):
+            write_frame(outdir, frameno, 0.5*frameno,
+                        np.ones((1, 10)) * (n + frameno), 'ascii')
+        if archive:
+            sweep_archive.archive_outdir(outdir)
+        caselist.append({'case_name': 'case%i' % n, 'outdir': outdir,
+                         'plotdir': str(tmp_path / ('_plots_%i' % n)),
+                         'setplot_file': str(tmp_path
+                                             / 'setplot_archived.py'),
+                         'xclawcmd': None, 'root': str(tmp_path),
+                         'log': str(tmp_path / 'plot_log.txt'),
+                         'index_dir': str(tmp_path / '_case_index')})
+    return caselist
+
+
+def test_plot_failure_rearchives(tmp_path, monkeypatch):
+    import zipfile
+    pytest.importorskip('clawpack.visclaw')
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('CLAW', os.environ.get('CLAW', str(tmp_path)))
+    case = make_archived_cases(tmp_path, 1)[0]
+    case['fail'] = True
+
+    with pytest.raises(ValueError, match='setplot failed'):
+        clawmultip_tools.plot_stage_clawpack(case)
+
+    assert not os.path.exists(case['outdir'])
+    with zipfile.ZipFile(case['outdir'] + '.zip') as zf:
+        assert 'python_output_plots.txt' in zf.namelist()
+        assert 'fort.q0001' in zf.namelist()
+
+
+def test_plot_many_archived_cases(tmp_path, monkeypatch):
+    pytest.importorskip('clawpack.visclaw')
+
+    monkeypatch.chdir(tmp_path)
+    # plotclaw is imported from this directory (see conftest.py):
+    monkeypatch.setenv('CLAW', os.environ.get('CLAW', str(tmp_path)))
+    caselist = make_archived_cases(tmp_path, 3)
+
+    results = clawmultip_tools.plot_many_cases_frames(caselist, 1,
+                                                      abort_time=0)
+
+    assert [result['status'] for result in results] == ['done'] * 3
+    assert [result['num_frames'] for result in results] == [2] * 3
+    # each case is only extracted while its own frames are plotted:
+    with open(caselist[0]['log']) as f:
+        lines = [line.split() for line in f]
+    assert len(lines) == 6
+    for line in lines:
+        n = int(line[0][len('case'):])
+        assert line[1:] == [caselist[n]['outdir'] + os.sep]
+    for case in caselist:
+        assert not os.path.exists(case['outdir'])
+        assert os.path.isfile(case['outdir'] + '.zip')
+        assert os.path.isfile(os.path.join(case['plotdir'],
+                                           'frame0001fig0.png'))
+
+
+def test_plot_many_cases_frames(tmp_path, monkeypatch):
+    import results_index
+    pytest.importorskip('clawpack.visclaw')
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('CLAW', os.environ.get('CLAW', str(tmp_path)))
+    # one case with many frames and two with one frame each:
+    caselist = make_archived_cases(tmp_path, 3, archive=False,
+                                   num_frames=[5, 1, 1])
+    caselist[0]['fail_frameno'] = 3
+
+    results = clawmultip_tools.plot_many_cases_frames(caselist, 2,
+                                                      abort_time=0)
+
+    assert [result['num_frames'] for result in results] == [5, 1, 1]
+    assert [result['status'] for result in results] \
+            == ['failed', 'done', 'done']
+    # a frame that fails does not stop the other frames of its case:
+    assert results[0]['failed_frames'] == [3]
+    for frameno in [0, 1, 2, 4]:
+        assert os.path.isfile(os.path.join(caselist[0]['plotdir'],
+                        'frame%sfig0.png' % str(frameno).zfill(4)))
+    for case in caselist[1:]:
+        assert os.path.isfile(os.path.join(case['plotdir'],
+                                           'frame0000fig0.png'))
+    index = results_index.read_index(caselist[0]['index_dir'])
+    assert sorted([(record['case_name'], record['plot_status'])
+                   for record in index]) \
+            == [('case0', 'failed'), ('case1', 'done'), ('case2', 'done')]
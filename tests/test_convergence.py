@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import pytest
+
+import convergence
+from frame_files import write_frame, write_amr_frame
+
+
+def test_convergence_rates():
+    rows = []
+    for order, p in [(1, 1.), (2, 2.)]:
+        for mx in [50, 100, 200]:
+            dx = 1. / mx
+            rows.append({'group': {'order': order}, 'frameno': 1,
+                         'dx': dx, 'L1': 3*dx**p, 'L2': dx**p,
+                         'max': 0.})
+    rates = convergence.convergence_rates(rows)
+    assert [rate['group'] for rate in rates] == [{'order': 1},
+                                                 {'order': 2}]
+    for rate, p in zip(rates, [1., 2.]):
+        assert rate['num_cases'] == 3 and rate['frameno'] == 1
+        assert abs(rate['L1'] - p) < 1e-10
+        assert abs(rate['L2'] - p) < 1e-10
+        # all errors 0, so no rate can be fit:
+        assert rate['max'] is None
+
+
+@pytest.mark.parametrize('nprocs', [1, 2])
+def test_compute_errors(tmp_path, nprocs):
+    caselist = []
+    for mx in [20, 40, 80]:
+        outdir = str(tmp_path / ('_output_mx%i' % mx))
+        os.mkdir(outdir)
+        x = (np.arange(mx) + 0.5) / mx
+        # second order error:
+        q = np.array([np.sin(2*np.pi*x) + 0.1 / mx**2])
+        write_frame(outdir, 1, 0.5, q, 'ascii')
+        caselist.append({'case_name': 'mx%i' % mx, 'mx': mx,
+                         'outdir': outdir})
+
+    # a lambda cannot be pickled, so this needs forked worker processes:
+    qtrue = lambda x, t: np.sin(2*np.pi*x)
+    rows = convergence.compute_errors(caselist, [1], qtrue=qtrue,
+                                      nprocs=nprocs)
+    assert [row['case_name'] for row in rows] == ['mx20', 'mx40', 'mx80']
+    for row in rows:
+        assert abs(row['max'] - 0.1 / row['mx']**2) < 1e-10
+
+    rates = convergence.convergence_rates(rows)
+    assert len(rates) == 1
+    assert abs(rates[0]['max'] - 2.) < 1e-3
+
+
+def test_amr_errors(tmp_path):
+    outdir = str(tmp_path / '_output')
+    os.mkdir(outdir)
+    qtrue = lambda x, t: np.sin(2*np.pi*x)
+    # level 1 on [0,1] with error 1, level 2 on [0.5,1] with error 0.1:
+    x1 = (np.arange(10) + 0.5) / 10
+    x2 = 0.5 + (np.arange(10) + 0.5) / 20
+    write_amr_frame(outdir, 1, 0., [(1, 0., 0.1, np.array([qtrue(x1, 0)+1])),
+                                (2, 0.5, 0.05, np.array([qtrue(x2, 0)+.1]))])
+    case = {'case_name': 'amr', 'mx': 10, 'outdir': outdir}
+    rows = convergence.compute_errors([case], [1], qtrue=qtrue)
+    assert rows[0]['m'] is None and abs(rows[0]['dx'] - 0.1) < 1e-12
+    # the level 1 cells in [0.5,1] are covered by level 2:
+    assert abs(rows[0]['L1'] - (0.5 + 0.05)) < 1e-10
+    assert abs(rows[0]['L2'] - np.sqrt(0.5 + 0.005)) < 1e-10
+    assert abs(rows[0]['max'] - 1.) < 1e-10
+
+    fine = str(tmp_path / '_output_fine')
+    os.mkdir(fine)
+    write_frame(fine, 1, 0., np.array([qtrue(x2, 0)]), 'ascii')
+    caselist = [case, {'case_name': 'fine', 'mx': 20, 'outdir': fine}]
+    with pytest.raises(ValueError, match='single patch'):
+        convergence.compute_errors(caselist, [1])
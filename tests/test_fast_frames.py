@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import pytest
+
+import fast_frames
+from frame_files import write_frame
+
+data = pytest.importorskip('clawpack.visclaw.data')
+plotpages = pytest.importorskip('clawpack.visclaw.plotpages')
+
+
+def make_plotdata(outdir, plotdir):
+    plotdata = data.ClawPlotData()
+    plotdata.outdir = outdir
+    plotdata.plotdir = plotdir
+    plotdata.format = 'ascii'
+    plotfigure = plotdata.new_plotfigure(name='q', figno=1)
+    plotaxes = plotfigure.new_plotaxes()
+    plotaxes.xlimits = [0, 1]
+    plotaxes.ylimits = [-1.5, 1.5]
+    plotaxes.title = 'q'
+    plotitem = plotaxes.new_plotitem(plot_type='1d_plot')
+    plotitem.plot_var = 0
+    plotitem.plotstyle = '-o'
+    plotitem.color = 'b'
+    plotdata.printfigs = True
+    plotdata.print_format = 'png'
+    plotdata.print_framenos = 'all'
+    plotdata.print_fignos = 'all'
+    plotdata.html = False
+    plotdata.latex = False
+    return plotdata
+
+
+def test_same_png_as_plotclaw_driver(tmp_path):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.image
+
+    outdir = str(tmp_path / '_output')
+    os.mkdir(outdir)
+    x = (np.arange(50) + 0.5) / 50
+    write_frame(outdir, 0, 0., np.array([np.sin(2*np.pi*x)]), 'ascii')
+
+    pngs = []
+    for fast in [False, True]:
+        plotdir = str(tmp_path / ('_plots_%s' % fast))
+        plotdata = make_plotdata(outdir, plotdir)
+        plotdata._parallel_todo = 'initialize'
+        plotpages.plotclaw_driver(plotdata, verbose=False, format='ascii')
+        assert fast_frames.supported(plotdata)
+        if fast:
+            fast_frames.render_frame(plotdata, 0)
+        else:
+            fast_frames.render_frames(plotdata, [0], 'ascii')
+        pngs.append(matplotlib.image.imread(os.path.join(plotdir,
+                                                'frame0000fig1.png')))
+
+    assert pngs[0].shape == pngs[1].shape
+    assert np.abs(pngs[0] - pngs[1]).max() < 1e-6
@@ -0,0 +1,150 @@
+import os
+
+import pytest
+
+import frame_fingerprints
+
+data = pytest.importorskip('clawpack.visclaw.data')
+
+
+def make_plotdata(tmp_path, ylimits=(-1, 1)):
+    plotdata = data.ClawPlotData()
+    plotdata.outdir = str(tmp_path / '_output')
+    plotdata.plotdir = str(tmp_path / '_plots')
+    plotfigure = plotdata.new_plotfigure(name='q', figno=1)
+    plotaxes = plotfigure.new_plotaxes()
+    plotaxes.ylimits = list(ylimits)
+    plotitem = plotaxes.new_plotitem(plot_type='1d_plot')
+    plotitem.plot_var = 0
+    return plotdata
+
+
+def plot(plotdata, framenos, case):
+    """Pretend to plot the frames and record their fingerprints."""
+    for frameno in framenos:
+        for figno in frame_fingerprints.frame_figures(plotdata):
+            png = 'frame%sfig%s.png' % (str(frameno).zfill(4), figno)
+            open(os.path.join(plotdata.plotdir, png), 'w').close()
+    frame_fingerprints.update_fingerprints(plotdata, framenos, case)
+
+
+@pytest.fixture
+def case(tmp_path):
+    os.mkdir(str(tmp_path / '_output'))
+    os.mkdir(str(tmp_path / '_plots'))
+    for frameno in [0, 1]:
+        for ext in ['q', 't']:
+            fname = tmp_path / '_output' / ('fort.%s%s' % (ext,
+                                            str(frameno).zfill(4)))
+            fname.write_text('frame %i\n' % frameno)
+    setplot_file = tmp_path / 'setplot.py'
+    setplot_file.write_text('qtrue_shift = 0.\n')
+    return {'case_name': 'case0', 'outdir': str(tmp_path / '_output'),
+            'setplot_file': str(setplot_file), 'mx': 100}
+
+
+def test_up_to_date(tmp_path, case):
+    plotdata = make_plotdata(tmp_path)
+    assert frame_fingerprints.stale_frames(plotdata, [0, 1], case) \
+            == [([1], [0, 1])]
+    plot(plotdata, [0, 1], case)
+    assert frame_fingerprints.stale_frames(plotdata, [0, 1], case) == []
+
+    # parameters not in plot_keys do not affect the plots:
+    case['mx'] = 200
+    case['outdir'] = str(tmp_path / '_output_staged')
+    assert frame_fingerprints.stale_frames(plotdata, [0, 1], case) == []
+
+
+def test_invalidation(tmp_path, case):
+    plotdata = make_plotdata(tmp_path)
+    plot(plotdata, [0, 1], case)
+
+    # new output for frame 1:
+    (tmp_path / '_output' / 'fort.q0001').write_text('frame 1, longer\n')
+    assert frame_fingerprints.stale_frames(plotdata, [0, 1], case) \
+            == [([1], [1])]
+    plot(plotdata, [1], case)
+
+    # missing png:
+    os.remove(str(tmp_path / '_plots' / 'frame0000fig1.png'))
+    assert frame_fingerprints.stale_frames(plotdata, [0, 1], case) \
+            == [([1], [0])]
+    plot(plotdata, [0], case)
+
+    # figure settings:
+    plotdata = make_plotdata(tmp_path, ylimits=(-2, 2))
+    assert frame_fingerprints.stale_frames(plotdata, [0, 1], case) \
+            == [([1], [0, 1])]
+    plot(plotdata, [0, 1], case)
+
+    # other changes to the setplot file:
+    with open(case['setplot_file'], 'a') as f:
+        f.write('# a comment\n')
+    assert frame_fingerprints.stale_frames(plotdata, [0, 1], case) == []
+
+    # a case parameter listed in case['plot_keys']:
+    case['plot_keys'] = ['mx']
+    plot(plotdata, [0, 1], case)
+    case['mx'] = 200
+    assert frame_fingerprints.stale_frames(plotdata, [0, 1], case) \
+            == [([1], [0, 1])]
+
+
+def test_closure(tmp_path, case):
+    def make_afteraxes(beta):
+        def qtrue(x):
+            return beta * x
+        def afteraxes(current_data):
+            return qtrue(current_data.x)
+        return afteraxes
+
+    plotdata = make_plotdata(tmp_path)
+    plotdata.plotfigure_dict['q'].plotaxes_dict['AXES1'].afteraxes = \
+            make_afteraxes(1.)
+    plot(plotdata, [0, 1], case)
+    plotdata.plotfigure_dict['q'].plotaxes_dict['AXES1'].afteraxes = \
+            make_afteraxes(2.)
+    assert frame_fingerprints.stale_frames(plotdata, [0, 1], case) \
+            == [([1], [0, 1])]
+
+
+def test_module_values(tmp_path, case):
+    import types
+
+    setplot = types.ModuleType('setplot')
+    exec('qtrue_shift = 0.\n'
+         'def qtrue(x):\n'
+         '    return x + qtrue_shift\n'
+         'def afteraxes(current_data):\n'
+         '    return qtrue(current_data.x)\n', setplot.__dict__)
+
+    plotdata = make_plotdata(tmp_path)
+    plotfigure = plotdata.new_plotfigure(name='q with qtrue', figno=2)
+    plotaxes = plotfigure.new_plotaxes()
+    plotaxes.afteraxes = setplot.afteraxes
+    plotaxes.new_plotitem(plot_type='1d_plot')
+    plot(plotdata, [0, 1], case)
+    assert frame_fingerprints.stale_frames(plotdata, [0, 1], case) == []
+
+    # only the figure that uses the value is remade:
+    setplot.qtrue_shift = 0.5
+    assert frame_fingerprints.stale_frames(plotdata, [0, 1], case) \
+            == [([2], [0, 1])]
+
+
+def test_archived_output(tmp_path, case):
+    import sweep_archive
+
+    plotdata = make_plotdata(tmp_path)
+    plot(plotdata, [0, 1], case)
+
+    # extracting an archived outdir changes the modification times only:
+    sweep_archive.archive_outdir(case['outdir'])
+    sweep_archive.extract_archive(case['outdir'])
+    assert frame_fingerprints.stale_frames(plotdata, [0, 1], case) == []
+
+    # new output of the same size:
+    (tmp_path / '_output' / 'fort.q0001').write_text('frame 9\n')
+    assert frame_fingerprints.stale_frames(plotdata, [0, 1], case) \
+            == [([1], [1])]
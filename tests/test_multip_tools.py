@@ -0,0 +1,327 @@
+import os
+
+import pytest
+
+import multip_tools
+import sweep_manifest
+import sweep_progress
+
+
+def run_one_case_touch(case):
+    """Record that the case was run by creating case['outdir']."""
+    os.mkdir(case['outdir'])
+
+
+def run_one_case_flaky(case):
+    """Fail the first case['failures'] times the case is run."""
+    attempts = case['outdir'] + '_attempts'
+    with open(attempts, 'a') as f:
+        f.write('attempt\n')
+    with open(attempts) as f:
+        num_attempts = len(f.readlines())
+    if num_attempts <= case['failures']:
+        raise RuntimeError('attempt %i of %s' % (num_attempts,
+                                                 case['case_name']))
+    return num_attempts
+
+
+def run_stage_touch(case):
+    """Run stage: create case['outdir'], or fail if case['fail_run']."""
+    if case.get('fail_run', False):
+        raise RuntimeError('run failed')
+    os.mkdir(case['outdir'])
+
+
+def plot_stage_touch(case):
+    """Plot stage: needs the output of the run stage."""
+    os.mkdir(os.path.join(case['outdir'], '_plots'))
+
+
+def run_one_case_sleep(case):
+    """Create case['outdir'] after sleeping case['sleep'] seconds."""
+    import time
+    time.sleep(case['sleep'])
+    os.mkdir(case['outdir'])
+
+
+def make_caselist(tmp_path, num_cases):
+    return [{'case_name': 'case%i' % i,
+             'outdir': str(tmp_path / ('_output_%i' % i))}
+            for i in range(num_cases)]
+
+
+def test_map_chunksize():
+    assert multip_tools._map_chunksize(0, 4) == 1
+    assert multip_tools._map_chunksize(1, 4) == 1
+    assert multip_tools._map_chunksize(16, 4) == 1
+    assert multip_tools._map_chunksize(17, 4) == 2
+    assert multip_tools._map_chunksize(100, 3) == 9
+
+
+def test_pool_keywords(tmp_path):
+    import inspect
+
+    parameters = inspect.signature(multip_tools.run_many_cases_pool).parameters
+    for name in ['schedule', 'retries', 'num_cores', 'backend', 'post_case',
+                 'status_file', 'on_result']:
+        assert name in parameters
+
+    finished = []
+    caselist = make_caselist(tmp_path, 3)
+    results = multip_tools.run_many_cases_pool(caselist, 2,
+                    run_one_case_touch, abort_time=0, schedule='dynamic',
+                    progress=False, on_result=finished.append)
+    assert [result['status'] for result in results] == ['done'] * 3
+    assert len(finished) == 3
+
+    with pytest.raises(TypeError, match='schedul'):
+        multip_tools.run_many_cases_pool(caselist, 2, run_one_case_touch,
+                                         abort_time=0, schedul='dynamic')
+
+
+def test_resume_runs_unfinished_cases(tmp_path):
+    manifest = str(tmp_path / 'sweep_manifest.db')
+    caselist = make_caselist(tmp_path, 4)
+    sweep_manifest.init_manifest(manifest, caselist)
+    sweep_manifest.set_case_state(manifest, caselist[0], 'done')
+    sweep_manifest.set_case_state(manifest, caselist[1], 'failed')
+    os.mkdir(caselist[1]['outdir'])
+
+    todo = sweep_manifest.unfinished_cases(manifest, caselist)
+    assert [case['case_name'] for case in todo] == ['case1', 'case2',
+                                                    'case3']
+
+    results = multip_tools.resume_many_cases_pool(caselist, 2,
+                    run_one_case_touch, manifest, abort_time=0,
+                    progress=False)
+    assert sorted([result['case_id'] for result in results]) \
+            == ['case1', 'case2', 'case3']
+    assert all([result['status'] == 'done' for result in results])
+    assert os.path.isdir(caselist[1]['outdir'] + '_partial')
+    assert not os.path.isdir(caselist[0]['outdir'])
+    states = sweep_manifest.read_manifest(manifest)
+    assert set([record['state'] for record in states.values()]) == {'done'}
+
+
+def test_resume_completed_sweep(tmp_path, monkeypatch):
+    manifest = str(tmp_path / 'sweep_manifest.db')
+    caselist = make_caselist(tmp_path, 3)
+    results = multip_tools.run_many_cases_pool(caselist, 2,
+                    run_one_case_touch, abort_time=0, manifest=manifest,
+                    progress=False)
+    assert [result['status'] for result in results] == ['done'] * 3
+
+    def sleep(seconds):
+        raise AssertionError('waited %s seconds with no cases' % seconds)
+
+    monkeypatch.setattr(multip_tools.time, 'sleep', sleep)
+    for schedule in ['static', 'dynamic']:
+        results = multip_tools.resume_many_cases_pool(caselist, 2,
+                        run_one_case_touch, manifest, abort_time=5,
+                        schedule=schedule, progress=False)
+        assert results == []
+
+    # no manifest is made for an empty sweep:
+    empty = str(tmp_path / 'empty_manifest.db')
+    assert multip_tools.run_many_cases_pool([], 2, run_one_case_touch,
+                                            manifest=empty) == []
+    assert not os.path.exists(empty)
+
+
+def test_progress_eta(monkeypatch):
+    now = [1000.]
+    monkeypatch.setattr(sweep_progress.time, 'time', lambda: now[0])
+    caselist = [{'case_name': 'case%i' % i} for i in range(4)]
+    tracker = sweep_progress.SweepProgress(caselist, 2, costs=[4, 2, 1, 1],
+                                           verbose=False)
+    assert tracker.status()['eta_seconds'] is None
+
+    for index in [0, 1]:
+        tracker.started({'index': index})
+    now[0] = 1040.
+    tracker.finished({'index': 0, 'status': 'done', 'elapsed': 40.})
+    tracker.started({'index': 2})
+    now[0] = 1050.
+    status = tracker.status()
+    # 10 s per unit of cost and cost 4 left, but cases 1 and 2 have
+    # already run 50 + 10 s:
+    assert status['eta_seconds'] == 0.
+    assert status['running'] == 2 and status['waiting'] == 1
+
+    now[0] = 1060.
+    tracker.finished({'index': 1, 'status': 'failed', 'elapsed': 60.})
+    status = tracker.status()
+    # 100 s for cost 6, cost 2 left, case 2 has run 20 s, 2 cases left:
+    assert abs(status['eta_seconds'] - (2 * 100. / 6 - 20.) / 2) < 1e-9
+    assert status['failed'] == 1 and status['failed_cases'] == ['case1']
+
+    for index in [2, 3]:
+        tracker.finished({'index': index, 'status': 'done', 'elapsed': 5.})
+    status = tracker.status()
+    assert status['complete'] and status['eta_seconds'] == 0.
+
+
+class ImmediatePool:
+    """Stand-in for a Pool that completes each task as it is handed out."""
+
+    def __init__(self):
+        self.started = []
+
+    def apply_async(self, func, args, callback, error_callback):
+        task = args[0]
+        self.started.append(task)
+        callback({'index': task['index'], 'cores': task.get('cores', [])})
+
+
+def test_adaptive_threads():
+    tasks = [{'index': i, 'case': {'num_threads': 1}} for i in range(4)]
+    pool = ImmediatePool()
+    results = list(multip_tools._dispatch_dynamic(pool, tasks, 2,
+                        cores=list(range(8)), pin_cores=False,
+                        adaptive_threads=True))
+    assert len(results) == 4
+    # the first two tasks share all 8 cores, since only 2 can run at once:
+    assert [task['num_threads'] for task in pool.started[:2]] == [4, 4]
+
+
+def test_backfill_reserves_cores():
+    # a case needing all 4 cores behind a stream of 1-core cases:
+    tasks = [{'index': i, 'case': {'num_threads': 4 if i == 1 else 1}}
+             for i in range(10)]
+    pool = ImmediatePool()
+    results = list(multip_tools._dispatch_dynamic(pool, tasks, 4,
+                        cores=list(range(4)), pin_cores=False))
+    assert sorted([result['index'] for result in results]) == list(range(10))
+    # 4 cases are started ahead of it, then its cores are kept free:
+    assert [task['index'] for task in pool.started] \
+            == [0, 2, 3, 4, 5, 1, 6, 7, 8, 9]
+
+
+def test_dynamic_longest_first(tmp_path):
+    caselist = make_caselist(tmp_path, 4)
+    for case, cost in zip(caselist, [1, 4, 2, 3]):
+        case['cost'] = cost
+    finished = []
+    multip_tools.run_many_cases_pool(caselist, 1, run_one_case_touch,
+                    abort_time=0, schedule='dynamic', progress=False,
+                    case_cost=lambda case: case['cost'],
+                    on_result=finished.append)
+    # one process, so the cases finish in the order they are started:
+    assert [result['case_id'] for result in finished] \
+            == ['case1', 'case3', 'case2', 'case0']
+
+    # more cells, higher order and more output times cost more:
+    cost = multip_tools.default_case_cost
+    assert cost({'mx': 200}) > cost({'mx': 100})
+    assert cost({'mx': 100, 'order': 2}) > cost({'mx': 100, 'order': 1})
+    assert cost({'mx': 100, 'num_output_times': 10}) > cost({'mx': 100})
+    assert cost({'mx': 100, 'my': 100}) > cost({'mx': 200})
+
+
+@pytest.mark.parametrize('schedule', ['static', 'dynamic'])
+def test_retries(tmp_path, schedule):
+    caselist = make_caselist(tmp_path, 3)
+    for case, failures in zip(caselist, [0, 1, 5]):
+        case['failures'] = failures
+    results = multip_tools.run_many_cases_pool(caselist, 2,
+                    run_one_case_flaky, abort_time=0, schedule=schedule,
+                    retries=1, progress=False)
+
+    assert [result['index'] for result in results] == [0, 1, 2]
+    assert [result['status'] for result in results] \
+            == ['done', 'done', 'failed']
+    assert [result['attempts'] for result in results] == [1, 2, 2]
+    assert [result['value'] for result in results] == [1, 2, None]
+    # the exception of a case that succeeded on retry is not kept:
+    assert results[1]['exception'] is None
+    assert results[2]['exception'] \
+            == repr(RuntimeError('attempt 2 of case2'))
+    assert 'RuntimeError: attempt 2 of case2' in results[2]['traceback']
+
+    with pytest.raises(RuntimeError, match='1 of 3 cases failed: case2'):
+        multip_tools.run_many_cases_pool(caselist, 2, run_one_case_flaky,
+                        abort_time=0, schedule=schedule, on_error='raise',
+                        progress=False)
+
+
+def test_pipeline(tmp_path):
+    caselist = make_caselist(tmp_path, 4)
+    caselist[2]['fail_run'] = True
+    run_results, plot_results = multip_tools.run_many_cases_pipeline(
+                    caselist, 2, 2, run_stage_touch, plot_stage_touch,
+                    abort_time=0)
+
+    assert [result['status'] for result in run_results] \
+            == ['done', 'done', 'failed', 'done']
+    # the plot stage of each case ran after its run stage, and not at all
+    # if the run stage failed:
+    assert plot_results[2] is None
+    for i in [0, 1, 3]:
+        assert plot_results[i]['status'] == 'done'
+        assert plot_results[i]['index'] == i
+        assert os.path.isdir(os.path.join(caselist[i]['outdir'], '_plots'))
+
+    with pytest.raises(RuntimeError, match='stages failed'):
+        multip_tools.run_many_cases_pipeline(caselist[2:3], 1, 1,
+                    run_stage_touch, plot_stage_touch, abort_time=0,
+                    on_error='raise')
+
+
+def metric_value(case):
+    """The metric of a case run by run_one_case_touch."""
+    assert os.path.isdir(case['outdir'])
+    return case['value']
+
+
+def test_refinement_ladders(tmp_path):
+    caselist = make_caselist(tmp_path, 8)
+    # two ladders, the first converges on its third level:
+    for case, order, mx, value in zip(caselist, [1]*4 + [2]*4,
+                                      [10, 20, 40, 80]*2,
+                                      [1., .5, .45, .449, 1., .5, .2, 0.]):
+        case.update({'order': order, 'mx': mx, 'value': value})
+    ladders = multip_tools.refinement_ladders(caselist, group_by=['order'])
+    assert [[case['case_name'] for case in ladder] for ladder in ladders] \
+            == [['case0', 'case1', 'case2', 'case3'],
+                ['case4', 'case5', 'case6', 'case7']]
+
+    results, summaries = multip_tools.run_refinement_ladders(ladders, 2,
+                    run_one_case_touch, metric_value, tol=0.1, abort_time=0)
+
+    assert [result['status'] for result in results] \
+            == ['done']*3 + ['skipped'] + ['done']*4
+    assert not os.path.exists(caselist[3]['outdir'])
+    assert summaries[0]['converged'] and summaries[0]['skipped'] == ['case3']
+    assert summaries[0]['case_ids'] == ['case0', 'case1', 'case2']
+    assert abs(summaries[0]['changes'][-1] - 0.05) < 1e-12
+    assert not summaries[1]['converged'] and summaries[1]['skipped'] == []
+
+
+def test_stopped_sweep(tmp_path):
+    import multiprocessing
+
+    manifest = str(tmp_path / 'sweep_manifest.db')
+    caselist = make_caselist(tmp_path, 3)
+    for case, sleep in zip(caselist, [0, 5, 0]):
+        case['sleep'] = sleep
+
+    def on_result(result):
+        import time
+        # stop once case1 has started:
+        while sweep_manifest.read_manifest(manifest)['case1']['state'] \
+                != 'running':
+            time.sleep(0.01)
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        multip_tools.run_many_cases_pool(caselist, 2, run_one_case_sleep,
+                        abort_time=0, manifest=manifest, progress=False,
+                        post_case=run_one_case_touch, on_result=on_result)
+
+    # case1 was running, case2 had not started:
+    states = sweep_manifest.read_manifest(manifest)
+    assert [states[case['case_name']]['state'] for case in caselist] \
+            == ['done', 'failed', 'pending']
+    assert 'KeyboardInterrupt' in states['case1']['message']
+    # no worker processes are left, including those of post_case:
+    assert multiprocessing.active_children() == []
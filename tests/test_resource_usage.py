@@ -0,0 +1,39 @@
+import subprocess, sys
+
+import pytest
+
+import resource_usage
+
+
+def test_case_usage():
+    record = {'usage': {
+        'setrun': {'wall': 0.5, 'user': 0.25, 'sys': 0.125,
+                   'maxrss_mb': 80., 'bytes_written': 1000},
+        'runclaw': {'wall': 10., 'user': 0.5, 'sys': 0.25,
+                    'maxrss_mb': 90., 'child_maxrss_mb': 200.,
+                    'bytes_written': 5000},
+        'plot': {'wall': 2., 'user': 1.5, 'sys': 0.5, 'maxrss_mb': 250.}}}
+
+    total = resource_usage.case_usage(record)
+
+    assert total['wall'] == pytest.approx(12.5)
+    assert total['user'] == pytest.approx(2.25)
+    assert total['sys'] == pytest.approx(0.875)
+    assert total['bytes_written'] == 6000
+    # the child runs while this process holds its memory:
+    assert total['maxrss_mb'] == pytest.approx(290.)
+
+    assert resource_usage.case_usage({'case_name': 'not run'}) \
+            == {'wall': 0., 'user': 0., 'sys': 0., 'maxrss_mb': 0.,
+                'bytes_written': 0}
+
+
+def test_phase_with_child():
+    usage = {}
+    with resource_usage.Phase(usage, 'runclaw', children=True):
+        subprocess.check_call([sys.executable, '-c',
+                               'import time; time.sleep(0.3)'])
+
+    assert usage['runclaw']['wall'] >= 0.3
+    assert usage['runclaw']['maxrss_mb'] > 0
+    assert set(['user', 'sys']) <= set(usage['runclaw'])
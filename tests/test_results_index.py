@@ -0,0 +1,45 @@
+import json, os
+
+import results_index
+
+
+def test_update_record_without_record(tmp_path):
+    index_dir = str(tmp_path / '_case_index')
+    case = {'case_name': 'mx100', 'mx': 100, 'outdir': '_output_mx100'}
+
+    # e.g. a plot stage of a case run before the index was used:
+    results_index.update_record(index_dir, 'mx100',
+                                {'plot_status': 'done',
+                                 'timings': {'plot_time': 1.5}}, case)
+    results_index.update_record(index_dir, 'other', {'plot_status': 'done'})
+
+    record = results_index.read_record(index_dir, 'mx100')
+    assert record['status'] is None
+    assert record['params']['mx'] == 100
+    assert record['outdir'] == '_output_mx100'
+    assert record['timings'] == {'plot_time': 1.5}
+
+    assert [r['case_name'] for r in results_index.query(index_dir,
+                                                        mx=100)] == ['mx100']
+    assert results_index.query(index_dir, status='done') == []
+    fname = str(tmp_path / 'case_summary.txt')
+    results_index.write_summary(index_dir, fname)
+    with open(fname) as f:
+        summary = f.read()
+    assert 'plot_time' in summary and 'other' in summary
+
+
+def test_query_bare_records(tmp_path):
+    # records written by update_record before it made complete ones:
+    index_dir = str(tmp_path / '_case_index')
+    os.makedirs(index_dir)
+    with open(results_index.record_file(index_dir, 'old'), 'w') as f:
+        json.dump({'case_name': 'old', 'plot_status': 'done'}, f)
+    results_index.write_record(index_dir,
+                results_index.new_record({'case_name': 'new', 'mx': 50}))
+
+    assert [r['case_name'] for r in results_index.query(index_dir,
+                                                        mx=50)] == ['new']
+    assert [r['case_name'] for r in results_index.query(index_dir,
+                                            status='running')] == ['new']
+    results_index.write_summary(index_dir, str(tmp_path / 'summary.txt'))
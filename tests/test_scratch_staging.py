@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+import scratch_staging
+
+
+def make_dir(path, fnames):
+    os.makedirs(str(path))
+    for fname in fnames:
+        (path / fname).write_text(fname)
+
+
+@pytest.mark.parametrize('rsync', [True, False])
+def test_move_dir_replaces_old_output(tmp_path, monkeypatch, rsync):
+    if not rsync:
+        monkeypatch.setattr(scratch_staging.shutil, 'which',
+                            lambda cmd: None)
+    elif scratch_staging.shutil.which('rsync') is None:
+        pytest.skip('rsync is not available')
+
+    # an earlier run with more frames:
+    dst = tmp_path / 'shared' / '_output'
+    make_dir(dst, ['fort.q%s' % str(n).zfill(4) for n in range(6)])
+    make_dir(dst / '_plots', ['frame0005fig1.png'])
+
+    src = tmp_path / 'scratch' / 'outdir'
+    make_dir(src, ['fort.q0000', 'fort.q0001', 'claw.data'])
+
+    scratch_staging.move_dir(str(src), str(dst))
+
+    assert not os.path.exists(str(src))
+    assert sorted(os.listdir(str(dst))) == ['claw.data', 'fort.q0000',
+                                            'fort.q0001']
+    assert sorted(os.listdir(str(dst.parent))) == ['_output']
+    assert (dst / 'fort.q0001').read_text() == 'fort.q0001'
@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pytest
+
+import sweep_archive
+import sweep_data
+from frame_files import write_frame
+
+
+@pytest.mark.parametrize('codec', ['store', 'deflate'])
+@pytest.mark.parametrize('output_format', ['ascii', 'binary64'])
+def test_read_frame_from_archive(tmp_path, codec, output_format):
+    outdir = str(tmp_path / '_output')
+    os.mkdir(outdir)
+    q = np.array([np.linspace(0., 1., 10), np.linspace(2., 3., 10)])
+    for frameno in range(3):
+        write_frame(outdir, frameno, 0.5*frameno, q + frameno, output_format)
+    expected = [sweep_data.read_frame(outdir, frameno)
+                for frameno in range(3)]
+
+    archive = sweep_archive.archive_outdir(outdir, codec)
+    assert archive == outdir + '.zip'
+    assert not os.path.exists(outdir)
+    assert sweep_archive.archive_codec(archive) == codec
+
+    assert sweep_data.frame_numbers(outdir) == [0, 1, 2]
+    for frameno in range(3):
+        frame = sweep_data.read_frame(outdir, frameno)
+        assert frame['t'] == expected[frameno]['t'] == 0.5*frameno
+        assert frame['output_format'] == output_format
+        assert np.allclose(frame['patches'][0]['q'], q + frameno)
+        assert np.array_equal(frame['patches'][0]['q'],
+                              expected[frameno]['patches'][0]['q'])
+
+    # and back again:
+    sweep_archive.extract_archive(outdir)
+    assert sorted(os.listdir(outdir)) == sorted(
+            ['fort.t%04i' % n for n in range(3)]
+            + ['fort.q%04i' % n for n in range(3)]
+            + (['fort.b%04i' % n for n in range(3)]
+               if output_format != 'ascii' else []))
+
+
+def test_extract_restores_mtimes(tmp_path):
+    outdir = str(tmp_path / '_output')
+    os.mkdir(outdir)
+    write_frame(outdir, 0, 0., np.ones((1, 5)), 'ascii')
+    fname = os.path.join(outdir, 'fort.q0000')
+    os.utime(fname, (1.6e9, 1.6e9))
+    mtimes = dict([(name, os.path.getmtime(os.path.join(outdir, name)))
+                   for name in os.listdir(outdir)])
+
+    sweep_archive.archive_outdir(outdir)
+    sweep_archive.extract_archive(outdir)
+
+    for name, mtime in mtimes.items():
+        # zip files record times to 2 seconds:
+        assert abs(os.path.getmtime(os.path.join(outdir, name)) - mtime) <= 2
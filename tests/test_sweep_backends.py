@@ -0,0 +1,142 @@
+import os, sys, signal, socket, subprocess, textwrap
+
+import pytest
+
+import multip_tools
+import sweep_backends
+
+# run_one_case must be importable by the workers, which add the working
+# directory of the coordinator to sys.path:
+cases_module = textwrap.dedent('''
+    import os, time
+
+    def run_one_case_logged(case):
+        with open(case['log'], 'a') as f:
+            f.write('%s %i\\n' % (case['case_name'], os.getpid()))
+        time.sleep(0.3)
+        return os.getpid()
+    ''')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def start_workers(tmp_path, port, nprocs_per_group):
+    """
+    Start a group of worker processes for each number in *nprocs_per_group*,
+    as if on different nodes.
+    """
+
+    groups = []
+    for nprocs in nprocs_per_group:
+        log = open(str(tmp_path / ('workers%i.log' % len(groups))), 'w')
+        groups.append(subprocess.Popen([sys.executable,
+                                        sweep_backends.__file__, 'worker',
+                                        'localhost', str(port), str(nprocs)],
+                                       stdout=log, stderr=subprocess.STDOUT,
+                                       start_new_session=True))
+    return groups
+
+
+def stop_workers(groups):
+    for group in groups:
+        # the worker processes as well as the process that started them:
+        os.killpg(group.pid, signal.SIGTERM)
+        group.wait()
+
+
+@pytest.fixture
+def workers(tmp_path, monkeypatch):
+    """
+    Start 3 worker processes on this machine, in two groups as if on two
+    nodes, and return the port of the coordinator they connect to.
+    """
+
+    monkeypatch.setenv(sweep_backends.authkey_variable, 'test-authkey')
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'sweep_test_cases.py').write_text(cases_module)
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    port = free_port()
+    groups = start_workers(tmp_path, port, [2, 1])
+    yield port
+    stop_workers(groups)
+
+
+@pytest.mark.parametrize('schedule', ['static', 'dynamic'])
+def test_tcp_backend(tmp_path, workers, schedule):
+    import sweep_test_cases
+
+    log = str(tmp_path / ('cases_%s.log' % schedule))
+    caselist = [{'case_name': 'case%i' % i, 'log': log} for i in range(9)]
+    backend = sweep_backends.tcp_backend(address=('localhost', workers))
+
+    results = multip_tools.run_many_cases_pool(caselist, 3,
+                    sweep_test_cases.run_one_case_logged, abort_time=0,
+                    schedule=schedule, backend=backend, progress=False)
+
+    assert [result['case_id'] for result in results] \
+            == [case['case_name'] for case in caselist]
+    assert [result['status'] for result in results] == ['done'] * 9
+
+    # each case was run exactly once, and not all by the same worker:
+    with open(log) as f:
+        runs = [line.split() for line in f]
+    assert sorted([case_name for case_name, pid in runs]) \
+            == sorted([case['case_name'] for case in caselist])
+    pids = set([int(pid) for case_name, pid in runs])
+    assert pids == set([result['value'] for result in results])
+    assert 2 <= len(pids) <= 3
+
+
+def test_task_taken_but_not_started(tmp_path, monkeypatch):
+    monkeypatch.setenv(sweep_backends.authkey_variable, 'test-authkey')
+    monkeypatch.chdir(tmp_path)
+    port = free_port()
+    backend = sweep_backends.tcp_backend(address=('localhost', port),
+                                         lost_after=1.)
+    groups = []
+    with backend(processes=1) as pool:
+        result = pool.apply_async(pow, (2, 10))
+
+        # a worker that takes the task and dies before starting it:
+        manager = sweep_backends._SweepManager(address=('localhost', port),
+                                               authkey=b'test-authkey')
+        manager.connect()
+        task = manager.get_task_queue().get(timeout=10)
+        assert task[0] == 0
+
+        groups = start_workers(tmp_path, port, [1])
+        try:
+            assert result.get(timeout=60) == 1024
+        finally:
+            stop_workers(groups)
+
+
+def test_lost_queues(monkeypatch):
+    monkeypatch.setenv(sweep_backends.authkey_variable, 'test-authkey')
+    backend = sweep_backends.tcp_backend(address=('localhost', free_port()))
+    with backend(processes=1) as pool:
+        results = [pool.apply_async(pow, (2, n)) for n in range(3)]
+        # e.g. the manager process was killed:
+        pool._manager.shutdown()
+        for result in results:
+            with pytest.raises(RuntimeError, match='Lost the connection'):
+                result.get(timeout=30)
+
+
+def start_pool(n):
+    import multiprocessing
+    with multiprocessing.Pool(n) as pool:
+        return pool.map(abs, range(-n, 0))
+
+
+def test_local_backends():
+    with sweep_backends.local_backend(processes=1) as pool:
+        with pytest.raises(AssertionError):
+            pool.apply(start_pool, (2,))
+    with sweep_backends.nested_backend(processes=1) as pool:
+        assert pool.apply(start_pool, (2,)) == [2, 1]
@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+
+import sweep_data
+from frame_files import write_frame
+
+
+def make_sweep(tmp_path, mxs):
+    caselist = []
+    for mx in mxs:
+        outdir = str(tmp_path / ('_output_mx%i' % mx))
+        os.mkdir(outdir)
+        for frameno in [0, 1]:
+            write_frame(outdir, frameno, 0.5*frameno,
+                        np.full((1, mx), float(frameno)), 'ascii')
+        caselist.append({'case_name': 'mx%i' % mx, 'mx': mx,
+                         'outdir': outdir})
+    return caselist
+
+
+def test_dataset_cache(tmp_path):
+    ds = sweep_data.SweepDataset(make_sweep(tmp_path, [10, 20, 40]),
+                                 cache_size=2)
+    assert ds.values('mx') == [10, 20, 40]
+    assert ds.q(1, mx=20).shape == (1, 20)
+
+    frame = ds.frame(0, 'mx10')
+    ds.frame(0, 'mx20')
+    # reading mx10 again makes mx20 the least recently used:
+    assert ds.frame(0, 'mx10') is frame
+    ds.frame(0, 'mx40')
+    assert list(ds._cache.keys()) == [('mx10', 0), ('mx40', 0)]
+    assert ds.frame(0, 'mx10') is frame
+
+    # a selection shares the cache:
+    ds2 = ds.select(mx=[20, 40])
+    assert ds2.case_names == ['mx20', 'mx40']
+    ds2.frame(0, 'mx20')
+    assert list(ds._cache.keys()) == [('mx10', 0), ('mx20', 0)]
+    assert [case['mx'] for case, frame in ds2.iter_frames(1)] == [20, 40]
+    assert len(ds._cache) == 2
+
+
+def test_read_frame_recorded_format(tmp_path):
+    outdir = str(tmp_path)
+    q = np.array([np.linspace(0., 1., 10)])
+
+    # e.g. the classic 1d code, which always writes ascii, with
+    # case['output_format'] = 'binary':
+    write_frame(outdir, 0, 0., q, 'ascii')
+    frame = sweep_data.read_frame(outdir, 0, 'binary')
+    assert frame['output_format'] == 'ascii'
+    assert np.allclose(frame['patches'][0]['q'], q)
+
+    # binary output read as ascii:
+    write_frame(outdir, 1, 0.5, 2*q, 'binary64')
+    frame = sweep_data.read_frame(outdir, 1, 'ascii')
+    assert frame['output_format'] == 'binary64'
+    assert np.allclose(frame['patches'][0]['q'], 2*q)
+
+    # recorded as an integer by some versions of Clawpack:
+    fname = os.path.join(outdir, 'fort.t0001')
+    with open(fname) as f:
+        text = f.read().replace('binary64', '3')
+    with open(fname, 'w') as f:
+        f.write(text)
+    assert sweep_data.read_frame(outdir, 1)['output_format'] == 'binary64'
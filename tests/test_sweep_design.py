@@ -0,0 +1,59 @@
+import sweep_design
+
+
+def make_case(point):
+    case = dict(point)
+    case['case_name'] = sweep_design.case_name(point)
+    case['outdir'] = '_output_' + case['case_name']
+    return case
+
+
+def test_adaptive_sweep_failing_point():
+    space = {'x': (0., 1.)}
+    runs = []
+
+    def run_cases(caselist):
+        # the case at the middle of the range always fails:
+        runs.extend([case['x'] for case in caselist])
+        return [{'status': 'failed' if case['x'] == 0.5 else 'done'}
+                for case in caselist]
+
+    caselist, values = sweep_design.adaptive_sweep(space, make_case,
+                            run_cases, lambda case: case['x']**2,
+                            points=[{'x': 0.}, {'x': 1.}], num_new=1,
+                            max_cases=10)
+
+    # the failed point is run once and not proposed again:
+    assert runs == [0., 1., 0.5]
+    assert [case['x'] for case in caselist] == [0., 1.]
+    assert values == [0., 1.]
+
+
+def test_adaptive_sweep_counts_failed_cases():
+    space = {'x': (0., 1.)}
+    runs = []
+
+    def run_cases(caselist):
+        runs.extend([case['x'] for case in caselist])
+
+    def metric(case):
+        # only the first two cases have a value:
+        if case['x'] not in [0., 1.]:
+            raise ValueError('no output')
+        return case['x']
+
+    caselist, values = sweep_design.adaptive_sweep(space, make_case,
+                            run_cases, metric,
+                            points=[{'x': 0.}, {'x': 0.25}, {'x': 1.}],
+                            num_new=1, max_cases=3)
+
+    assert runs == [0., 0.25, 1.]
+    assert [case['x'] for case in caselist] == [0., 1.]
+
+
+def test_refine_skips_failed_points():
+    space = {'x': (0., 1.)}
+    cases = [{'x': 0.}, {'x': 1.}]
+    assert sweep_design.refine(cases, [0., 1.], space, 1) == [{'x': 0.5}]
+    assert sweep_design.refine(cases, [0., 1.], space, 1,
+                               failed=[{'x': 0.5}]) == []